@@ -0,0 +1,13 @@
+#!/usr/bin/env python2
+# encoding: utf-8
+"""Print how a night was spent (open shutter vs. overheads) from a sop ledger file."""
+
+from __future__ import absolute_import, division, print_function
+
+import sys
+
+from sopActor.utils.efficiency import main
+
+
+if __name__ == '__main__':
+    sys.exit(main())
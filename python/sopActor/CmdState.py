@@ -9,6 +9,7 @@ Hold state about running commands, e.g. 'running', 'done', 'failed', ...
 Also hold keywords for those commands as we pass them around.
 """
 
+import time
 from time import sleep
 
 import sopActor
@@ -56,6 +57,10 @@ class CmdState(object):
     validStageStates = ('prepping', 'running', 'done', 'failed', 'aborted', 'pending', 'off',
                         'idle')
 
+    # Non-keyword attributes that hold the progress of a sequence: if set, the
+    # sequence is checkpointed and can be resumed after an actor restart.
+    checkpointAttrs = ()
+
     def __init__(self, name, allStages, keywords={}, hiddenKeywords=()):
         """
         Specify keywords with their default values: these will both be output automatically
@@ -101,6 +106,7 @@ class CmdState(object):
 
     def setStages(self, allStages):
         """Set the list of stages that are applicable, and make them idle."""
+        self.stageStartTimes = {}
         self.allStages = allStages
         self.stages = dict(zip(allStages, ['idle'] * len(allStages)))
         self.activeStages = allStages
@@ -143,6 +149,34 @@ class CmdState(object):
         if genKeys:
             self.genKeys()
 
+        if state == 'running':
+            self.startTime = time.time()
+        elif state in ('done', 'failed', 'aborted'):
+            self.endTime = time.time()
+            if state == 'done' and getattr(self, 'startTime', None) is not None:
+                self._measure('command.%s' % self.name, self.endTime - self.startTime)
+            params = dict((k, getattr(self, k)) for k in self.keywords)
+            params.update(state=state, stateText=self.stateText)
+            self._record('command', self.name, getattr(self, 'startTime', None), state == 'done',
+                         params)
+
+        if state == 'done':
+            checkpoints = getattr(myGlobals.actorState, 'checkpoints', None)
+            if self.checkpointAttrs and checkpoints is not None:
+                checkpoints.clear(self.name)
+
+        if state in ('done', 'failed', 'aborted'):
+            commandQueue = getattr(myGlobals.actorState, 'commandQueue', None)
+            if commandQueue is not None:
+                commandQueue.command_finished(self, state)
+
+        slewWhenReady = getattr(myGlobals.actorState, 'slewWhenReady', None)
+        if slewWhenReady is not None:
+            slewWhenReady.state_changed()
+
+        if state in ('done', 'failed', 'aborted'):
+            self.update_plan()
+
     def setStageState(self, name, stageState, genKeys=True):
         """Set a stage to a new state, and output the stage state keys."""
         assert name in self.stages, 'stage %s is unknown, out of %s' % (name, repr(self.stages))
@@ -150,9 +184,95 @@ class CmdState(object):
             'state %s is unknown, out of %s' % (stageState, repr(self.validStageStates))
         self.stages[name] = stageState
 
+        if stageState == 'running':
+            self.stageStartTimes[name] = time.time()
+        elif stageState in ('done', 'failed', 'aborted') and name in self.stageStartTimes:
+            start = self.stageStartTimes.pop(name)
+            if stageState == 'done':
+                self._measure('stage.%s.%s' % (self.name, name), time.time() - start)
+            self._record('stage', '%s.%s' % (self.name, name), start, stageState == 'done',
+                         dict(state=stageState))
+            self.update_plan()
+
         if genKeys:
             self.genCmdStateKeys()
 
+    def checkpoint(self):
+        """
+        Save the progress of this sequence, so it can be resumed after an actor
+        restart. Called after each exposure; a failure to save is only warned about.
+        """
+        checkpoints = getattr(myGlobals.actorState, 'checkpoints', None)
+        if not self.checkpointAttrs or checkpoints is None or not checkpoints.enabled:
+            return
+        if self.aborted:
+            return  # abort() truncates the sequence: keep the progress before it.
+        try:
+            checkpoints.save(self.name, getattr(myGlobals.actorState, 'cartridge', None),
+                             dict((k, getattr(self, k)) for k in self.keywords),
+                             dict((k, getattr(self, k)) for k in self.checkpointAttrs
+                                  if hasattr(self, k)))
+        except (IOError, OSError) as e:
+            self._getCmd().warn('text="Could not save the %s checkpoint: %s"' % (self.name, e))
+
+    def resume(self):
+        """
+        Restore the progress saved by checkpoint(), if it was taken with the
+        cartridge that is loaded. Return None if resumed, else why not.
+        """
+        checkpoints = getattr(myGlobals.actorState, 'checkpoints', None)
+        if not self.checkpointAttrs:
+            return '%s cannot be resumed.' % self.name
+        saved = checkpoints.load(self.name) if checkpoints is not None else None
+        if saved is None:
+            return 'There is no %s checkpoint to resume from.' % self.name
+        cartridge = getattr(myGlobals.actorState, 'cartridge', None)
+        if saved['cartridge'] != cartridge:
+            return ('The %s checkpoint was taken with cartridge %s, but cartridge %s is loaded.' %
+                    (self.name, saved['cartridge'], cartridge))
+        for k, v in saved['keywords'].items():
+            if k in self.keywords:
+                setattr(self, k, v)
+        for k, v in saved['state'].items():
+            if k in self.checkpointAttrs:
+                setattr(self, k, v)
+        self.update_etr()
+        return None
+
+    def update_plan(self):
+        """Update the observing plan of the loaded cartridge with our progress."""
+        plan = getattr(myGlobals.actorState, 'plan', None)
+        if plan is not None:
+            plan.update()
+
+    @staticmethod
+    def _measure(name, duration):
+        """Record how long a command or stage took, for the observing plan."""
+        metrics = getattr(myGlobals.actorState, 'metrics', None)
+        if metrics is not None:
+            metrics.record(name, duration)
+
+    def readout_overhead(self):
+        """
+        Return the measured BOSS flush and readout time, or readout_time until
+        measured. The measured time is only used with the observing plan enabled.
+        """
+        plan = getattr(myGlobals.actorState, 'plan', None)
+        if plan is None or not plan.enabled:
+            return self.readout_time
+        metrics = getattr(myGlobals.actorState, 'metrics', None)
+        read = metrics.mean('boss.read') if metrics is not None else None
+        if read is None:
+            return self.readout_time
+        return metrics.mean('boss.flush', 0.) + read
+
+    def _record(self, kind, name, start, success, params):
+        """Record a finished command or stage in the ledger."""
+        ledger = getattr(myGlobals.actorState, 'ledger', None)
+        if ledger is not None:
+            ledger.record_state(myGlobals.actorState, kind, name, start, time.time(), success,
+                                thread='master', params=params)
+
     def genCmdStateKeys(self, cmd=None):
         cmd = self._getCmd(cmd)
         cmd.inform('%sState=%s,%s,%s' % (self.name, qstr(self.cmdState),
@@ -214,12 +334,24 @@ class CmdState(object):
     def took_exposure(self):
         """Update keys after an exposure and output them."""
         self.index += 1
+        self.checkpoint()
+        self.update_plan()
         self.genKeys()
 
     def update_etr(self):
         ''' Update the estimate time remaining for sequences '''
         pass
 
+    def update_etr_from_reads(self, elapsed, cmd=None):
+        '''
+        Update the etr with the time already spent on the current exposures,
+        as measured from the APOGEE reads, and output it.
+        '''
+        self.update_etr()
+        self.etr = max(self.etr - elapsed / 60., 0.)
+        cmd = self._getCmd(cmd)
+        cmd.inform('{0}_etr={1:.1f},{2}'.format(self.name, self.etr, self.keywords.get('etr')))
+
     def isSlewingDisabled_BOSS(self):
         """Return False if the BOSS state is safe to start a slew."""
         safe_state = ('READING', 'IDLE', 'DONE', 'ABORTED')
@@ -255,6 +387,9 @@ class CmdState(object):
         for s in self.activeStages:
             if not self.stages[s] in ('done', 'failed', 'off'):
                 self.stages[s] = 'aborted'
+                if s in self.stageStartTimes:
+                    self._record('stage', '%s.%s' % (self.name, s), self.stageStartTimes.pop(s),
+                                 False, dict(state='aborted'))
         self.genCmdStateKeys()
 
     def stop_boss_exposure(self, wait=False, clear_queue=False):
@@ -265,9 +400,10 @@ class CmdState(object):
         force_readout : bool
             If set, makes sure the exposure has been read.
         clear_queue : bool
-            If set, removes all messages from the BOSS queue. This is useful
-            if multiple exposures have been queued and we want to cancel all
-            of them, not only the current one.
+            If set, removes all pending exposures from the BOSS queue. This is
+            useful if multiple exposures have been queued and we want to cancel
+            all of them, not only the current one. The boss thread does the
+            clearing itself, since it keeps serving its queue while exposing.
 
         """
 
@@ -281,20 +417,16 @@ class CmdState(object):
                 # to pass.
 
                 cmd.warn('text="clearing BOSS queue."')
-
-                boss_queue = actorState.queues[sopActor.BOSS_ACTOR]
-                while not boss_queue.empty():
-                    try:
-                        msg = boss_queue.get(False)
-                        msg.replyQueue.put(sopActor.Msg.REPLY, cmd=cmd, success=False)
-                        boss_queue.task_done()
-                    except boss_queue.Empty:
-                        continue
+                actorState.queues[sopActor.BOSS_ACTOR].put(
+                    sopActor.Msg.STOP_EXPOSURE,
+                    cmd,
+                    clear_queue=True,
+                    priority=sopActor.Msg.CRITICAL)
 
         # The same states we cannot slew during are the states we can't abort from.
         if self.isSlewingDisabled_BOSS()[0]:
             cmd.warn('text="Will cancel pending BOSS exposures and stop any running one."')
-            call = myGlobals.actorState.actor.cmdr.call
+            call = myGlobals.actorState.gateway.call
             cmdVar = call(actor='boss', forUserCmd=cmd, cmdStr='exposure stop')
             if cmdVar.didFail:
                 cmd.warn('text="Failed to stop running BOSS exposure"')
@@ -311,7 +443,7 @@ class CmdState(object):
         """Abort any currently running APOGEE exposure."""
         cmd = self._getCmd()
         cmd.warn('text="Will cancel pending APOGEE exposures and stop any running one."')
-        call = myGlobals.actorState.actor.cmdr.call
+        call = myGlobals.actorState.gateway.call
         cmdVar = call(actor='apogee', forUserCmd=cmd, cmdStr='expose stop')
         if cmdVar.didFail:
             cmd.warn('text="Failed to stop running APOGEE exposure"')
@@ -319,7 +451,7 @@ class CmdState(object):
     def stop_tcc(self):
         """Stop current TCC motion."""
         cmd = self._getCmd()
-        cmdVar = myGlobals.actorState.actor.cmdr.call(
+        cmdVar = myGlobals.actorState.gateway.call(
             actor='tcc', forUserCmd=cmd, cmdStr='track /stop', timeLim=1)
         if cmdVar.didFail:
             cmd.warn('text="Failed to abort slew"')
@@ -328,7 +460,7 @@ class CmdState(object):
         """Aborts the hartmanns."""
 
         cmd = self._getCmd()
-        call = myGlobals.actorState.actor.cmdr.call
+        call = myGlobals.actorState.gateway.call
         cmdVar = call(actor='hartmann', forUserCmd=cmd, cmdStr='abort')
         if cmdVar.didFail:
             cmd.warn('text="Failed to abort hartmann."')
@@ -410,6 +542,26 @@ class CollimateBossCmd(CmdState):
         CmdState.__init__(self, 'collimateBoss', ['collimate', 'cleanup'])
 
 
+class DitheredFlatCmd(CmdState):
+
+    def __init__(self):
+        CmdState.__init__(
+            self,
+            'ditheredFlat', ['lamps', 'flats', 'cleanup'],
+            keywords=dict(expTime=30.0, nStep=22, nTick=62))
+
+    def reset_nonkeywords(self):
+        self.spN = ['sp1', 'sp2']
+        self.nFlatDone = 0
+
+    def getUserKeys(self):
+        return ['%s_nFlat=%d,%d' % (self.name, self.nFlatDone, self.nStep)]
+
+    def abort(self):
+        super(DitheredFlatCmd, self).abort()
+        self.stop_boss_exposure(clear_queue=True)
+
+
 class GotoFieldCmd(CmdState):
 
     def __init__(self):
@@ -429,6 +581,7 @@ class GotoFieldCmd(CmdState):
         self.doSlew = True
         self.doHartmann = True
         self.doCalibs = True
+        self.forceCalibs = False
         self.didArc = False
         self.didFlat = False
         self.doGuiderFlat = True
@@ -466,6 +619,9 @@ class DoBossCalibsCmd(CmdState):
             keywords=dict(darkTime=900.0, flatTime=25.0, arcTime=4.0,
                           guiderFlatTime=0.5, offset=0))
 
+    checkpointAttrs = ('nBias', 'nBiasDone', 'nDark', 'nDarkDone', 'nFlat', 'nFlatDone', 'nArc',
+                       'nArcDone')
+
     def isSlewingDisabled(self):
         """If slewing is disabled, return a string describing why, else False."""
 
@@ -502,6 +658,12 @@ class DoBossCalibsCmd(CmdState):
         msg.append('nArc=%d,%d' % (self.nArcDone, self.nArc))
         return ['%s_%s' % (self.name, m) for m in msg]
 
+    def resume(self):
+        """Resume the calibrations, without offsetting the telescope again."""
+        error = super(DoBossCalibsCmd, self).resume()
+        self.offset = 0
+        return error
+
     def abort(self):
         self.nArc = self.nArcDone
         self.nBias = self.nBiasDone
@@ -524,6 +686,8 @@ class DoApogeeScienceCmd(CmdState):
         self.num_dithers = 2
         self.readout_time = 10.
 
+    checkpointAttrs = ('index', )
+
     def reset_nonkeywords(self):
         self.expType = 'object'
         super(DoApogeeScienceCmd, self).reset_nonkeywords()
@@ -551,6 +715,8 @@ class DoApogeeScienceCmd(CmdState):
         self.index += 1
         # update etr
         self.update_etr()
+        self.checkpoint()
+        self.update_plan()
         # generate keys
         self.genKeys()
 
@@ -589,8 +755,10 @@ class DoApogeeSkyFlatsCmd(CmdState):
         CmdState.__init__(
             self,
             'doApogeeSkyFlats', ['offset', 'expose'],
-            keywords=dict(ditherPairs=2, expTime=150.0))
+            keywords=dict(ditherPairs=2, expTime=150.0, etr=10.7))
         self.exposureSeq = 'ABBA'
+        self.num_dithers = 2
+        self.readout_time = 10.
 
     def reset_nonkeywords(self):
         self.expType = 'object'
@@ -600,8 +768,21 @@ class DoApogeeSkyFlatsCmd(CmdState):
     def getUserKeys(self):
         msg = []
         msg.append('%s_index=%d,%d' % (self.name, self.index, self.ditherPairs))
+        msg.append('{0}_etr={1},{2}'.format(self.name, self.etr, self.keywords['etr']))
         return msg
 
+    def took_exposure(self):
+        """Update keys after an exposure and output them."""
+        self.index += 1
+        self.update_etr()
+        self.update_plan()
+        self.genKeys()
+
+    def update_etr(self):
+        ''' Update the estimated time remaining '''
+        num_pairs = self.ditherPairs - self.index
+        self.etr = (self.num_dithers * num_pairs * (self.expTime + self.readout_time)) / 60.
+
     def exposures_remain(self):
         """Return True if there are any exposures left to be taken."""
         if self.aborted:
@@ -668,6 +849,8 @@ class DoMangaSequenceCmd(CmdState):
         self.reset_ditherSeq()
         self.readout_time = 60.0
 
+    checkpointAttrs = ('index', 'ditherSeq')
+
     def reset_nonkeywords(self):
         super(DoMangaSequenceCmd, self).reset_nonkeywords()
 
@@ -720,7 +903,7 @@ class DoMangaSequenceCmd(CmdState):
         ''' Update the estimated time remaining '''
         remaining_dithers = self.ditherSeq[self.index:]
         num = len(remaining_dithers)
-        self.etr = (num * (self.expTime + self.readout_time)) / 60.
+        self.etr = (num * (self.expTime + self.readout_overhead())) / 60.
 
     def getUserKeys(self):
         msg = []
@@ -732,6 +915,8 @@ class DoMangaSequenceCmd(CmdState):
         """Update keys after an exposure and output them."""
         self.index += 1
         self.update_etr()
+        self.checkpoint()
+        self.update_plan()
         self.genKeys()
 
     def exposures_remain(self):
@@ -913,10 +1098,13 @@ class DoApogeeMangaSequenceCmd(CmdState):
         self.manga_lead = False
         self.reset_ditherSeq()
 
+    checkpointAttrs = ('index', 'mangaDitherSeq', 'mangaExpTime', 'apogeeExpTime', 'readout',
+                       'apogee_long', 'manga_lead')
+
     def set_default_etr(self, exptime):
         ''' Sets the default estimated time remaining based on survey lead '''
         num = self.count * len(self.mangaDithers)
-        self.etr = (num * (exptime + self.readout_time)) / 60.
+        self.etr = (num * (exptime + self.readout_overhead())) / 60.
         self.keywords['etr'] = self.etr
 
     def set_apogeeLead(self, apogeeExpTime=None, mangaExpTime=None):
@@ -1011,7 +1199,7 @@ class DoApogeeMangaSequenceCmd(CmdState):
         num = len(remaining_dithers)
 
         mangaExpTime = self.mangaExpTime if self.mangaExpTime >= 900. else 900.
-        self.etr = (num * (mangaExpTime + self.readout_time)) / 60.
+        self.etr = (num * (mangaExpTime + self.readout_overhead())) / 60.
 
     def getUserKeys(self):
         msg = []
@@ -1037,6 +1225,8 @@ class DoApogeeMangaSequenceCmd(CmdState):
 
         # update the etr
         self.update_etr()
+        self.checkpoint()
+        self.update_plan()
 
         # generating keys
         self.genKeys()
@@ -1124,6 +1314,7 @@ class DoApogeeBossScienceCmd(CmdState):
         self.index += 1
         # update etr
         self.update_etr()
+        self.update_plan()
         # generate keys
         self.genKeys()
 
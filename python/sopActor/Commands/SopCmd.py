@@ -8,6 +8,8 @@ from __future__ import absolute_import, division, print_function
 
 import glob
 import os
+import re
+import shlex
 import threading
 
 import opscore.protocols.keys as keys
@@ -17,6 +19,9 @@ import sopActor.myGlobals as myGlobals
 from opscore.utility.qstr import qstr
 from sopActor import CmdState, Msg
 from sopActor.multiCommand import MultiCommand
+from sopActor.utils.efficiency import EfficiencyReport, bossFlushTime
+from sopActor.utils.fieldplan import read_fields
+from sopActor.utils.whenready import SlewWhenReady
 
 
 """ Wrap top-level ICC functions. """
@@ -75,6 +80,14 @@ surveyMode_inv_dict = {
     sopActor.MWMLEAD: 'MWM lead',
 }
 
+# The commands that can be put in the command queue: those that report
+# when they are done through their CmdState.
+queueableCommands = ('gotoField', 'doBossCalibs', 'doBossScience', 'doApogeeBossScience',
+                     'doApogeeScience', 'doApogeeSkyFlats', 'doMangaDither', 'doMangaSequence',
+                     'doApogeeMangaDither', 'doApogeeMangaSequence', 'gotoGangChange',
+                     'doApogeeDomeFlat', 'gotoInstrumentChange', 'gotoStow', 'gotoAll60',
+                     'gotoStow60', 'hartmann', 'collimateBoss', 'ditheredFlat')
+
 
 class SopCmd(object):
     """ Wrap commands to the sop actor"""
@@ -111,6 +124,7 @@ class SopCmd(object):
             keys.Key('noHartmann', help="Don't make Hartmann corrections"),
             keys.Key('noGuider', help="Don't start the guider"),
             keys.Key('noCalibs', help="Don't run the calibration step"),
+            keys.Key('forceCalibs', help='Take calibrations even if recent ones can be reused'),
             keys.Key('noDomeFlat', help="Don't run the dome flat step"),
             keys.Key('sp1', help='Select SP1'),
             keys.Key('sp2', help='Select SP2'),
@@ -139,45 +153,60 @@ class SopCmd(object):
             keys.Key('az', types.Float(), help='what azimuth to slew to'),
             keys.Key('rotOffset', types.Float(), help='what rotator offset to add'),
             keys.Key('alt', types.Float(), help='what altitude to slew to'),
+            keys.Key('command', types.String(), help='a sop command to queue'),
+            keys.Key('position', types.Int(), help='position in the command queue (1 is next)'),
+            keys.Key('remove', types.Int(), help='position to remove from the command queue'),
+            keys.Key('whenReady', help='Wait until slewing is allowed, then start'),
+            keys.Key('nEntries', types.Int(), help='Number of history entries to show'),
+            keys.Key('cartridge', types.Int(), help='A cartridge number'),
+            keys.Key('kind', types.Enum('command', 'stage', 'msg'),
+                     help='The kind of history entry'),
+            keys.Key('mjd', types.Int(), help='An SDSS MJD'),
+            keys.Key('resume', help='Continue a sequence from its last checkpoint'),
+            keys.Key('reload', help='Reload the code of the threads being restarted'),
+            keys.Key('fieldFile', types.String(), help='A plate list: plate ra dec [cartridge]'),
         )
 
         # Declare commands
         self.vocab = [
             ('bypass', '<subSystem> [clear]', self.bypass),
             ('doBossCalibs', '[<narc>] [<nbias>] [<ndark>] [<nflat>] [<arcTime>] '
-                             '[<darkTime>] [<flatTime>] [<guiderFlatTime>] [<offset>] [abort]',
+                             '[<darkTime>] [<flatTime>] [<guiderFlatTime>] [<offset>] [abort] '
+                             '[resume]',
                              self.doBossCalibs),
             ('doBossScience', '[<expTime>] [<nexp>] [abort] [stop] [test]',
                               self.doBossScience),
             ('doApogeeBossScience', '[<nExposures>] [abort] [stop] [test]',
                                     self.doApogeeBossScience),
-            ('doApogeeScience', '[<expTime>] [<ditherPairs>] [stop] [<abort>] [<comment>]',
+            ('doApogeeScience', '[<expTime>] [<ditherPairs>] [stop] [<abort>] [<comment>] '
+                                '[resume]',
                                 self.doApogeeScience),
             ('doApogeeSkyFlats', '[<expTime>] [<ditherPairs>] [stop] [abort]',
                                  self.doApogeeSkyFlats),
             ('doMangaDither', '[<expTime>] [<dither>] [stop] [abort]',
                               self.doMangaDither),
-            ('doMangaSequence', '[<expTime>] [<dithers>] [<count>] [stop] [abort]',
+            ('doMangaSequence', '[<expTime>] [<dithers>] [<count>] [stop] [abort] [resume]',
                                 self.doMangaSequence),
             ('doApogeeMangaDither', '[<mangaDither>] [<comment>] [stop] [abort]',
                                     self.doApogeeMangaDither),
-            ('doApogeeMangaSequence', '[<mangaDithers>] [<count>] [<comment>] [stop] [abort]',
+            ('doApogeeMangaSequence', '[<mangaDithers>] [<count>] [<comment>] [stop] [abort] '
+                                      '[resume]',
                                       self.doApogeeMangaSequence),
-            ('ditheredFlat', '[sp1] [sp2] [<expTime>] [<nStep>] [<nTick>]',
+            ('ditheredFlat', '[sp1] [sp2] [<expTime>] [<nStep>] [<nTick>] [abort]',
                              self.ditheredFlat),
             ('hartmann', '[<expTime>]', self.hartmann),
             ('collimateBoss', '', self.collimateBoss),
             ('lampsOff', '', self.lampsOff),
             ('ping', '', self.ping),
-            ('restart', '[keepQueues]', self.restart),
+            ('restart', '[keepQueues] [<threads>] [reload]', self.restart),
             ('gotoField', '[<arcTime>] [<flatTime>] [<guiderFlatTime>] [<guiderTime>] [noSlew] '
-                          '[noHartmann] [noCalibs] [noGuider] [abort] [keepOffsets]',
+                          '[noHartmann] [noCalibs] [forceCalibs] [noGuider] [abort] [keepOffsets]',
                           self.gotoField),
-            ('gotoInstrumentChange', '[abort] [stop]', self.gotoInstrumentChange),
-            ('gotoStow', '[abort] [stop]', self.gotoStow),
-            ('gotoAll60', '[abort] [stop]', self.gotoAll60),
-            ('gotoStow60', '[abort] [stop]', self.gotoStow60),
-            ('gotoGangChange', '[<alt>] [abort] [stop] [noDomeFlat] [noSlew]',
+            ('gotoInstrumentChange', '[abort] [stop] [whenReady]', self.gotoInstrumentChange),
+            ('gotoStow', '[abort] [stop] [whenReady]', self.gotoStow),
+            ('gotoAll60', '[abort] [stop] [whenReady]', self.gotoAll60),
+            ('gotoStow60', '[abort] [stop] [whenReady]', self.gotoStow60),
+            ('gotoGangChange', '[<alt>] [abort] [stop] [noDomeFlat] [noSlew] [whenReady]',
                                self.gotoGangChange),
             ('doApogeeDomeFlat', '[stop] [abort]', self.doApogeeDomeFlat),
             ('setFakeField', '[<az>] [<alt>] [<rotOffset>]', self.setFakeField),
@@ -185,7 +214,11 @@ class SopCmd(object):
             ('reinit', '', self.reinit),
             ('runScript', '<scriptName>', self.runScript),
             ('listScripts', '', self.listScripts),
-            ('stopScript', '', self.stopScript)
+            ('stopScript', '', self.stopScript),
+            ('queue', '[<command>] [<position>] [<remove>] [clear]', self.queue),
+            ('history', '[<nEntries>] [<cartridge>] [<kind>]', self.history),
+            ('efficiency', '[<mjd>]', self.efficiency),
+            ('planFields', '[<fieldFile>]', self.planFields),
         ]
 
     def stop_cmd(self, cmd, cmdState, sopState, name):
@@ -199,19 +232,40 @@ class SopCmd(object):
     def modifiable(self, cmd, cmdState):
         return cmdState.cmd and cmdState.cmd.isAlive()
 
+    def resume_cmd(self, cmd, cmdState):
+        """
+        If resume was requested, continue cmdState from its checkpoint.
+        Return False (and fail cmd) if it cannot be resumed.
+        """
+        if 'resume' not in cmd.cmd.keywords:
+            return True
+        error = cmdState.resume()
+        if error is not None:
+            cmd.fail('text=%s' % qstr(error))
+            return False
+        cmd.inform('text="Resuming %s from its checkpoint"' % cmdState.name)
+        return True
+
     def doBossCalibs(self, cmd):
         """ Take a set of calibration frames.
 
         CmdArgs:
-          nbias=N     - the number of biases to take. Taken first. [0]
-          ndark=N     - the number of darks to take. Taken after any biases. [0]
-          nflat=N     - the number of flats to take. Taken after any darks or biases. [0]
-          narc=N      - the number of arcs to take. Taken after any flats, darks, or biases. [0]
+          nbias=N     - the number of biases to take. [0]
+          ndark=N     - the number of darks to take. [0]
+          nflat=N     - the number of flats to take. [0]
+          narc=N      - the number of arcs to take. [0]
+
+          The exposures are grouped by type, in the order that takes the least
+          time given the current lamp and flat field screen state (by default
+          biases, darks, flats, then arcs).
 
           darkTime=S  - override the default dark exposure time. Default depends on survey.
           flatTime=S  - override the default flat exposure time. Default depends on survey.
           arcTime=S   - override the default arc exposure time. Default depends on survey.
           guiderFlatTime=S   - override the default guider flat exposure time.
+
+          resume      - continue the calibrations interrupted by an actor restart,
+                        from their last checkpoint (with the same cartridge).
           """
 
         sopState = myGlobals.actorState
@@ -275,6 +329,9 @@ class SopCmd(object):
         if 'guiderFlatTime' in keywords:
             cmdState.guiderFlatTime = keywords['guiderFlatTime'].values[0]
 
+        if not self.resume_cmd(cmd, cmdState):
+            return
+
         if cmdState.nArc + cmdState.nBias + cmdState.nDark + cmdState.nFlat == 0:
             cmd.fail('text="You must take at least one arc, bias, dark, or flat exposure"')
             return
@@ -288,7 +345,7 @@ class SopCmd(object):
                 cmd.warn('text="No cartridge is known to be loaded; not taking guider flats"')
                 cmdState.guiderFlatTime = 0
 
-        if 'offset' in keywords:
+        if 'offset' in keywords and 'resume' not in keywords:
             cmdState.offset = float(keywords['offset'].values[0])
 
         activeStages = []
@@ -431,6 +488,8 @@ class SopCmd(object):
         cmdState.comment = comment
         expTime = float(keywords['expTime'].values[0]) if 'expTime' in keywords else None
         cmdState.set('expTime', expTime)
+        if not self.resume_cmd(cmd, cmdState):
+            return
 
         if cmdState.ditherPairs == 0:
             cmd.fail('text="You must take at least one exposure"')
@@ -467,6 +526,9 @@ class SopCmd(object):
             if 'expTime' in keywords:
                 cmdState.set('expTime', int(keywords['expTime'].values[0]))
 
+            # update the etr
+            cmdState.update_etr()
+
             self.status(cmd, threads=False, finish=True, oneCommand=name)
             return
         cmdState.reinitialize(cmd)
@@ -475,6 +537,7 @@ class SopCmd(object):
         cmdState.set('expTime', expTime)
         ditherPairs = int(keywords['ditherPairs'].values[0]) if 'ditherPairs' in keywords else None
         cmdState.set('ditherPairs', ditherPairs)
+        cmdState.update_etr()
 
         if cmdState.ditherPairs == 0:
             cmd.fail('text="You must take at least one exposure"')
@@ -568,6 +631,8 @@ class SopCmd(object):
         count = keywords['count'].values[0] if 'count' in keywords else None
         cmdState.set('count', count)
         cmdState.reset_ditherSeq()
+        if not self.resume_cmd(cmd, cmdState):
+            return
 
         sopState.queues[sopActor.MASTER].put(
             Msg.DO_MANGA_SEQUENCE,
@@ -652,6 +717,8 @@ class SopCmd(object):
         cmdState.set('count', count)
 
         cmdState.reset_ditherSeq()
+        if not self.resume_cmd(cmd, cmdState):
+            return
 
         sopState.queues[sopActor.MASTER].put(
             Msg.DO_APOGEEMANGA_SEQUENCE,
@@ -706,7 +773,7 @@ class SopCmd(object):
                     bypassed=doBypass)
                 cmdStr = 'setRefractionBalance plateType="{0}" surveyMode="{1}"'.format(
                     *sopState.surveyText)
-                cmdVar = sopState.actor.cmdr.call(actor='guider', forUserCmd=cmd, cmdStr=cmdStr)
+                cmdVar = sopState.gateway.call(actor='guider', forUserCmd=cmd, cmdStr=cmdStr)
                 if cmdVar.didFail:
                     cmd.fail('text="Failed to set guider refraction '
                              'balance for bypass {0} {1}'.format(subSystem, doBypass))
@@ -743,43 +810,48 @@ class SopCmd(object):
                     sopState.gotoField.fakeRotOffset))
 
     def ditheredFlat(self, cmd, finish=True):
-        """Take a set of nStep dithered flats, moving the collimator by nTick between exposures"""
+        """
+        Take a set of nStep dithered flats, moving the collimator by nTick between exposures.
+
+        The collimators of the requested spectrographs (sp1, sp2; default both)
+        move together, while the previous flat reads out. At the end they are
+        returned to their initial positions.
+        """
 
         sopState = myGlobals.actorState
+        cmdState = sopState.ditheredFlat
+        keywords = cmd.cmd.keywords
 
-        if self.doing_science():
+        if 'abort' in keywords:
+            self.stop_cmd(cmd, cmdState, sopState, 'ditheredFlat')
+            return
+
+        if self.doing_science(sopState):
             cmd.fail(
                 "text='A science exposure sequence is running -- will not start dithered flats!")
             return
 
-        sopState.aborting = False
-
-        spN = []
-        all = [
-            'sp1',
-            'sp2',
-        ]
-        for s in all:
-            if s in cmd.cmd.keywords:
-                spN += [s]
-
-        if not spN:
-            spN = all
+        if self.modifiable(cmd, cmdState):
+            cmd.fail('text="A ditheredFlat sequence is already running"')
+            return
 
-        nStep = int(cmd.cmd.keywords['nStep'].values[0]) if 'nStep' in cmd.cmd.keywords else 22
-        nTick = int(cmd.cmd.keywords['nTick'].values[0]) if 'nTick' in cmd.cmd.keywords else 62
-        expTime = float(
-            cmd.cmd.keywords['expTime'].values[0]) if 'expTime' in cmd.cmd.keywords else 30
+        cmdState.reinitialize(cmd)
+        spN = [sp for sp in ('sp1', 'sp2') if sp in keywords]
+        if spN:
+            cmdState.spN = spN
+        if 'nStep' in keywords:
+            cmdState.nStep = int(keywords['nStep'].values[0])
+        if 'nTick' in keywords:
+            cmdState.nTick = int(keywords['nTick'].values[0])
+        if 'expTime' in keywords:
+            cmdState.expTime = float(keywords['expTime'].values[0])
 
         sopState.queues[sopActor.MASTER].put(
             Msg.DITHERED_FLAT,
             cmd,
             replyQueue=self.replyQueue,
             actorState=sopState,
-            expTime=expTime,
-            spN=spN,
-            nStep=nStep,
-            nTick=nTick)
+            cmdState=cmdState)
 
     def hartmann(self, cmd, finish=True):
         """
@@ -842,6 +914,9 @@ class SopCmd(object):
         field screen petals are closed.  When you arrive at the field,
         all the lamps are turned off again and the flat field petals
         are opened if you specified openFFS.
+
+        Arcs and flats taken recently on the same field are reused, unless
+        forceCalibs is specified.
         """
 
         sopState = myGlobals.actorState
@@ -899,10 +974,20 @@ class SopCmd(object):
 
         cmdState.reinitialize(cmd, output=False)
 
+        # The target and stages resolved when the cartridge was loaded, if still current.
+        prepared = sopState.cartLoad.claim()
+        if prepared is not None:
+            stages = prepared.stages
+        elif survey == sopActor.APOGEE:
+            stages = ['slew', 'guider']
+        else:
+            stages = ['slew', 'hartmann', 'calibs', 'guider']
+
         cmdState.doSlew = 'noSlew' not in keywords
         cmdState.doGuider = 'noGuider' not in keywords
-        cmdState.doCalibs = ('noCalibs' not in keywords and survey != sopActor.APOGEE)
-        cmdState.doHartmann = ('noHartmann' not in keywords and survey != sopActor.APOGEE)
+        cmdState.doCalibs = ('noCalibs' not in keywords and 'calibs' in stages)
+        cmdState.doHartmann = ('noHartmann' not in keywords and 'hartmann' in stages)
+        cmdState.forceCalibs = 'forceCalibs' in keywords
         if cmdState.doCalibs:
             if 'arcTime' in keywords:
                 cmdState.arcTime = float(keywords['arcTime'].values[0])
@@ -933,7 +1018,11 @@ class SopCmd(object):
             cmdState.doGuider = False
             cmdState.doGuiderFlat = False
 
-        if cmdState.doSlew:
+        if cmdState.doSlew and prepared is not None:
+            cmdState.ra = prepared.ra
+            cmdState.dec = prepared.dec
+            cmdState.rotang = 0.0  # Rotator angle; should always be 0.0
+        elif cmdState.doSlew:
             pointingInfo = sopState.models['platedb'].keyVarDict['pointingInfo']
             cmdState.ra = pointingInfo[3]
             cmdState.dec = pointingInfo[4]
@@ -969,15 +1058,14 @@ class SopCmd(object):
             cmdState=cmdState)
 
     def gotoPosition(self, cmd, cmdState, name, az=None, alt=None, rot=None):
-        """Goto a specified alt/az/[rot] position, named 'name'."""
+        """Goto a specified alt/az/[rot] position, named 'name' (whenReady waits to be allowed)."""
 
         sopState = myGlobals.actorState
         cmdState = cmdState or sopState.gotoPosition
         keywords = cmd.cmd.keywords
 
-        blocked = self.isSlewingDisabled(cmd)
-        if blocked:
-            cmd.fail('text=%s' % (qstr('will not {0}: {1}'.format(name, blocked))))
+        retry = lambda: self.gotoPosition(cmd, cmdState, name, az=az, alt=alt, rot=rot)
+        if not self.slew_allowed(cmd, name, name, retry):
             return
 
         if 'stop' in keywords or 'abort' in keywords:
@@ -1027,15 +1115,18 @@ class SopCmd(object):
         self.gotoPosition(cmd, None, 'stow', 121, 60, 0)
 
     def gotoGangChange(self, cmd):
-        """Go to the gang connector change position"""
+        """Go to the gang connector change position.
+
+        With whenReady, wait for slewing to be allowed (e.g. for the last BOSS
+        exposure to start reading out) instead of failing.
+        """
 
         sopState = myGlobals.actorState
         cmdState = sopState.gotoGangChange
         keywords = cmd.cmd.keywords
 
-        blocked = self.isSlewingDisabled(cmd)
-        if blocked:
-            cmd.fail('text=%s' % (qstr('will not go to gang change: %s' % (blocked))))
+        retry = lambda: self.gotoGangChange(cmd)
+        if not self.slew_allowed(cmd, 'gotoGangChange', 'go to gang change', retry):
             return
 
         if 'stop' in keywords or 'abort' in keywords:
@@ -1124,17 +1215,177 @@ class SopCmd(object):
         sopState = myGlobals.actorState
         sopState.queues[sopActor.SCRIPT].put(Msg.STOP_SCRIPT, cmd, replyQueue=self.replyQueue)
 
+    def queue(self, cmd):
+        """Show or edit the commands to start when the running command finishes.
+
+        CmdArgs:
+          command="..." - a sop command to queue, e.g. command="doApogeeMangaSequence count=2"
+          position=N    - insert the command at position N (1 is next). [end of the queue]
+          remove=N      - remove the command at position N.
+          clear         - remove all queued commands.
+
+        The first queued command is started as soon as a command finishes
+        successfully; the queue is cleared if a command fails or is aborted.
+        """
+        commandQueue = myGlobals.actorState.commandQueue
+        keywords = cmd.cmd.keywords
+
+        if 'clear' in keywords:
+            commandQueue.clear()
+
+        try:
+            if 'remove' in keywords:
+                removed = commandQueue.remove(int(keywords['remove'].values[0]))
+                cmd.inform('text=%s' % qstr('Removed %s from the queue' % removed))
+
+            if 'command' in keywords:
+                cmdStr = keywords['command'].values[0]
+                error = self.check_queueable(cmdStr)
+                if error:
+                    cmd.fail('text=%s' % qstr(error))
+                    return
+                position = int(keywords['position'].values[0]) if 'position' in keywords else None
+                commandQueue.add(cmdStr, position)
+        except IndexError as e:
+            cmd.fail('text=%s' % qstr(e))
+            return
+
+        commandQueue.genKeys(cmd)
+        cmd.finish('')
+
+    def history(self, cmd):
+        """Show the most recent commands, stages and thread messages recorded in the ledger.
+
+        CmdArgs:
+          nEntries=N  - the number of entries to show. [20]
+          cartridge=N - only show entries taken with cartridge N.
+          kind=K      - only show entries of kind K: command, stage or msg.
+
+        Each entry is output as sopHistory=kind,name,thread,start,end,success,
+        cartridge,survey,params, newest first.
+        """
+        ledger = myGlobals.actorState.ledger
+        keywords = cmd.cmd.keywords
+        if not ledger.enabled:
+            cmd.fail('text="The sop ledger is not enabled: see [ledger] in the sop config."')
+            return
+
+        nEntries = int(keywords['nEntries'].values[0]) if 'nEntries' in keywords else 20
+        cartridge = int(keywords['cartridge'].values[0]) if 'cartridge' in keywords else None
+        kind = keywords['kind'].values[0] if 'kind' in keywords else None
+        ledger.genKeys(cmd, ledger.recent(nEntries, cartridge=cartridge, kind=kind))
+        cmd.finish('')
+
+    def efficiency(self, cmd):
+        """Show how a night was spent: with a science shutter open, or in each overhead.
+
+        CmdArgs:
+          mjd=N - the SDSS MJD of the night. [today]
+
+        The night runs from the first to the last command recorded in the
+        ledger during that MJD. Outputs nightEfficiency=mjd,start,duration,
+        openFraction, one nightEfficiencyTime=category,seconds,fraction per
+        category, and one nightEfficiencyStage=stage,seconds,open,overhead per
+        stage.
+        """
+        actorState = myGlobals.actorState
+        ledger = actorState.ledger
+        keywords = cmd.cmd.keywords
+        if not ledger.enabled:
+            cmd.fail('text="The sop ledger is not enabled: see [ledger] in the sop config."')
+            return
+
+        mjd = int(keywords['mjd'].values[0]) if 'mjd' in keywords else None
+        flushTime = actorState.metrics.mean('boss.flush', bossFlushTime)
+        EfficiencyReport.from_ledger(ledger, mjd, flushTime).genKeys(cmd)
+        cmd.finish('')
+
+    def planFields(self, cmd):
+        """Predict the position, airmass and slew time of each field in a plate list.
+
+        CmdArgs:
+          fieldFile=F - the plate list, one "plate ra dec [cartridge]" per line.
+                        [the [plan] fieldFile]
+
+        The slews start from the current tcc axePos. Outputs fieldPlanTime=
+        time,lst,nFields, then one fieldPlan=plate,cartridge,ha,alt,az,airmass,
+        slewTime per field: those above the [plan] minAlt first, by slew time.
+        """
+        sopState = myGlobals.actorState
+        planner = sopState.fieldPlanner
+        keywords = cmd.cmd.keywords
+        path = keywords['fieldFile'].values[0] if 'fieldFile' in keywords else planner.fieldFile
+        if path is None:
+            cmd.fail('text="No fieldFile given, and no [plan] fieldFile in the sop config."')
+            return
+        try:
+            fields = read_fields(os.path.expanduser(path))
+        except (IOError, ValueError) as e:
+            cmd.fail('text=%s' % qstr('Cannot read the fields: %s' % e))
+            return
+
+        axePos = sopState.models['tcc'].keyVarDict['axePos']
+        fromAz, fromAlt = [float('nan') if axePos[i] is None else axePos[i] for i in (0, 1)]
+        planner.plan(*fields, fromAz=fromAz, fromAlt=fromAlt).genKeys(cmd)
+        cmd.finish('')
+
+    def check_queueable(self, cmdStr):
+        """Return why cmdStr cannot be queued, or '' if it can."""
+        try:
+            words = shlex.split(cmdStr)
+        except ValueError as e:
+            return 'Cannot parse %s: %s' % (cmdStr, e)
+        if not words:
+            return 'No command to queue'
+
+        verb = words[0]
+        if verb not in queueableCommands:
+            return '%s cannot be queued; valid commands are: %s' % (verb,
+                                                                    ', '.join(queueableCommands))
+
+        argSpec = dict((name, args) for name, args, func in self.vocab)[verb]
+        valueArgs = set(re.findall(r'<(\w+)>', argSpec)) - set(('abort', 'stop'))
+        flagArgs = set(re.findall(r'\[(\w+)\]', argSpec)) - set(('abort', 'stop'))
+        for word in words[1:]:
+            name, equals, value = word.partition('=')
+            if equals:
+                if name not in valueArgs:
+                    return '%s does not take a %s= argument' % (verb, name)
+                if not value:
+                    return 'No value given for %s' % name
+            elif name not in flagArgs:
+                return '%s does not take a %s argument' % (verb, name)
+        return ''
+
     def ping(self, cmd):
         """ Query sop for liveness/happiness. """
 
         cmd.finish('text="Yawn; how soporific"')
 
     def restart(self, cmd):
-        """Restart the worker threads"""
+        """Restart the worker threads.
+
+        CmdArgs:
+          threads=a,b - only restart these threads, given by thread (e.g. tcc) or
+                        module name (e.g. lampThreads). Their queues and handler
+                        state are kept, and a thread that is busy is not restarted.
+          reload      - with threads, reload the code of their modules first.
+          keepQueues  - when restarting all the threads, keep their queues.
+        """
 
         sopState = myGlobals.actorState
+        keywords = cmd.cmd.keywords
+
+        if 'threads' in keywords:
+            for name in keywords['threads'].values:
+                error = sopState.supervisor.restart(cmd, name, reloadCode='reload' in keywords)
+                if error is not None:
+                    cmd.fail('text=%s' % qstr(error))
+                    return
+            cmd.finish('')
+            return
 
-        keepQueues = True if 'keepQueues' in cmd.cmd.keywords else False
+        keepQueues = True if 'keepQueues' in keywords else False
 
         if sopState.restartCmd:
             sopState.restartCmd.finish("text=\"secundum verbum tuum in pace\"")
@@ -1161,6 +1412,29 @@ class SopCmd(object):
 
         cmd.finish('')
 
+    def slew_allowed(self, cmd, name, description, retry):
+        """
+        Return True if command name may slew now.
+
+        Otherwise fail cmd or, if whenReady was given, arm it to call retry()
+        as soon as slewing is allowed. Stopping a command that is armed
+        disarms it.
+        """
+        keywords = cmd.cmd.keywords
+        slewWhenReady = myGlobals.actorState.slewWhenReady
+        if ('stop' in keywords or 'abort' in keywords) and slewWhenReady.disarm(name):
+            cmd.finish('text="%s disarmed"' % name)
+            return False
+
+        blocked = self.isSlewingDisabled(cmd)
+        if not blocked:
+            return True
+        if 'whenReady' in keywords:
+            slewWhenReady.arm(cmd, name, blocked, retry)
+        else:
+            cmd.fail('text=%s' % (qstr('will not {0}: {1}'.format(description, blocked))))
+        return False
+
     def isSlewingDisabled(self, cmd):
         """Return False if we can slew, otherwise return a string describing why we cannot."""
         sopState = myGlobals.actorState
@@ -1219,6 +1493,8 @@ class SopCmd(object):
         cmd.inform('text="apogeeGang: %s"' % (sopState.apogeeGang.getPos()))
 
         cmd.inform('surveyCommands=' + ', '.join(sopState.validCommands))
+        if len(sopState.commandQueue):
+            sopState.commandQueue.genKeys(cmd)
 
         # major commands
         sopState.gotoField.genKeys(cmd=cmd, trimKeys=oneCommand)
@@ -1235,6 +1511,7 @@ class SopCmd(object):
         sopState.doApogeeDomeFlat.genKeys(cmd=cmd, trimKeys=oneCommand)
         sopState.hartmann.genKeys(cmd=cmd, trimKeys=oneCommand)
         sopState.collimateBoss.genKeys(cmd=cmd, trimKeys=oneCommand)
+        sopState.ditheredFlat.genKeys(cmd=cmd, trimKeys=oneCommand)
         sopState.gotoPosition.genKeys(cmd=cmd, trimKeys=oneCommand)
         sopState.gotoInstrumentChange.genKeys(cmd=cmd, trimKeys=oneCommand)
         sopState.gotoStow.genKeys(cmd=cmd, trimKeys=oneCommand)
@@ -1242,6 +1519,13 @@ class SopCmd(object):
         # TBD: threads arg is only used with "geek" option, apparently?
         # TBD: I guess its useful for live debugging of the threads.
         if threads:
+            sopState.metrics.genKeys(cmd)
+            sopState.watchdog.genKeys(cmd)
+            sopState.plan.genKeys(cmd)
+            sopState.cartLoad.genKeys(cmd)
+            for lampFlux in sopState.lampFlux.values():
+                lampFlux.genKeys(cmd)
+            sopState.lampState.genKeys(cmd, myGlobals.warmupTime)
             try:
                 sopState.ignoreAborting = True
                 getStatus = MultiCommand(cmd, 5.0, None)
@@ -1285,6 +1569,11 @@ class SopCmd(object):
         sopState.doApogeeDomeFlat = CmdState.DoApogeeDomeFlatCmd()
         sopState.hartmann = CmdState.HartmannCmd()
         sopState.collimateBoss = CmdState.CollimateBossCmd()
+        sopState.ditheredFlat = CmdState.DitheredFlatCmd()
+
+        if getattr(sopState, 'slewWhenReady', None) is not None:
+            sopState.slewWhenReady.disarm(text='disarmed by reinitialization')
+        sopState.slewWhenReady = SlewWhenReady(sopState, self.isSlewingDisabled)
 
         self.updateCartridge(-1, 'UNKNOWN', 'None')
         sopState.guiderState.setLoadedNewCartridgeCallback(self.updateCartridge)
@@ -1402,6 +1691,13 @@ class SopCmd(object):
             sopState.doBossCalibs.nArc = 1
             sopState.doBossCalibs.set('offset', 20)
 
+        # a bypass only reclassifies the cartridge that is already loaded.
+        if bypassed:
+            sopState.plan.update()
+        else:
+            sopState.plan.cartridge_loaded()
+        sopState.cartLoad.loaded(cartridge)
+
         if status:
             self.status(cmd, threads=False, finish=False)
 
@@ -1538,7 +1834,7 @@ def obs2Sky(cmd, az=None, alt=None, rotOffset=0.0):
 
     cmd.warn('text="FAKING slew position from az, alt, and rotator offset: %0.1f %0.1f %0.1f"' %
              (gotoAz, gotoAlt, rotOffset))
-    cmdVar = myGlobals.actorState.actor.cmdr.call(
+    cmdVar = myGlobals.actorState.gateway.call(
         actor='tcc', forUserCmd=cmd, cmdStr=('convert %0.5f,%0.6f obs icrs' % (gotoAz, gotoAlt)))
     if cmdVar.didFail:
         return 0, 0, 0
@@ -13,6 +13,10 @@
 from __future__ import division, print_function
 
 import abc
+import ConfigParser
+import functools
+import os
+import sqlite3
 
 import actorcore.Actor
 import apogeeThread
@@ -31,8 +35,23 @@ import sopActor
 import tccThread
 from bypass import Bypass
 from sopActor import myGlobals
+from sopActor.utils.calibrations import CalibrationRegistry
+from sopActor.utils.cartload import CartLoadPrep
+from sopActor.utils.checkpoint import CheckpointStore
+from sopActor.utils.fieldplan import FieldPlanner
+from sopActor.utils.cmdqueue import CommandQueue
+from sopActor.utils.focus import FocusCache
+from sopActor.utils.gateway import CommandGateway
+from sopActor.utils.lampflux import LampFluxModel
+from sopActor.utils.lampstate import LampStateTracker
+from sopActor.utils.ledger import Ledger
 from sopActor.utils.gang import ApogeeGang
 from sopActor.utils.guider import GuiderState
+from sopActor.utils.metrics import Metrics
+from sopActor.utils.nightplan import ObservingPlan
+from sopActor.utils.retry import RetryPolicy
+from sopActor.utils.supervisor import ThreadSupervisor
+from sopActor.utils.watchdog import Watchdog
 
 
 class SopActor(actorcore.Actor.SDSSActor):
@@ -97,12 +116,24 @@ class SopActor(actorcore.Actor.SDSSActor):
 
         # Explicitly load other actor models.
         self.models = {}
-        for actor in ['boss', 'guider', 'platedb', 'mcp', 'sop', 'tcc', 'apogee', 'hartmann']:
+        for actor in ['boss', 'guider', 'platedb', 'mcp', 'sop', 'tcc', 'apogee', 'hartmann', 'apo']:
             self.models[actor] = opscore.actor.model.Model(actor)
 
         self.actorState = actorcore.Actor.ActorState(self, self.models)
         self.actorState.guiderState = GuiderState(self.models['guider'])
         self.actorState.apogeeGang = ApogeeGang()
+        self.actorState.metrics = Metrics()
+        self.actorState.gateway = self._openGateway()
+        self.actorState.commandQueue = CommandQueue(self.actorState)
+        self.actorState.focusCache = self._readFocusCache()
+        self.actorState.calibrations = self._readCalibrationRegistry()
+        self.actorState.ledger = self._openLedger()
+        self.actorState.checkpoints = self._openCheckpoints()
+        self.actorState.supervisor = ThreadSupervisor(self.actorState)
+        self.actorState.fieldPlanner = self._readFieldPlanner()
+        self.actorState.plan = self._readObservingPlan()
+        self.actorState.cartLoad = self._readCartLoadPrep()
+        self.actorState.watchdog = self._startWatchdog()
         myGlobals.actorState = self.actorState
 
         # This is the default set of commands, valid both at APO and LCO
@@ -111,6 +142,160 @@ class SopActor(actorcore.Actor.SDSSActor):
         self.actorState.timeout = 60  # timeout on message queues
 
         self._readWarmUpTimes()
+        self.actorState.lampFlux = self._readLampFluxModels()
+        self.actorState.lampState = self._readLampState()
+        self._connectLampState()
+
+    def _openGateway(self):
+        """Return the CommandGateway, with coalescing, limits and retries from the config file."""
+        try:
+            retry = RetryPolicy.from_items(self.config.items('retry'))
+        except ConfigParser.Error:
+            self.logger.warn('No [retry] policy: never retrying failed commands.')
+            retry = RetryPolicy()
+        try:
+            coalesce = self.config.get('gateway', 'coalesce')
+            limits = self.config.get('gateway', 'limits')
+        except ConfigParser.Error:
+            self.logger.warn('No [gateway] configuration: not coalescing or limiting commands.')
+            return CommandGateway(self.actorState, retry=retry)
+        return CommandGateway(self.actorState, CommandGateway.parse_coalesce(coalesce),
+                              CommandGateway.parse_limits(limits), retry)
+
+    def _readFocusCache(self):
+        """Return a FocusCache with the gotoField Hartmann policy from the config file."""
+        focusCache = FocusCache()
+        try:
+            focusCache.maxAge = self.config.getfloat('hartmann', 'maxAge')
+            focusCache.maxTempChange = self.config.getfloat('hartmann', 'maxTempChange')
+            focusCache.perCartridge = self.config.getboolean('hartmann', 'perCartridge')
+            focusCache.temperatureKey = self.config.get('hartmann', 'temperatureKey')
+        except ConfigParser.Error:
+            self.logger.warn('No [hartmann] focus cache policy: always taking Hartmanns.')
+        return focusCache
+
+    def _readCalibrationRegistry(self):
+        """Return a CalibrationRegistry with the gotoField calibration reuse policy."""
+        calibrations = CalibrationRegistry()
+        try:
+            calibrations.maxAge = self.config.getfloat('calibs', 'maxAge')
+        except ConfigParser.Error:
+            self.logger.warn('No [calibs] reuse policy: always taking gotoField calibrations.')
+        return calibrations
+
+    def _openLedger(self):
+        """Return the started Ledger at the path in the config file (disabled if there is none)."""
+        try:
+            path = self.config.get('ledger', 'path')
+        except ConfigParser.Error:
+            self.logger.warn('No [ledger] path: not recording the sop history.')
+            return Ledger()
+        ledger = Ledger(os.path.expanduser(os.path.expandvars(path)))
+        try:
+            ledger.start()
+        except (OSError, IOError, sqlite3.Error) as e:
+            self.logger.warn('Cannot open the ledger %s (%s): not recording the sop history.' %
+                             (ledger.path, e))
+            return Ledger()
+        return ledger
+
+    def _openCheckpoints(self):
+        """Return the CheckpointStore in the directory in the config file (disabled if none)."""
+        try:
+            directory = self.config.get('checkpoint', 'directory')
+        except ConfigParser.Error:
+            self.logger.warn('No [checkpoint] directory: sequences cannot be resumed.')
+            return CheckpointStore()
+        return CheckpointStore(os.path.expanduser(os.path.expandvars(directory)))
+
+    def _readFieldPlanner(self):
+        """Return a FieldPlanner with the site, slew speeds and plate list from the config file."""
+        planner = FieldPlanner()
+        try:
+            planner.longitude = self.config.getfloat('plan', 'longitude')
+            planner.latitude = self.config.getfloat('plan', 'latitude')
+            planner.azSpeed = self.config.getfloat('plan', 'azSpeed')
+            planner.altSpeed = self.config.getfloat('plan', 'altSpeed')
+            planner.settleTime = self.config.getfloat('plan', 'settleTime')
+            planner.minAlt = self.config.getfloat('plan', 'minAlt')
+            planner.fieldFile = os.path.expanduser(self.config.get('plan', 'fieldFile'))
+        except ConfigParser.Error:
+            self.logger.warn('No [plan] configuration: using the APO defaults for planFields.')
+        return planner
+
+    def _readObservingPlan(self):
+        """Return the ObservingPlan, enabled and with default stage times from the config file."""
+        plan = ObservingPlan(self.actorState)
+        try:
+            plan.enabled = self.config.getboolean('nightPlan', 'enabled')
+            plan.defaultTimes.update(ObservingPlan.parse_times(
+                self.config.get('nightPlan', 'defaultTimes')))
+        except ConfigParser.Error:
+            self.logger.warn('No [nightPlan] configuration: not predicting the end of the plan.')
+        return plan
+
+    def _readCartLoadPrep(self):
+        """Return the CartLoadPrep, enabled from the config file."""
+        cartLoad = CartLoadPrep(self.actorState)
+        try:
+            cartLoad.enabled = self.config.getboolean('cartLoad', 'enabled')
+        except ConfigParser.Error:
+            self.logger.warn('No [cartLoad] configuration: not preparing gotoField on cart loads.')
+        return cartLoad
+
+    def _startWatchdog(self):
+        """Return the started thread Watchdog, configured from the config file."""
+        watchdog = Watchdog(self.actorState)
+        try:
+            watchdog.interval = self.config.getfloat('watchdog', 'interval')
+            watchdog.factor = self.config.getfloat('watchdog', 'factor')
+            watchdog.grace = self.config.getfloat('watchdog', 'grace')
+            watchdog.recover = self.config.getboolean('watchdog', 'recover')
+            watchdog.exempt = set(self.config.get('watchdog', 'exempt').split())
+        except ConfigParser.Error:
+            self.logger.warn('No [watchdog] configuration: not watching the sop threads.')
+            return watchdog
+        watchdog.start()
+        return watchdog
+
+    def _readLampFluxModels(self):
+        """Return the arc lamp flux models, fitted to the samples in the config file."""
+        lampFlux = {}
+        try:
+            samples = self.config.get('lamps', 'hgcdFlux').split()
+            minFlux = self.config.getfloat('lamps', 'minArcFlux')
+        except ConfigParser.Error:
+            return lampFlux
+        try:
+            samples = [[float(x) for x in sample.split(':')] for sample in samples]
+            lampFlux[sopActor.HGCD_LAMP] = LampFluxModel.fit('HgCd', samples, minFlux=minFlux)
+        except (ValueError, IndexError, ZeroDivisionError) as e:
+            self.logger.warn('Bad [lamps] hgcdFlux samples (%s): '
+                             'not adjusting arc times for the lamp warm-up.' % e)
+            return {}
+        return lampFlux
+
+    def _readLampState(self):
+        """Return a LampStateTracker with the lamp cooling time from the config file."""
+        lampState = LampStateTracker(warmupTimes=getattr(myGlobals, 'warmupTime', None))
+        try:
+            lampState.coolingTime = self.config.getfloat('lamps', 'coolingTime')
+        except ConfigParser.Error:
+            self.logger.warn('No lamp coolingTime: lamps are cold as soon as they are off.')
+        return lampState
+
+    def _connectLampState(self):
+        """Feed the mcp lamp keywords to the lamp state tracker."""
+        lampKeys = {
+            sopActor.FF_LAMP: 'ffLamp',
+            sopActor.HGCD_LAMP: 'hgCdLamp',
+            sopActor.NE_LAMP: 'neLamp',
+            sopActor.UV_LAMP: 'uvLampCommandedOn',
+            sopActor.WHT_LAMP: 'whtLampCommandedOn'
+        }
+        for lamp, key in lampKeys.items():
+            callback = functools.partial(self.actorState.lampState.keyVarChanged, lamp)
+            self.models['mcp'].keyVarDict[key].addCallback(callback, callNow=True)
 
     def periodicStatus(self):
         """Run some command periodically"""
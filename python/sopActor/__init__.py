@@ -1,6 +1,8 @@
 import Queue as _Queue
+import heapq
 import threading
 import re
+import time
 import six
 
 from opscore.utility.qstr import qstr
@@ -224,6 +226,12 @@ except NameError:
         class EXPOSURE_FINISHED():
             pass
 
+        class STOP_EXPOSURE():
+            pass  # stop the running exposure, and optionally drop pending ones
+
+        class QUEUE_STATUS():
+            pass  # report the running and pending messages of a thread
+
         class REPLY():
             pass
 
@@ -248,9 +256,18 @@ except NameError:
         class DECENTER():
             pass
 
+        class DITHER_TRANSITION():
+            pass  # decenter and move to a MaNGA dither in one step
+
         class POST_FLAT():
             pass
 
+        class MOVE_COLLIMATOR():
+            pass  # move one BOSS spectrograph's collimator
+
+        class COLLIMATOR_MOVED():
+            pass  # a MOVE_COLLIMATOR has completed, so the boss thread can reply to it
+
         class APOGEE_SHUTTER():
             pass  # control the internal APOGEE shutter
 
@@ -279,6 +296,12 @@ except NameError:
                 self.__setattr__(k, v)
             self.__data = data.keys()
 
+        def data(self):
+            """Return the plain-valued data of this message (e.g. expTime), as a dict."""
+            plain = (bool, float, six.string_types) + six.integer_types
+            return dict((k, getattr(self, k)) for k in self.__data
+                        if isinstance(getattr(self, k), plain))
+
         def __repr__(self):
             values = []
             for k in self.__data:
@@ -299,6 +322,10 @@ class Queue(_Queue.PriorityQueue):
     def __init__(self, name, *args):
         _Queue.Queue.__init__(self, *args)
         self.name = name
+        self.handling = None  # the message its thread is handling, until it gets the next one
+        self.handlingSince = None  # when it started handling it
+        self.heartbeat = None  # when its thread last asked for a message
+        self.retired = set()  # idents of replaced threads, to be told to exit
 
         assert isinstance(self.name, six.string_types), 'Queue name must be a string.'
 
@@ -322,6 +349,40 @@ class Queue(_Queue.PriorityQueue):
 
         _Queue.Queue.put(self, msg)
 
+    def get(self, *args, **kwds):
+        """
+        Get the next message, which is then being handled until the next get().
+        A thread that has been retired (replaced by another) gets an EXIT instead.
+        """
+        ident = threading.current_thread().ident
+        if ident in self.retired:
+            self.retired.discard(ident)
+            return Msg(Msg.EXIT, None)
+        self.handling = None
+        self.heartbeat = time.time()
+        msg = _Queue.PriorityQueue.get(self, *args, **kwds)
+        self.handling, self.handlingSince = msg, time.time()
+        return msg
+
+    def remove(self, match):
+        """
+        Remove and return (in priority order) the waiting messages for which
+        match(msg) is True. Unlike get(), this is not handling them: the
+        thread's handling and heartbeat, and the other messages, are untouched.
+        """
+        with self.mutex:
+            removed = [msg for msg in self.queue if match(msg)]
+            if removed:
+                self.queue[:] = [msg for msg in self.queue if not match(msg)]
+                heapq.heapify(self.queue)
+                self.not_full.notify_all()
+        return sorted(removed)
+
+    def retire(self, thread):
+        """Make thread exit the next time it gets a message, e.g. once a hung call returns."""
+        self.retired.add(thread.ident)
+        self.handling = None
+
     def flush(self):
         """flush the queue"""
 
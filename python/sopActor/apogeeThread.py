@@ -1,5 +1,6 @@
 import Queue
 import threading
+import time
 
 from twisted.internet import defer, reactor
 
@@ -7,6 +8,7 @@ import sopActor
 import sopActor.myGlobals as myGlobals
 from opscore.utility.qstr import qstr
 from sopActor import Msg, tback
+from sopActor.lampThreads import ignore_lamps
 
 
 def twistedSleep(secs):
@@ -38,7 +40,7 @@ def checkFailure(cmd, replyQueue, cmdVar, failmsg, finish=True):
 def do_dither(cmd, actorState, dither):
     """Move the APOGEE dither position."""
     timeLim = 30.0  # seconds
-    cmdVar = actorState.actor.cmdr.call(
+    cmdVar = actorState.gateway.call(
         actor='apogee',
         forUserCmd=cmd,
         cmdStr=('dither namedpos=%s' % dither),
@@ -52,7 +54,7 @@ def do_dither(cmd, actorState, dither):
 
 def do_shutter(cmd, actorState, position):
     """Move the APOGEE shutter position."""
-    cmdVar = actorState.actor.cmdr.call(
+    cmdVar = actorState.gateway.call(
         actor='apogee', forUserCmd=cmd, cmdStr='shutter %s' % (position), timeLim=20)
     return cmdVar
 
@@ -71,7 +73,7 @@ def do_expose(cmd, actorState, expTime, dither, expType, comment):
     #         return False
 
     timeLim = expTime + 15.0  # seconds
-    cmdVar = actorState.actor.cmdr.call(
+    cmdVar = actorState.gateway.call(
         actor='apogee',
         forUserCmd=cmd,
         cmdStr='expose time=%0.1f object=%s %s' % (expTime, expType, ('comment=%s' % qstr(comment))
@@ -87,20 +89,175 @@ def do_expose(cmd, actorState, expTime, dither, expType, comment):
     return success
 
 
-def do_apogee_dither_set(cmd, actorState, expTime, dithers, expType, comment):
+class ApogeeMechanisms(object):
+    """
+    Cache of the APOGEE shutter position.
+
+    Kept up to date from the shutterLimitSwitch keyword, and from our own
+    successful moves (so that a second request that arrives before the
+    keyword does is not sent again). Moves that are already satisfied are
+    skipped, and counted in actorState.metrics.
+
+    The dither is not cached: do_expose never commands it while dithering
+    is disabled.
+    """
+
+    handoverAttrs = ('shutterOpen', )  # kept when the thread is restarted
+
+    def __init__(self, actorState):
+        self.actorState = actorState
+        self.shutterOpen = None
+
+    def _keyVar(self, name):
+        return self.actorState.models['apogee'].keyVarDict[name]
+
+    def connect(self):
+        self._keyVar('shutterLimitSwitch').addCallback(self.shutterCB, callNow=True)
+
+    def disconnect(self):
+        self._keyVar('shutterLimitSwitch').removeCallback(self.shutterCB, doRaise=False)
+
+    def shutterCB(self, keyVar):
+        if keyVar[0] and not keyVar[1]:
+            self.shutterOpen = True
+        elif keyVar[1] and not keyVar[0]:
+            self.shutterOpen = False
+        else:
+            self.shutterOpen = None
+
+    def _skip(self, cmd, mechanism, position):
+        self.actorState.metrics.increment('apogee.skipped.%s' % mechanism)
+        cmd.inform('text="APOGEE %s already %s: not commanding move."' % (mechanism, position))
+
+    def shutter_needed(self, cmd, open):
+        """Return False (and count the skipped move) if the shutter is already open/closed."""
+        if self.shutterOpen is not None and self.shutterOpen == open:
+            self._skip(cmd, 'shutter', 'open' if open else 'closed')
+            return False
+        return True
+
+    def moved_shutter(self, open):
+        """Record a successful shutter move."""
+        self.shutterOpen = open
+
+
+class ApogeeProgress(object):
+    """
+    Follow the progress of the current APOGEE exposure and dither set.
+
+    Each utrReadState update during a dither set outputs the reads done and
+    remaining, and updates the etr of the running APOGEE sequences with the
+    time already spent on the current dither set.
+    """
+
+    etrCmdStates = ('doApogeeScience', 'doApogeeSkyFlats', 'doApogeeBossScience',
+                    'doApogeeMangaSequence')
+
+    def __init__(self, actorState):
+        self.actorState = actorState
+        self.lastRead = None  # (exposure name, read number, time) of the previous read
+        self.reset()
+
+    def _utrReadState(self):
+        return self.actorState.models['apogee'].keyVarDict['utrReadState']
+
+    def connect(self):
+        self._utrReadState().addCallback(self.readCB, callNow=False)
+
+    def disconnect(self):
+        self._utrReadState().removeCallback(self.readCB, doRaise=False)
+
+    def reset(self):
+        """Forget about the current dither set."""
+        self.cmd = None
+        self.nExposures = 0
+        self.expTime = 0
+        self.expIndex = 0
+        self.readNum = 0
+        self.nReads = 0
+
+    def start_set(self, cmd, nExposures, expTime):
+        """Start following a dither set of nExposures of expTime seconds each."""
+        self.reset()
+        self.cmd = cmd
+        self.nExposures = nExposures
+        self.expTime = expTime
+
+    def start_exposure(self, index):
+        """Start following exposure number index of the dither set."""
+        self.expIndex = index
+        self.readNum = 0
+
+    def elapsed(self):
+        """Return the seconds of exposure time already done in this dither set."""
+        fraction = float(self.readNum) / self.nReads if self.nReads else 0.
+        return (self.expIndex + fraction) * self.expTime
+
+    def reads(self):
+        """Return (reads done, reads remaining) for the current exposure and the dither set."""
+        expRemain = self.nReads - self.readNum
+        setDone = self.expIndex * self.nReads + self.readNum
+        setRemain = (self.nExposures - self.expIndex - 1) * self.nReads + expRemain
+        return self.readNum, expRemain, setDone, setRemain
+
+    def measure_cadence(self, expName, readNum):
+        """Record the time between two consecutive reads of the same exposure."""
+        now = time.time()
+        if self.lastRead is not None:
+            lastName, lastNum, lastTime = self.lastRead
+            if lastName == expName and readNum == lastNum + 1:
+                self.actorState.metrics.record('apogee.readTime', now - lastTime)
+        self.lastRead = (expName, readNum, now)
+
+    def readCB(self, keyVar):
+        """Update the progress and the sequence etrs after each read."""
+        try:
+            state = keyVar[1]
+            readNum = int(keyVar[2])
+            nReads = int(keyVar[3])
+        except (TypeError, ValueError, IndexError):
+            return
+        if str(state) != 'Reading' or nReads <= 0:
+            return
+
+        self.measure_cadence(keyVar[0], readNum)
+        if self.cmd is None:
+            return
+
+        self.readNum = readNum
+        self.nReads = nReads
+        self.cmd.inform('apogeeReads=%d,%d,%d,%d' % self.reads())
+
+        elapsed = self.elapsed()
+        for name in self.etrCmdStates:
+            cmdState = getattr(self.actorState, name, None)
+            if cmdState is not None and cmdState.cmd and cmdState.cmd.isAlive():
+                cmdState.update_etr_from_reads(elapsed)
+
+
+def do_apogee_dither_set(cmd, actorState, expTime, dithers, expType, comment, progress=None):
     """
     A set of exposures at multiple dither positions, moving the dither
     in between as needed.
+
+    If progress (an ApogeeProgress) is given, it follows the reads of the set.
     """
 
     # JSG: For SDSS-V we are not dithering, so we just hack it.
     currentDither = actorState.models['apogee'].keyVarDict['ditherPosition'][1]
     dithers = currentDither * len(dithers)
 
+    if progress is not None:
+        progress.start_set(cmd, len(dithers), expTime)
+
+    success = True
     for i, dither in enumerate(dithers):
         if actorState.aborting:
             cmd.warn('text="Primary command aborted: stopping APOGEE dither set."')
-            return False
+            success = False
+            break
+        if progress is not None:
+            progress.start_exposure(i)
         # currentDither = actorState.models['apogee'].keyVarDict['ditherPosition'][1]
         # Per ticket #1756, APOGEE now does not want dither move requests unless necessary
         # if dither == currentDither:
@@ -110,15 +267,121 @@ def do_apogee_dither_set(cmd, actorState, expTime, dithers, expType, comment):
         cmd.inform('apogeeDitherSet=%s,%d' % (dithers, i))
         success = do_expose(cmd, actorState, expTime, dither, expType, comment)
         if not success:
-            return False
-    cmd.inform('apogeeDitherSet=%s,%d' % (dithers, i + 1))
-    return True
+            break
+    else:
+        cmd.inform('apogeeDitherSet=%s,%d' % (dithers, i + 1))
+
+    if progress is not None:
+        progress.reset()
+    return success
+
+
+class LampFlash(object):
+    """The command and times of one flash, so that overlapping flashes keep their own."""
+
+    def __init__(self, cmd, triggerTime):
+        self.cmd = cmd
+        self.triggerTime = triggerTime
+        self.onSent = None
+        self.onDone = None
+        self.offSent = None
+
+
+class ReadSyncedLampFlasher(object):
+    """
+    Flash the flat field lamps in step with the APOGEE reads.
+
+    The mcp lamp commands are sent directly from the utrReadState callback
+    (which runs in the reactor thread) with a non-blocking cmdr call, rather
+    than going through the FF lamp thread queue, so the flash starts as close
+    to the read as possible. The lamps are turned off flashTime seconds after
+    the on command was sent.
+
+    The lamp thread's rules still apply: ignored lamps are never commanded,
+    and a failed command is an error unless the lamp_<name> bypass is set.
+
+    Latencies are recorded in actorState.metrics, and histograms of the
+    callback-to-command and command-to-on latencies are output after each flash.
+    """
+
+    flashTime = 4.0  # seconds
+    commandEdges = [0.001, 0.005, 0.01, 0.05, 0.1, 0.5]  # seconds
+    onEdges = [0.1, 0.25, 0.5, 1, 2, 5]  # seconds
+
+    def __init__(self, actorState, lampName='ff'):
+        self.actorState = actorState
+        self.lampName = lampName
+
+    def _call(self, cmd, action, callFunc):
+        self.actorState.gateway.bgCall(
+            callFunc=callFunc,
+            actor='mcp',
+            forUserCmd=cmd,
+            cmdStr='%s.%s' % (self.lampName, action),
+            timeLim=30.0)
+
+    def _histogram(self, cmd, name, edges):
+        """Output the histogram of the apogeeFlash.name latencies."""
+        counts = self.actorState.metrics.histogram('apogeeFlash.%s' % name, edges)
+        cmd.inform('apogeeFlashLatency=%s,%s' % (name, ','.join(str(n) for n in counts)))
+
+    def _failed(self, cmd, action):
+        """Report a failed lamp command, as the lamp thread would."""
+        bypassName = 'lamp_%s' % self.lampName
+        bypassed = myGlobals.bypass.get(name=bypassName)
+        self.actorState.metrics.increment('apogeeFlash.failed')
+        if bypassed:
+            cmd.warn('text="Ignoring failure on %s lamps %s for APOGEE flash"' %
+                     (self.lampName, action))
+        else:
+            cmd.error('text=%s' % qstr('Failed to turn %s lamps %s for APOGEE flash '
+                                       '(bypass(%s) = %s)' %
+                                       (self.lampName, action, bypassName, bypassed)))
+
+    def flash(self, cmd, triggerTime=None):
+        """Turn the lamps on now, and off again after flashTime seconds. Return the LampFlash."""
+        if self.lampName in ignore_lamps:
+            cmd.diag('text="ignoring %s flash"' % self.lampName)
+            return None
+        flash = LampFlash(cmd, triggerTime if triggerTime is not None else time.time())
+        flash.onSent = time.time()
+        self._call(cmd, 'on', lambda cmdVar: self.onCB(flash, cmdVar))
+        reactor.callLater(self.flashTime, self.off, flash)
+
+        self.actorState.metrics.record('apogeeFlash.callbackToCommand',
+                                       flash.onSent - flash.triggerTime)
+        self._histogram(cmd, 'callbackToCommand', self.commandEdges)
+        return flash
+
+    def off(self, flash):
+        """Turn the lamps off, ending flash."""
+        flash.offSent = time.time()
+        self._call(flash.cmd, 'off', lambda cmdVar: self.offCB(flash, cmdVar))
+
+    def onCB(self, flash, cmdVar):
+        flash.onDone = time.time()
+        if cmdVar.didFail:
+            self._failed(flash.cmd, 'on')
+            return
+        self.actorState.metrics.record('apogeeFlash.commandToOn', flash.onDone - flash.onSent)
+        self._histogram(flash.cmd, 'commandToOn', self.onEdges)
+
+    def offCB(self, flash, cmdVar):
+        if cmdVar.didFail:
+            self._failed(flash.cmd, 'off')
+            return
+        offDone = time.time()
+        metrics = self.actorState.metrics
+        metrics.record('apogeeFlash.commandToOff', offDone - flash.offSent)
+        if flash.onDone is not None:
+            metrics.record('apogeeFlash.onDuration', offDone - flash.onDone)
 
 
 class ApogeeCB(object):
 
     def __init__(self):
         self.cmd = myGlobals.actorState.actor.bcast
+        self.flasher = ReadSyncedLampFlasher(myGlobals.actorState)
         self.reset()
         myGlobals.actorState.models['apogee'].keyVarDict['utrReadState'].addCallback(
             self.listenToReads, callNow=True)
@@ -130,6 +393,7 @@ class ApogeeCB(object):
             self.listenToReads, doRaise=False)
 
     def listenToReads(self, key):
+        self.readTime = time.time()
         try:
             state = key[1]
             n = key[2]
@@ -175,26 +439,9 @@ class ApogeeCB(object):
 
         self.cb = cb if cb else self.flashLamps
 
-    def turnOffLamps(self):
-        self.cmd.diag('text="calling ff_lamp.off"')
-        replyQueue = sopActor.Queue('apogeeFlasher')
-        myGlobals.actorState.queues[sopActor.FF_LAMP].put(
-            Msg.LAMP_ON, cmd=self.cmd, on=False, replyQueue=replyQueue)
-        self.cmd.diag('text="called ff_lamp.off"')
-
     def flashLamps(self):
-        time2flash = 4.0  # seconds
-
-        replyQueue = sopActor.Queue('apogeeFlasher')
-        self.cmd.diag('text="calling ff_lamp.on"')
-        # NOTE: calling with noWait, so we don't wait for the mcp to respond.
-        # This prevents the problem where one lamp doesn't turn on within 4 seconds.
-        myGlobals.actorState.queues[sopActor.FF_LAMP].put(
-            Msg.LAMP_ON, cmd=self.cmd, on=True, replyQueue=replyQueue, noWait=True)
-
-        self.cmd.diag('text="called ff_lamp.on"')
-        self.cmd.diag('text="pausing..."')
-        reactor.callLater(time2flash, self.turnOffLamps)
+        self.cmd.diag('text="flashing %s lamps"' % self.flasher.lampName)
+        self.flasher.flash(self.cmd, getattr(self, 'readTime', None))
 
 
 def main(actor, queues):
@@ -204,7 +451,11 @@ def main(actor, queues):
     actorState = myGlobals.actorState
     timeout = actorState.timeout
 
-    # Set up readout callback object:
+    # Follow the reads of the dither sets, to keep the etrs up to date.
+    progress = ApogeeProgress(actorState)
+    progress.connect()
+    mechanisms = actorState.supervisor.adopt(threadName, ApogeeMechanisms(actorState))
+    mechanisms.connect()
 
     while True:
         try:
@@ -214,6 +465,8 @@ def main(actor, queues):
                 if msg.cmd:
                     msg.cmd.inform(
                         "text=\"Exiting thread %s\"" % (threading.current_thread().name))
+                progress.disconnect()
+                mechanisms.disconnect()
                 return
 
             elif msg.type == Msg.DITHER:
@@ -222,10 +475,14 @@ def main(actor, queues):
                              'Failed to move APOGEE dither to %s position.' % (msg.dither))
 
             elif msg.type == Msg.APOGEE_SHUTTER:
+                if not mechanisms.shutter_needed(msg.cmd, msg.open):
+                    msg.replyQueue.put(Msg.REPLY, cmd=msg.cmd, success=True)
+                    continue
                 position = 'open' if msg.open else 'close'
                 cmdVar = do_shutter(msg.cmd, actorState, position)
-                checkFailure(msg.cmd, msg.replyQueue, cmdVar,
-                             'Failed to %s APOGEE internal shutter.' % (position))
+                if not checkFailure(msg.cmd, msg.replyQueue, cmdVar,
+                                    'Failed to %s APOGEE internal shutter.' % (position)):
+                    mechanisms.moved_shutter(msg.open)
 
             elif msg.type == Msg.EXPOSE:
                 dither = getattr(msg, 'dither', None)
@@ -239,8 +496,14 @@ def main(actor, queues):
                 dithers = getattr(msg, 'dithers', 'AB')
                 expType = getattr(msg, 'expType', 'object')
                 comment = getattr(msg, 'comment', '')
-                success = do_apogee_dither_set(msg.cmd, actorState, msg.expTime, dithers, expType,
-                                               comment)
+                success = do_apogee_dither_set(
+                    msg.cmd,
+                    actorState,
+                    msg.expTime,
+                    dithers,
+                    expType,
+                    comment,
+                    progress=progress)
 
                 msg.replyQueue.put(Msg.EXPOSURE_FINISHED, cmd=msg.cmd, success=success)
 
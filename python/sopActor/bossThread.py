@@ -1,6 +1,7 @@
 """Thread to send commands to the BOSS camera."""
 import Queue
 import threading
+import time
 
 import sopActor
 import sopActor.myGlobals
@@ -42,7 +43,7 @@ def single_hartmann(cmd, actorState, replyQueue, expTime, mask):
 
     timeLim = expTime + 180.0  # seconds
     timeLim += 100
-    cmdVar = actorState.actor.cmdr.call(
+    cmdVar = actorState.gateway.call(
         actor='boss',
         forUserCmd=cmd,
         cmdStr=('exposure %s %s hartmann=%s' % (expType, expTimeCmd, mask)),
@@ -62,7 +63,7 @@ def hartmann(cmd, actorState, replyQueue, args):
     cmdStr = 'collimate'
     if args is not None:
         cmdStr = ' '.join((cmdStr, args))
-    cmdVar = actorState.actor.cmdr.call(
+    cmdVar = actorState.gateway.call(
         actor='hartmann', forUserCmd=cmd, cmdStr=cmdStr, keyVars=[], timeLim=timeLim)
 
     if cmdVar.didFail:
@@ -70,12 +71,233 @@ def hartmann(cmd, actorState, replyQueue, args):
     replyQueue.put(Msg.EXPOSURE_FINISHED, cmd=cmd, success=not cmdVar.didFail)
 
 
+def move_collimator(cmd, actorState, replyQueue, spec, a, b, c):
+    """Move the collimator motors of spectrograph spec by a, b, c ticks."""
+    cmdVar = actorState.gateway.call(
+        actor='boss',
+        forUserCmd=cmd,
+        cmdStr=('moveColl spec=%s a=%d b=%d c=%d' % (spec, a, b, c)),
+        keyVars=[],
+        timeLim=actorState.timeout)
+
+    if cmdVar.didFail:
+        cmd.warn('text="Failed to move collimator for %s"' % spec)
+    replyQueue.put(Msg.REPLY, cmd=cmd, success=not cmdVar.didFail)
+
+
+def move_collimator_for(msg, actorState, queue):
+    """
+    Move the collimator as MOVE_COLLIMATOR msg asks (in a helper thread), then
+    put COLLIMATOR_MOVED on the boss queue, so the boss thread sends the reply.
+    """
+    replyQueue = sopActor.Queue('bossCollimator')
+    move_collimator(msg.cmd, actorState, replyQueue, msg.spec, msg.a, msg.b, msg.c)
+    queue.put(Msg.COLLIMATOR_MOVED, msg.cmd, moveMsg=msg, success=replyQueue.get().success,
+              priority=Msg.HIGH)
+
+
+def exposure_description(msg):
+    """Return a short description of the exposure requested by msg."""
+    if msg.type == Msg.SINGLE_HARTMANN:
+        return '%gs %s Hartmann exposure' % (msg.expTime, msg.mask)
+    elif msg.type == Msg.HARTMANN:
+        return 'Hartmann collimation'
+    expType = getattr(msg, 'expType', '')
+    if msg.readout and msg.expTime <= 0:
+        return 'exposure readout'
+    return '%s%s exposure' % ((('%gs ' % msg.expTime) if msg.expTime > 0 else ''), expType)
+
+
+class ExposureController(object):
+    """
+    Run BOSS exposures without blocking the boss thread.
+
+    The boss command for an exposure (or Hartmann) is issued from a helper
+    thread, which puts an EXPOSURE_FINISHED message back on the boss queue
+    when the command completes. In the meantime the boss thread keeps serving
+    STATUS, STOP_EXPOSURE and QUEUE_STATUS messages; exposure requests that
+    arrive while one is running are kept in order and started afterwards.
+
+    The boss exposureState keyword is monitored so that the time spent
+    flushing, integrating and reading out is recorded in actorState.metrics.
+    """
+
+    phaseNames = {'FLUSHING': 'flush', 'INTEGRATING': 'integrate', 'READING': 'read'}
+
+    def __init__(self, actorState, queue):
+        self.actorState = actorState
+        self.queue = queue
+        self.current = None  # the message for the running exposure
+        self.startTime = None
+        self.pending = []  # exposure messages waiting for the current one to finish
+
+        self._lock = threading.Lock()
+        self._phase = None
+        self._phaseStart = None
+        self._phaseTimes = {}
+
+    def _exposureStateKey(self):
+        try:
+            return self.actorState.models['boss'].keyVarDict['exposureState']
+        except (AttributeError, KeyError):
+            return None
+
+    def connect(self):
+        """Start monitoring the boss exposureState."""
+        keyVar = self._exposureStateKey()
+        if keyVar is not None:
+            keyVar.addCallback(self.exposureStateCB, callNow=False)
+
+    def disconnect(self):
+        """Stop monitoring the boss exposureState."""
+        keyVar = self._exposureStateKey()
+        if keyVar is not None:
+            keyVar.removeCallback(self.exposureStateCB, doRaise=False)
+
+    def exposureStateCB(self, keyVar):
+        """Time the transitions between the boss exposure states."""
+        state = keyVar[0]
+        if state is None:
+            return
+        state = state.upper()
+        now = time.time()
+        with self._lock:
+            if state == self._phase:
+                return
+            if self._phase in self.phaseNames:
+                name = self.phaseNames[self._phase]
+                duration = now - self._phaseStart
+                self._phaseTimes[name] = duration
+                self.actorState.metrics.record('boss.%s' % name, duration)
+            self._phase = state
+            self._phaseStart = now
+
+    @property
+    def busy(self):
+        """True if an exposure is running or waiting to run."""
+        return self.current is not None or bool(self.pending)
+
+    def submit(self, msg):
+        """Start the exposure requested by msg, or queue it if one is running."""
+        if self.current is not None:
+            msg.cmd.inform('text="BOSS is busy with %s: queueing %s"' %
+                           (exposure_description(self.current), exposure_description(msg)))
+            self.pending.append(msg)
+        else:
+            self.start(msg)
+
+    def start(self, msg):
+        """Issue the boss command for msg from a helper thread."""
+        self.current = msg
+        self.startTime = time.time()
+        with self._lock:
+            self._phaseTimes = {}
+
+        if msg.type == Msg.EXPOSE:
+            msg.cmd.respond('text="starting %s"' % exposure_description(msg))
+            target = self._expose
+        elif msg.type == Msg.SINGLE_HARTMANN:
+            target = self._single_hartmann
+        else:
+            target = self._hartmann
+
+        worker = threading.Thread(target=target, args=(msg, ), name='bossExposure')
+        worker.daemon = True
+        worker.start()
+
+    def _finished(self, msg, success):
+        """Tell the boss thread that the command for msg has completed."""
+        self.queue.put(
+            Msg.EXPOSURE_FINISHED, msg.cmd, exposeMsg=msg, success=success, priority=Msg.HIGH)
+
+    def _expose(self, msg):
+        expType = getattr(msg, 'expType', '')
+        expTimeCmd, readoutCmd = getExpTimeCmd(msg.expTime, expType, msg.cmd, msg.readout)
+        timeLim = msg.expTime + 180.0  # seconds
+        timeLim += 100
+        cmdVar = self.actorState.gateway.call(
+            actor='boss',
+            forUserCmd=msg.cmd,
+            cmdStr=('exposure %s %s %s' % (expType, expTimeCmd, readoutCmd)),
+            keyVars=[],
+            timeLim=timeLim)
+        self._finished(msg, not cmdVar.didFail)
+
+    def _single_hartmann(self, msg):
+        replyQueue = sopActor.Queue('bossHartmann')
+        single_hartmann(msg.cmd, self.actorState, replyQueue, msg.expTime, msg.mask)
+        self._finished(msg, replyQueue.get().success)
+
+    def _hartmann(self, msg):
+        replyQueue = sopActor.Queue('bossHartmann')
+        hartmann(msg.cmd, self.actorState, replyQueue, getattr(msg, 'args', None))
+        self._finished(msg, replyQueue.get().success)
+
+    def finish(self, msg):
+        """Reply to the exposure that has just completed and start the next one."""
+        exposeMsg = msg.exposeMsg
+        if exposeMsg.type == Msg.EXPOSE:
+            if not msg.success:
+                exposeMsg.cmd.error('text="BOSS failed on %s"' % exposure_description(exposeMsg))
+            if getattr(exposeMsg, 'finish_msg', False):
+                exposeMsg.cmd.inform(exposeMsg.finish_msg)
+
+        with self._lock:
+            phaseTimes = dict(self._phaseTimes)
+        if phaseTimes:
+            exposeMsg.cmd.inform('bossExposurePhases=%s' % ','.join(
+                '%0.1f' % phaseTimes.get(name, 0) for name in ('flush', 'integrate', 'read')))
+
+        exposeMsg.replyQueue.put(
+            Msg.EXPOSURE_FINISHED, cmd=exposeMsg.cmd, success=msg.success, request=exposeMsg)
+
+        # The reply may be for an exposure started before a thread restart.
+        if exposeMsg is self.current:
+            self.actorState.metrics.record('boss.exposure', time.time() - self.startTime)
+            self.current = None
+            self.startTime = None
+            if self.pending:
+                self.start(self.pending.pop(0))
+
+    def stop(self, cmd, clear_queue=False):
+        """Drop the pending exposures (the running one is stopped by the caller)."""
+        if not clear_queue:
+            return
+        dropped = self.pending
+        self.pending = []
+
+        # Also remove exposures that are still sitting on the queue itself, leaving the
+        # other messages, with their original senders, where they are.
+        dropped += self.queue.remove(
+            lambda msg: msg.type in (Msg.EXPOSE, Msg.SINGLE_HARTMANN, Msg.HARTMANN))
+
+        for msg in dropped:
+            msg.replyQueue.put(Msg.REPLY, cmd=cmd, success=False)
+        if dropped:
+            cmd.warn('text="cleared %d pending BOSS exposures."' % len(dropped))
+
+    def genKeys(self, cmd):
+        """Output the running and pending exposures."""
+        if self.current is not None:
+            current = exposure_description(self.current)
+            elapsed = time.time() - self.startTime
+        else:
+            current = 'idle'
+            elapsed = 0
+        cmd.inform('bossExposureQueue=%s,%0.1f,%d' % (qstr(current), elapsed, len(self.pending)))
+        for msg in self.pending:
+            cmd.inform('text="pending: %s"' % exposure_description(msg))
+
+
 def main(actor, queues):
     """Main loop for boss ICC thread"""
 
     threadName = 'boss'
     actorState = sopActor.myGlobals.actorState
     timeout = actorState.timeout
+    controller = actorState.supervisor.adopt(
+        threadName, ExposureController(actorState, queues[sopActor.BOSS_ACTOR]))
+    controller.connect()
 
     while True:
         try:
@@ -85,44 +307,43 @@ def main(actor, queues):
                 if msg.cmd:
                     msg.cmd.inform(
                         "text=\"Exiting thread %s\"" % (threading.current_thread().name))
+                controller.disconnect()
 
                 return
 
-            elif msg.type == Msg.EXPOSE:
-                expType = getattr(msg, 'expType', '')
-                if msg.readout and msg.expTime <= 0:
-                    cmdTxt = 'exposure readout'
-                else:
-                    cmdTxt = '%s%s exposure' % (((('%gs ' % msg.expTime)
-                                                  if msg.expTime > 0 else ''), expType))
-                msg.cmd.respond('text="starting %s"' % cmdTxt)
-                expTimeCmd, readoutCmd = getExpTimeCmd(msg.expTime, expType, msg.cmd, msg.readout)
-
-                timeLim = msg.expTime + 180.0  # seconds
-                timeLim += 100
-                cmdVar = actorState.actor.cmdr.call(
-                    actor='boss',
-                    forUserCmd=msg.cmd,
-                    cmdStr=('exposure %s %s %s' % (expType, expTimeCmd, readoutCmd)),
-                    keyVars=[],
-                    timeLim=timeLim)
-                if cmdVar.didFail:
-                    msg.cmd.error('text="BOSS failed on %s"' % cmdTxt)
-
-                if getattr(msg, 'finish_msg', False):
-                    msg.cmd.inform(msg.finish_msg)
-
-                msg.replyQueue.put(Msg.EXPOSURE_FINISHED, cmd=msg.cmd, success=not cmdVar.didFail)
-
-            elif msg.type == Msg.SINGLE_HARTMANN:
-                single_hartmann(msg.cmd, actorState, msg.replyQueue, msg.expTime, msg.mask)
-
-            elif msg.type == Msg.HARTMANN:
-                args = getattr(msg, 'args', None)
-                hartmann(msg.cmd, actorState, msg.replyQueue, args)
+            elif msg.type in (Msg.EXPOSE, Msg.SINGLE_HARTMANN, Msg.HARTMANN):
+                controller.submit(msg)
+
+            elif msg.type == Msg.EXPOSURE_FINISHED:
+                controller.finish(msg)
+
+            elif msg.type == Msg.MOVE_COLLIMATOR:
+                # Collimator moves don't queue behind the exposures: each one runs
+                # in its own thread, so both spectrographs move at once, and can
+                # move while the chips read out. We reply once it is done, so the
+                # reply comes from the boss thread, like the others.
+                mover = threading.Thread(
+                    target=move_collimator_for,
+                    args=(msg, actorState, queues[sopActor.BOSS_ACTOR]),
+                    name='bossCollimator')
+                mover.daemon = True
+                mover.start()
+
+            elif msg.type == Msg.COLLIMATOR_MOVED:
+                msg.moveMsg.replyQueue.put(Msg.REPLY, cmd=msg.cmd, success=msg.success)
+
+            elif msg.type == Msg.STOP_EXPOSURE:
+                controller.stop(msg.cmd, getattr(msg, 'clear_queue', False))
+                if getattr(msg, 'replyQueue', None) is not None:
+                    msg.replyQueue.put(Msg.REPLY, cmd=msg.cmd, success=True)
+
+            elif msg.type == Msg.QUEUE_STATUS:
+                controller.genKeys(msg.cmd)
+                msg.replyQueue.put(Msg.REPLY, cmd=msg.cmd, success=True)
 
             elif msg.type == Msg.STATUS:
                 msg.cmd.inform('text="%s thread"' % threadName)
+                controller.genKeys(msg.cmd)
                 msg.replyQueue.put(Msg.REPLY, cmd=msg.cmd, success=True)
             else:
                 raise ValueError, ('Unknown message type %s' % msg.type)
@@ -71,7 +71,7 @@ def main(actor, queues):
                     ffsStatusKey = actorState.models['mcp'].keyVarDict['ffsStatus']
 
                     timeLim = 120.0  # seconds
-                    cmdVar = actorState.actor.cmdr.call(
+                    cmdVar = actorState.gateway.call(
                         actor='mcp',
                         forUserCmd=cmd,
                         cmdStr=('ffs.%s' % action),
@@ -32,7 +32,7 @@ def main(actor, queues):
                 msg.cmd.respond('text="starting gcamera exposure"')
 
                 timeLim = msg.expTime + 180.0  # seconds
-                cmdVar = actorState.actor.cmdr.call(
+                cmdVar = actorState.gateway.call(
                     actor='gcamera',
                     forUserCmd=msg.cmd,
                     cmdStr=('%s time=%g cartridge=%d' % (msg.expType, msg.expTime, msg.cartridge)),
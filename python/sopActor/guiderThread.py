@@ -1,5 +1,6 @@
 import Queue
 import threading
+import time
 
 import sopActor.myGlobals
 from opscore.utility.qstr import qstr
@@ -32,7 +33,7 @@ def guider_start(cmd, replyQueue, actorState, start, expTime, clearCorrections,
 
     if clearCorrections:
         for corr in ('axes', 'scale', 'focus'):
-            cmdVar = actorState.actor.cmdr.call(
+            cmdVar = actorState.gateway.call(
                 actor='guider', forUserCmd=cmd, cmdStr=('%s off' % (corr)), keyVars=[], timeLim=3)
             if cmdVar.didFail:
                 cmd.error('text="failed to disable %s guider corrections!!!"' % (corr))
@@ -45,7 +46,7 @@ def guider_start(cmd, replyQueue, actorState, start, expTime, clearCorrections,
     timeLim = expTime + 15  # seconds
 
     cmdStr = '%s %s %s %s' % (('on' if start else 'off'), time_text(expTime), force, oneExposure)
-    cmdVar = actorState.actor.cmdr.call(
+    cmdVar = actorState.gateway.call(
         actor='guider', forUserCmd=cmd, cmdStr=cmdStr, keyVars=[], timeLim=timeLim)
     if start and not oneExposure:
         # The value of the guider.guideState keyword tells us if it started successfully:
@@ -75,7 +76,7 @@ def decenter(cmd, state, actorState):
     """Activate or deactive decentered guiding."""
     cmd.respond('text="Turning decentered guiding %s."' % state)
     timeLim = 60  # could take as long as a 3xstack.
-    cmdVar = actorState.actor.cmdr.call(
+    cmdVar = actorState.gateway.call(
         actor='guider',
         forUserCmd=cmd,
         cmdStr='decenter %s' % (state),
@@ -91,7 +92,7 @@ def manga_dither(cmd, dither, actorState):
     cmd.respond('text=%s' % qstr('Changing guider dither position to %s.' % dither))
     timeLim = 60  # could take as long as a long guider exposure+readout, etc.
     ditherPos = 'ditherPos=%s' % dither
-    cmdVar = actorState.actor.cmdr.call(
+    cmdVar = actorState.gateway.call(
         actor='guider',
         forUserCmd=cmd,
         cmdStr='mangaDither %s' % (ditherPos),
@@ -103,6 +104,127 @@ def manga_dither(cmd, dither, actorState):
     return not cmdVar.didFail
 
 
+def is_decentered(actorState):
+    """Return True if the guider currently has decenter mode active."""
+    return bool(actorState.models['guider'].keyVarDict['decenter'][1])
+
+
+def at_manga_dither(actorState, dither):
+    """Return True if the guider currently is at the requested mangaDither position."""
+    return actorState.models['guider'].keyVarDict['mangaDither'][0] == dither
+
+
+def dither_transition(cmd, actorState, dither, timeLim=60, metric='ditherTransition'):
+    """
+    Activate decentered guiding and move to a MaNGA dither position in one step.
+
+    Only the commands that are not already satisfied are sent, in order:
+    mangaDither is sent once the guider has decentered (its decenter keyword
+    confirms it, or decenter on returns), and not at all if decenter on fails.
+    We finish as soon as the decenter and mangaDither keywords confirm the new
+    state, instead of waiting for the guider commands to return, which can
+    take up to a full guider exposure; if the keywords never confirm, we fall
+    back on the status of the commands themselves. A command that fails after
+    the keywords confirmed is warned about.
+
+    The time it took is recorded in actorState.metrics as metric.
+    """
+
+    startTime = time.time()
+    guiderModel = actorState.models['guider']
+
+    cmdStrs = []
+    if not is_decentered(actorState):
+        cmdStrs.append('decenter on')
+    if not at_manga_dither(actorState, dither):
+        cmdStrs.append('mangaDither ditherPos=%s' % dither)
+
+    if not cmdStrs:
+        cmd.inform('text=%s' % qstr('Guider already decentered at dither %s.' % dither))
+        actorState.metrics.increment('%s.skipped' % metric)
+        return True
+
+    cmd.respond('text=%s' % qstr('Changing guider to decentered dither %s.' % dither))
+
+    changed = threading.Event()  # a keyword changed or a command returned
+    decentered = threading.Event()  # mangaDither can be sent
+    confirmed = threading.Event()  # we have replied that it succeeded
+    cmdVars = {}
+
+    if 'decenter on' not in cmdStrs:
+        decentered.set()
+
+    def check_keywords(*args):
+        if is_decentered(actorState):
+            decentered.set()
+        changed.set()
+
+    def call(cmdStr):
+        cmdVar = actorState.gateway.call(
+            actor='guider', forUserCmd=cmd, cmdStr=cmdStr, keyVars=[], timeLim=timeLim)
+        cmdVars[cmdStr] = cmdVar
+        if cmdStr == 'decenter on':
+            decentered.set()
+        if confirmed.is_set() and cmdVar.didFail:
+            actorState.actor.bcast.warn('text=%s' % qstr(
+                'guider %s failed after the dither transition was confirmed.' % cmdStr))
+        changed.set()
+        return cmdVar
+
+    def send():
+        if 'decenter on' in cmdStrs:
+            decenterCaller = threading.Thread(target=call, args=('decenter on', ),
+                                              name='guiderTransition')
+            decenterCaller.daemon = True
+            decenterCaller.start()
+        if cmdStrs[-1] == 'decenter on':
+            return
+        decentered.wait(startTime + timeLim - time.time())
+        decenterVar = cmdVars.get('decenter on')
+        if not decentered.is_set() or (decenterVar is not None and decenterVar.didFail):
+            return
+        call(cmdStrs[-1])
+
+    for keyName in ('decenter', 'mangaDither'):
+        guiderModel.keyVarDict[keyName].addCallback(check_keywords, callNow=False)
+
+    try:
+        sender = threading.Thread(target=send, name='guiderTransition')
+        sender.daemon = True
+        sender.start()
+
+        success = False
+        endTime = startTime + timeLim
+        while time.time() < endTime:
+            changed.wait(endTime - time.time())
+            changed.clear()
+            if any(cmdVar.didFail for cmdVar in cmdVars.values()):
+                break
+            if is_decentered(actorState) and at_manga_dither(actorState, dither):
+                success = True
+                break
+            if len(cmdVars) == len(cmdStrs):
+                # Everything returned successfully, even if the keywords did not tell us.
+                success = True
+                break
+        if success:
+            confirmed.set()
+    finally:
+        for keyName in ('decenter', 'mangaDither'):
+            guiderModel.keyVarDict[keyName].removeCallback(check_keywords, doRaise=False)
+
+    latency = time.time() - startTime
+    if success:
+        actorState.metrics.record(metric, latency)
+        cmd.inform('ditherTransition=%s,%0.1f,%d' % (qstr(dither), latency, len(cmdStrs)))
+    else:
+        failed = ([cmdStr for cmdStr in cmdStrs if cmdStr in cmdVars and cmdVars[cmdStr].didFail] or
+                  [cmdStr for cmdStr in cmdStrs if cmdStr not in cmdVars])
+        cmd.error('text=%s' % qstr('Failed to change guider to decentered dither %s: %s' %
+                                   (dither, ', '.join(failed))))
+    return success
+
+
 def main(actor, queues):
     """Main loop for guider thread"""
 
@@ -127,7 +249,7 @@ def main(actor, queues):
                                                     if msg.on else 'disabling'), msg.what))
 
                 timeLim = 10
-                cmdVar = actorState.actor.cmdr.call(
+                cmdVar = actorState.gateway.call(
                     actor='guider',
                     forUserCmd=msg.cmd,
                     cmdStr=('%s %s' % (msg.what, 'on' if msg.on else 'off')),
@@ -158,7 +280,7 @@ def main(actor, queues):
                 timeLim = expTime
                 timeLim += 30
 
-                cmdVar = actorState.actor.cmdr.call(
+                cmdVar = actorState.gateway.call(
                     actor='guider',
                     forUserCmd=msg.cmd,
                     cmdStr='flat %s' % (expTimeOpt),
@@ -177,6 +299,11 @@ def main(actor, queues):
                 success = manga_dither(msg.cmd, msg.dither, actorState)
                 msg.replyQueue.put(Msg.DONE, cmd=msg.cmd, success=success)
 
+            elif msg.type == Msg.DITHER_TRANSITION:
+                metric = getattr(msg, 'metric', 'ditherTransition')
+                success = dither_transition(msg.cmd, actorState, msg.dither, metric=metric)
+                msg.replyQueue.put(Msg.DONE, cmd=msg.cmd, success=success)
+
             elif msg.type == Msg.STATUS:
                 msg.cmd.inform('text="%s thread"' % threadName)
                 msg.replyQueue.put(Msg.REPLY, cmd=msg.cmd, success=True)
@@ -39,8 +39,12 @@ class LampHandler(object):
 
         # seconds
         timeLim = 0.1 if noWait else 30.0
-        cmdVar = self.actorState.actor.cmdr.call(
-            actor='mcp', forUserCmd=cmd, cmdStr=('%s.%s' % (self.name, action)), timeLim=timeLim)
+        cmdVar = self.actorState.gateway.call(
+            actor='mcp',
+            forUserCmd=cmd,
+            cmdStr=('%s.%s' % (self.name, action)),
+            timeLim=timeLim,
+            retry=not noWait)
         if noWait:
             cmd.warn('text="Not waiting for response from: %s %s"' % (self.lampName, action))
             replyQueue.put(Msg.LAMP_COMPLETE, cmd=cmd, success=True)
@@ -15,8 +15,11 @@ import numpy
 
 import sopActor
 import sopActor.myGlobals as myGlobals
+from opscore.utility.qstr import qstr
 from sopActor import Msg
 from sopActor.multiCommand import MultiCommand, Precondition
+from sopActor.utils import calibplan, coobserving
+from sopActor.utils.calibrations import CalibrationRegistry
 
 
 class SopPrecondition(Precondition):
@@ -26,8 +29,10 @@ class SopPrecondition(Precondition):
     scheduled and then run.
     """
 
-    def __init__(self, queueName, msgId=None, timeout=None, **kwargs):
+    def __init__(self, queueName, msgId=None, timeout=None, partialWarmup=False, **kwargs):
         Precondition.__init__(self, queueName, msgId, timeout, **kwargs)
+        # Only wait until the lamp flux model says the lamp is bright enough.
+        self.partialWarmup = partialWarmup
 
     def required(self):
         """
@@ -36,7 +41,10 @@ class SopPrecondition(Precondition):
         Thus, self.required() will tell you whether you have to run the
         command to get the system into the desired state.
         Also accounts for lamp warm-up time, so if the lamp was turned on
-        and enough time has passed, it is ok, but if not, require (the full time).
+        and enough time has passed, it is ok, but if not, require (the remaining
+        time). A lamp that is off still counts the warmth it kept from before.
+        With partialWarmup, the warm-up time is shortened to when the lamp's
+        flux model reaches its minimum flux.
         """
 
         if self.queueName in myGlobals.warmupTime.keys():
@@ -45,10 +53,11 @@ class SopPrecondition(Precondition):
             isOn, timeSinceTransition = self.lampIsOn(self.queueName)
             # we want to turn them on
             if self.kwargs.get('on'):
-                # we want the time since turn on
-                if not isOn:
-                    timeSinceTransition = 0
+                # timeSinceTransition is how warm the lamp is, even if it is off
                 warmupTime = myGlobals.warmupTime[self.queueName]
+                lampFlux = getattr(myGlobals.actorState, 'lampFlux', {}).get(self.queueName)
+                if self.partialWarmup and lampFlux is not None:
+                    warmupTime = min(warmupTime, lampFlux.ready_time())
                 # how long until they're ready
                 delay = warmupTime - timeSinceTransition
                 if delay > 0:
@@ -84,6 +93,9 @@ class SopPrecondition(Precondition):
             elif self.msgId == Msg.MANGA_DITHER:
                 dither = self.kwargs.get('dither')
                 return not self.atCorrectMangaDither(dither)
+            elif self.msgId == Msg.DITHER_TRANSITION:
+                dither = self.kwargs.get('dither')
+                return not (self.isDecentered() and self.atCorrectMangaDither(dither))
 
         return True
 
@@ -123,9 +135,16 @@ class SopPrecondition(Precondition):
     def lampIsOn(self, queueName):
         """
         Return (True iff some lamps are on, timeSinceTransition)
-        The transition time can be used to determine if a lamp has been on long enough.
+        The transition time can be used to determine if a lamp has been on long enough,
+        and is 0 for a lamp that is off.
+        If the lamp state tracker knows the lamp, the time is its warmth instead,
+        which includes what it kept from before it was last turned off.
         """
 
+        lampState = getattr(myGlobals.actorState, 'lampState', None)
+        if lampState is not None and lampState.known(queueName):
+            return lampState.is_on(queueName), lampState.warmth(queueName)
+
         if queueName == sopActor.FF_LAMP:
             status = myGlobals.actorState.models['mcp'].keyVarDict['ffLamp']
         elif queueName == sopActor.HGCD_LAMP:
@@ -147,7 +166,9 @@ class SopPrecondition(Precondition):
         for i in status:
             on += i
 
-        return (True if on == 4 else False), (time.time() - status.timestamp)
+        if on != 4:
+            return False, 0
+        return True, (time.time() - status.timestamp)
 
     def isDecentered(self):
         """Return true if the guider currently has decenter mode active."""
@@ -165,6 +186,7 @@ ffsDuration = 15                # move the FFS
 flushDuration = 25              # flush the chips prior to an exposure
 guiderReadoutDuration = 1       # readout the guider
 hartmannDuration = 240          # take a Hartmann sequence and move the collimators
+collimatorDuration = 20         # move a BOSS collimator
 readoutDuration = 82            # read the BOSS chips
 guiderDecenterDuration = 30     # Applying decenters could take as long as the longest
                                 # reasonable guider exposure
@@ -174,8 +196,23 @@ class SopMultiCommand(MultiCommand):
     """A MultiCommand for sop that knows about how long sop commands take to execute"""
 
     def __init__(self, cmd, timeout, label, *args, **kwargs):
+        self.readouts = []  # (BossExposureLedger, readout msg, expTypes it reads out)
         MultiCommand.__init__(self, cmd, timeout, label, *args, **kwargs)
 
+    def finish(self, runningPreconditions=False):
+        """
+        Wait for the commands to reply. The exposures of a readout that did not
+        succeed (it failed, timed out, or was never sent) are unread again.
+        """
+        success = MultiCommand.finish(self, runningPreconditions)
+        if not runningPreconditions:
+            for ledger, msg, expTypes in self.readouts:
+                if not any(getattr(reply, 'request', None) is msg and reply.success
+                           for reply in self.replies):
+                    ledger.unread[:0] = expTypes
+            self.readouts = []
+        return success
+
     # NOTE: TBD: The durations here need to be expanded to incorporate all the
     # various other cases, and then we need a way to output it and have an
     # internal countdown timer to make it actually useful.
@@ -198,6 +235,95 @@ class SopMultiCommand(MultiCommand):
                     msg.duration += readoutDuration
         elif msg.type == Msg.HARTMANN:
             msg.duration = hartmannDuration
+        elif msg.type == Msg.MOVE_COLLIMATOR:
+            msg.duration = collimatorDuration
+
+
+class BossExposureLedger(object):
+    """
+    Keep track of the BOSS exposures that have been taken without a readout.
+
+    Every exposure issued with readout=False through expose() is recorded,
+    and the matching readout is appended to the next MultiCommand built with
+    overlap(), so that the readout runs in parallel with whatever that step
+    does (lamps, FFS, dither change). An exposure only counts as read out once
+    boss has replied that its readout succeeded: if the readout fails, or the
+    MultiCommand is aborted before sending it, the exposure is unread again.
+    cleanup() reads out anything left over, even when the command has been
+    aborted.
+    """
+
+    def __init__(self, cmd, cmdState, actorState):
+        self.cmd = cmd
+        self.cmdState = cmdState
+        self.actorState = actorState
+        self.unread = []  # the expTypes of the exposures with no readout scheduled
+
+    @property
+    def pending(self):
+        """True if there is an exposure waiting to be read out."""
+        return len(self.unread) > 0
+
+    def expose(self, multiCmd, expTime, expType, readout=True, **kwargs):
+        """Append a BOSS exposure to multiCmd, recording it if it will not be read out."""
+        # The chips can only hold one exposure: read the previous one out first.
+        self.readout(multiCmd)
+        multiCmd.append(
+            sopActor.BOSS_ACTOR,
+            Msg.EXPOSE,
+            expTime=expTime,
+            expType=expType,
+            readout=readout,
+            **kwargs)
+        if not readout:
+            self.unread.append(expType)
+
+    def readout(self, multiCmd):
+        """
+        Append the readout of the unread exposure to SopMultiCommand multiCmd,
+        if there is one. It stays multiCmd's to read out until multiCmd finishes.
+        """
+        if not self.pending:
+            return False
+        multiCmd.append(sopActor.BOSS_ACTOR, Msg.EXPOSE, expTime=-1, readout=True)
+        multiCmd.timeout += readoutDuration
+        multiCmd.readouts.append((self, multiCmd.commands[-1][2], self.unread))
+        self.unread = []
+        return True
+
+    def overlap(self, timeout, label):
+        """
+        Return a new SopMultiCommand that reads out any unread exposure.
+
+        Append the next step to it, so that it happens during the readout.
+        """
+        multiCmd = SopMultiCommand(self.cmd, timeout, label)
+        self.readout(multiCmd)
+        return multiCmd
+
+    def cleanup(self, label):
+        """Read out any unread exposure, even if we are aborting. Return False on failure."""
+        if not self.pending:
+            return True
+
+        success = run_even_if_aborting(self.overlap(self.actorState.timeout, label),
+                                       self.actorState)
+        if not success:
+            self.cmd.error('text="Failed to readout last exposure"')
+        return success
+
+
+def run_even_if_aborting(multiCmd, actorState):
+    """Run multiCmd, even if the command has been aborted. Return its status."""
+    # If we get here when the command has been aborted the multicommand
+    # won't do anything unless we set ignoreAborting to True.
+    ignoreAborting = getattr(actorState, 'ignoreAborting', False)
+    if actorState.aborting is True:
+        actorState.ignoreAborting = True
+    try:
+        return multiCmd.run()
+    finally:
+        actorState.ignoreAborting = ignoreAborting
 
 
 def doLamps(cmd,
@@ -228,7 +354,7 @@ def doLamps(cmd,
     # There's no Hartmann thread, so just open them synchronously for now.  This should be rare.
     #
     if openHartmann is not None:
-        cmdVar = actorState.actor.cmdr.call(
+        cmdVar = actorState.gateway.call(
             actor='boss',
             forUserCmd=cmd,
             cmdStr=('hartmann out'),
@@ -272,15 +398,22 @@ def prep_lamps_off(multiCmd, precondition=False):
         multiCmd.append(sopActor.NE_LAMP, Msg.LAMP_ON, on=False)
 
 
-def prep_for_arc(multiCmd, precondition=False):
-    """Prepare for an arc/hartmann, by closing the FFS and turning on arc lamps."""
+def prep_for_arc(multiCmd, precondition=False, partialWarmup=False):
+    """
+    Prepare for an arc/hartmann, by closing the FFS and turning on arc lamps.
+
+    With partialWarmup, the precondition only waits until the lamps are bright
+    enough for an arc with a scaled exposure time (see arc_exposure_time).
+    """
     if precondition:
         multiCmd.append(SopPrecondition(sopActor.FFS, Msg.FFS_MOVE, open=False))
         multiCmd.append(SopPrecondition(sopActor.WHT_LAMP, Msg.LAMP_ON, on=False))
         multiCmd.append(SopPrecondition(sopActor.UV_LAMP, Msg.LAMP_ON, on=False))
         multiCmd.append(SopPrecondition(sopActor.FF_LAMP, Msg.LAMP_ON, on=False))
-        multiCmd.append(SopPrecondition(sopActor.HGCD_LAMP, Msg.LAMP_ON, on=True))
-        multiCmd.append(SopPrecondition(sopActor.NE_LAMP, Msg.LAMP_ON, on=True))
+        multiCmd.append(
+            SopPrecondition(sopActor.HGCD_LAMP, Msg.LAMP_ON, partialWarmup=partialWarmup, on=True))
+        multiCmd.append(
+            SopPrecondition(sopActor.NE_LAMP, Msg.LAMP_ON, partialWarmup=partialWarmup, on=True))
     else:
         multiCmd.append(sopActor.FFS, Msg.FFS_MOVE, open=False)
         multiCmd.append(sopActor.WHT_LAMP, Msg.LAMP_ON, on=False)
@@ -290,6 +423,41 @@ def prep_for_arc(multiCmd, precondition=False):
         multiCmd.append(sopActor.NE_LAMP, Msg.LAMP_ON, on=True)
 
 
+def hint_arc_lamps(cmd, actorState, neededAt):
+    """
+    Tell the lamp state tracker that the arc lamps will be needed at neededAt,
+    and report how long after being turned on now each would be warm.
+    """
+    now = time.time()
+    for queue, name in ((sopActor.HGCD_LAMP, 'HgCd'), (sopActor.NE_LAMP, 'Ne')):
+        actorState.lampState.hint(queue, neededAt)
+        readyIn = actorState.lampState.time_until_warm(queue, myGlobals.warmupTime[queue], now)
+        cmd.inform('lampPrewarm=%s,%0.1f,%0.1f' % (name, neededAt - now, readyIn))
+
+
+def arc_exposure_time(cmd, actorState, expTime):
+    """
+    Return the arc exposure time that collects the counts of expTime with
+    fully warm lamps, given how warm the HgCd lamps will be when it starts.
+    """
+    lampFlux = actorState.lampFlux.get(sopActor.HGCD_LAMP)
+    if lampFlux is None or expTime <= 0:
+        return expTime
+    try:
+        isOn, timeSinceTransition = SopPrecondition(None).lampIsOn(sopActor.HGCD_LAMP)
+    except RuntimeError:
+        return expTime
+
+    # The exposure can't start before the partial warm-up precondition is met.
+    start = max(timeSinceTransition, lampFlux.ready_time())
+    if start >= myGlobals.warmupTime[sopActor.HGCD_LAMP]:
+        return expTime
+    scaled = round(lampFlux.scaled_exposure(start, expTime), 1)
+    cmd.inform('arcExposureScaling=%0.1f,%0.3f,%g,%0.1f' % (start, lampFlux.flux(start), expTime,
+                                                           scaled))
+    return scaled
+
+
 def prep_quick_hartmann(multiCmd):
     """Prepare for quick Hartmanns, which don't need the HgCd lamps fully warm."""
     multiCmd.append(SopPrecondition(sopActor.FFS, Msg.FFS_MOVE, open=False))
@@ -325,6 +493,12 @@ def prep_lamps_for_flat(multiCmd, precondition=False):
         multiCmd.append(sopActor.NE_LAMP, Msg.LAMP_ON, on=False)
 
 
+def prep_collimator_move(multiCmd, spN, move):
+    """Move the collimators of the spectrographs in spN together, by move ticks in focus."""
+    for sp in spN:
+        multiCmd.append(sopActor.BOSS_ACTOR, Msg.MOVE_COLLIMATOR, spec=sp, a=move, b=move, c=-move)
+
+
 def prep_apogee_shutter(multiCmd, open=True):
     """Open or close the APOGEE shutter, as a precondition."""
     multiCmd.append(SopPrecondition(sopActor.APOGEE, Msg.APOGEE_SHUTTER, open=open))
@@ -359,12 +533,14 @@ def prep_guider_decenter_off(multiCmd, precondition=True):
         multiCmd.append(sopActor.GUIDER, Msg.DECENTER, on=False)
 
 
-def prep_manga_dither(multiCmd, dither='C', precondition=False):
-    """Prepare for MaNGA exposures by dithering the guider.
+def prep_manga_dither(multiCmd, dither='C', precondition=False, metric='ditherTransition'):
+    """Prepare for MaNGA exposures by decentering and dithering the guider.
 
-    Appends command to stack
+    Appends a single guider dither transition to the stack, which only sends
+    the commands that are not already satisfied and records its latency in
+    actorState.metrics under metric.
 
-    Command: guider mangaDither ditherPos=N
+    Commands: guider decenter on, guider mangaDither ditherPos=N
     """
 
     if myGlobals.bypass.get('guider_decenter'):
@@ -372,16 +548,21 @@ def prep_manga_dither(multiCmd, dither='C', precondition=False):
                           'guider_decenter is bypassed."')
         return
 
-    # append guider decenter on
-    prep_guider_decenter_on(multiCmd)
-    # append manga guider dither command
     if precondition:
         multiCmd.append(
             SopPrecondition(
-                sopActor.GUIDER, Msg.MANGA_DITHER, dither=dither, timeout=guiderDecenterDuration))
+                sopActor.GUIDER,
+                Msg.DITHER_TRANSITION,
+                dither=dither,
+                metric=metric,
+                timeout=guiderDecenterDuration))
     else:
         multiCmd.append(
-            sopActor.GUIDER, Msg.MANGA_DITHER, dither=dither, timeout=guiderDecenterDuration)
+            sopActor.GUIDER,
+            Msg.DITHER_TRANSITION,
+            dither=dither,
+            metric=metric,
+            timeout=guiderDecenterDuration)
 
 
 def close_apogee_shutter_if_gang_on_cart(cmd, cmdState, actorState, stageName):
@@ -460,9 +641,75 @@ def update_exp_counts(cmdState, expType):
         cmdState.nArcDone += 1
     else:
         return False
+    cmdState.checkpoint()
     return True
 
 
+def remaining_calibs(cmdState):
+    """Return a dict of the number of exposures of each type left in a calibration sequence."""
+    return {
+        'bias': cmdState.nBias - cmdState.nBiasDone,
+        'dark': cmdState.nDark - cmdState.nDarkDone,
+        'flat': cmdState.nFlat - cmdState.nFlatDone,
+        'arc': cmdState.nArc - cmdState.nArcDone
+    }
+
+
+def plan_boss_calibs(cmd, cmdState, actorState, ffsOpen):
+    """
+    Return the order of exposure types that takes the remaining calibrations
+    in the least time, given the current lamp and FFS state, and output the
+    planned timeline.
+    """
+    precondition = SopPrecondition(None)
+    lampQueues = (('ff', sopActor.FF_LAMP), ('hgcd', sopActor.HGCD_LAMP), ('ne', sopActor.NE_LAMP))
+    warmup = dict((lamp, myGlobals.warmupTime[queue]) for lamp, queue in lampQueues)
+    # Arcs only wait for the lamps to be bright enough (see arc_exposure_time).
+    for lamp, queue in lampQueues:
+        if queue in actorState.lampFlux:
+            warmup[lamp] = min(warmup[lamp], actorState.lampFlux[queue].ready_time())
+    warmFor = {}
+    for lamp, queue in lampQueues:
+        try:
+            isOn, timeSinceTransition = precondition.lampIsOn(queue)
+        except RuntimeError:
+            continue
+        if isOn:
+            warmFor[lamp] = timeSinceTransition
+
+    expTimes = {
+        'bias': 0.,
+        'dark': cmdState.darkTime,
+        'flat': cmdState.flatTime,
+        'arc': cmdState.arcTime
+    }
+    order, steps, total = calibplan.plan_calibs(
+        remaining_calibs(cmdState),
+        expTimes,
+        warmup,
+        ffsOpen=bool(ffsOpen),
+        warmFor=warmFor,
+        flushTime=actorState.metrics.mean('boss.flush', flushDuration),
+        readoutTime=actorState.metrics.mean('boss.read', readoutDuration),
+        ffsTime=ffsDuration)
+
+    for step in steps:
+        cmd.inform('bossCalibsPlan="%s",%d,%0.1f,%0.1f' % step)
+    cmd.inform('text="BOSS calibration order: %s, expected to take %ds"' %
+               (', '.join(order), total))
+    return order
+
+
+def next_calib(cmdState, order):
+    """Return the next exposure type to take, following order, or None if there are none left."""
+    remaining = remaining_calibs(cmdState)
+    # The counts can be modified while running, adding types that were not planned.
+    for expType in list(order) + list(calibplan.canonicalOrder):
+        if remaining[expType] > 0:
+            return expType
+    return None
+
+
 def is_gang_at_cart(cmd, cmdState, actorState):
     """Fail, and return False if the gang is not at the cart, else return True."""
     if not actorState.apogeeGang.atCartridge():
@@ -489,6 +736,32 @@ def get_next_apogee_dither_pair(actorState):
         return 'AB'
 
 
+def plan_coobserving(actorState, bossExpTime, apogeeExpTime, lead=None, nBoss=None):
+    """
+    Return the coobserving.CoObservingPlan for the BOSS exposures in an
+    APOGEE dither pair, using the measured BOSS flush and readout times and
+    APOGEE read cadence when we have them. nBoss fixes the number of BOSS
+    exposures.
+    """
+    metrics = actorState.metrics
+    return coobserving.plan_boss_exposures(
+        bossExpTime,
+        apogeeExpTime,
+        lead=lead,
+        flushTime=metrics.mean('boss.flush', flushDuration),
+        readoutTime=metrics.mean('boss.read', readoutDuration),
+        readTime=metrics.mean('apogee.readTime'),
+        nBoss=nBoss)
+
+
+def report_coobserving(cmd, actorState, plan, startTime, name):
+    """Output the predicted and achieved efficiency of a co-observing dither pair."""
+    achieved = coobserving.efficiency(plan.bossTime, plan.apogeeTime, time.time() - startTime)
+    actorState.metrics.record(name + '.predictedEfficiency', plan.efficiency)
+    actorState.metrics.record(name + '.achievedEfficiency', achieved)
+    cmd.inform('coObservingEfficiency=%d,%0.3f,%0.3f' % (plan.nBoss, plan.efficiency, achieved))
+
+
 # The actual SOP commands, and sub-commands.
 
 def guider_start(cmd, cmdState, actorState, finish=True):
@@ -604,37 +877,39 @@ def do_apogee_boss_science(cmd, cmdState, actorState):
         else:
             dithers = get_next_apogee_dither_pair(actorState)
 
-        duration = (flushDuration + 2. * apogeeExpTime +
-                    readoutDuration + actorState.timeout)
+        # One BOSS exposure per APOGEE dither pair (two, for long APOGEE
+        # exposures), as the command's etr and nExposures expect.
+        nBoss = 2 if cmdState.apogee_long else 1
+        plan = plan_coobserving(actorState, bossExpTime, apogeeExpTime, nBoss=nBoss)
+
+        duration = (plan.duration + flushDuration + actorState.timeout)
 
         multiCmd = SopMultiCommand(
             cmd, duration, '.'.join((cmdState.name, stageName)))
 
         if do_boss:
-            multiCmd.append(sopActor.BOSS_ACTOR, Msg.EXPOSE,
-                            expTime=bossExpTime, expType='science',
-                            readout=True)
+            for ii in range(plan.nBoss):
+                multiCmd.append(sopActor.BOSS_ACTOR, Msg.EXPOSE,
+                                expTime=bossExpTime, expType='science',
+                                readout=True)
 
         if do_apogee:
             multiCmd.append(sopActor.APOGEE, Msg.APOGEE_DITHER_SET,
                             expTime=apogeeExpTime, dithers=dithers,
                             expType='object')
 
-        if cmdState.apogee_long:
-            if do_boss:
-                multiCmd.append(sopActor.BOSS_ACTOR, Msg.EXPOSE,
-                                expTime=bossExpTime, expType='science',
-                                readout=True)
-
         prep_for_science(multiCmd, precondition=True)
         prep_apogee_shutter(multiCmd, open=True)
 
         cmd.inform('text="Taking an APOGEE-BOSS science exposure"')
 
+        startTime = time.time()
         if not multiCmd.run():
             failMsg = 'Failed to take APOGEE-BOSS science exposure'
             break
 
+        if do_boss and do_apogee:
+            report_coobserving(cmd, actorState, plan, startTime, cmdState.name)
         cmdState.took_exposure()
 
     # Did we break out of that loop?
@@ -681,13 +956,15 @@ def do_apogee_science(cmd, cmdState, actorState, finishMsg=None):
     finish_command(cmd, cmdState, actorState, finishMsg)
 
 
-def do_one_manga_dither(cmd, cmdState, actorState):
+def do_one_manga_dither(cmd, cmdState, actorState, sequenceState=None, ledger=None):
     """Start a single MaNGA dithered exposure.
 
     Appends Manga dither commands to stack
 
     Commands:
     boss exposure science itime=900 noreadout
+
+    Exposures taken without a readout are recorded in ledger, if given.
     """
 
     dither = cmdState.dither
@@ -702,14 +979,16 @@ def do_one_manga_dither(cmd, cmdState, actorState):
     # Does as many expTime exposures as possible in a 900s dither.
     n_exposures = int(numpy.ceil(900. / (expTime + readoutDuration))) or 1
 
+    if ledger is None:
+        ledger = BossExposureLedger(cmd, cmdState, actorState)
     for ii in range(n_exposures):
-        multiCmd.append(sopActor.BOSS_ACTOR, Msg.EXPOSE, expTime=expTime,
-                        expType='science', readout=readout)
+        ledger.expose(multiCmd, expTime, 'science', readout=readout)
 
     # append ff lamp commands etc
     prep_for_science(multiCmd, precondition=True)
     # append guider dithers
-    prep_manga_dither(multiCmd, dither=dither, precondition=True)
+    metric = '%s.ditherTransition' % (sequenceState or cmdState).name
+    prep_manga_dither(multiCmd, dither=dither, precondition=True, metric=metric)
 
     return multiCmd.run()
 
@@ -738,7 +1017,7 @@ def do_manga_sequence(cmd, cmdState, actorState):
     finishMsg = 'Your Nobel Prize is a little closer!'
     failMsg = ''  # message to use if we've failed
     arcExp = 3  # number of exposures to take between arcs
-    pendingReadout = False
+    ledger = BossExposureLedger(cmd, cmdState, actorState)
     # set at start, and then update after each exposure.
     dither = cmdState.ditherSeq[cmdState.index]
     cmdState.update_etr()
@@ -748,24 +1027,19 @@ def do_manga_sequence(cmd, cmdState, actorState):
         ditherState.expTime = cmdState.expTime
         ditherState.dither = cmdState.ditherSeq[cmdState.index]
         ditherState.readout = True if cmdState.expTime < 900 else False
-        pendingReadout = not ditherState.readout
         # Beginning of exposure
         stageName = 'expose'
         cmdState.setStageState(stageName, 'running')
         # start one manga dither - appends boss expose command
-        if not do_one_manga_dither(cmd, ditherState, actorState):
+        if not do_one_manga_dither(cmd, ditherState, actorState, cmdState, ledger=ledger):
             cmdState.setStageState(stageName, 'failed')
             failMsg = 'failed one dither of a MaNGA dither sequence'
             break
         # finished - index the exposure count by 1, ditherSeq.index
         cmdState.took_exposure()
 
-        # Append to stack exposure readout command
-        # Command : boss exposure   readout
-        multiCmd = SopMultiCommand(cmd, readoutDuration + actorState.timeout,
-                                   cmdState.name + '.readout')
-        if pendingReadout:
-            multiCmd.append(sopActor.BOSS_ACTOR, Msg.EXPOSE, expTime=-1, readout=True)
+        # Read out the exposure (if needed) while we move to the next dither.
+        multiCmd = ledger.overlap(actorState.timeout, cmdState.name + '.readout')
 
         # end of one command sequence
         # here is where we can check count and dithers, append or remove?
@@ -773,12 +1047,12 @@ def do_manga_sequence(cmd, cmdState, actorState):
         # move to a new dither position - append new guider dither commands
         try:
             dither = cmdState.ditherSeq[cmdState.index]
-            prep_manga_dither(multiCmd, dither=dither, precondition=False)
+            prep_manga_dither(multiCmd, dither=dither, precondition=False,
+                              metric='%s.ditherTransition' % cmdState.name)
         except IndexError:
             # We're at the end, so don't need to move to new dither position.
             pass
 
-        pendingReadout = False
         if not multiCmd.run():
             failMsg = 'failed to readout exposure/change dither position'
             break
@@ -787,32 +1061,19 @@ def do_manga_sequence(cmd, cmdState, actorState):
     show_status(cmdState.cmd, cmdState, actorState.actor, oneCommand=cmdState.name)
     deactivate_guider_decenter(cmd, cmdState, actorState, 'dither')
 
-    # Append to stack exposure readout command
-    # Command : boss exposure   readout
-    # when while loop is aborted
-    if pendingReadout:
-        multiCmd = SopMultiCommand(
-            cmd,
-            actorState.timeout + readoutDuration,
-            cmdState.name + '.readout',
-            sopActor.BOSS_ACTOR,
-            Msg.EXPOSE,
-            expTime=-1,
-            readout=True)
-    else:
-        multiCmd = SopMultiCommand(cmd, actorState.timeout, cmdState.name + '.cleanup')
-
     if failMsg:
         # handle the readout, but don't touch lamps, guider state, etc.
-        if pendingReadout and not multiCmd.run():
-            cmd.error('text="Failed to readout last exposure"')
+        ledger.cleanup(cmdState.name + '.readout')
         return fail_command(cmd, cmdState, failMsg)
 
     finish_command(cmd, cmdState, actorState, finishMsg)
 
 
-def do_one_apogeemanga_dither(cmd, cmdState, actorState, sequenceState=None):
-    """A single APOGEE/MaNGA co-observing dither."""
+def do_one_apogeemanga_dither(cmd, cmdState, actorState, sequenceState=None, ledger=None):
+    """A single APOGEE/MaNGA co-observing dither.
+
+    BOSS exposures taken without a readout are recorded in ledger, if given.
+    """
 
     stageName = 'expose'
     cmdState.setStageState(stageName, 'prepping')
@@ -845,36 +1106,29 @@ def do_one_apogeemanga_dither(cmd, cmdState, actorState, sequenceState=None):
         expType='object',
         comment=cmdState.comment)
 
-    # The total time the APOGEE dither set will take. There is no readout time
-    # for APOGEE.
-    apogee_total_exptime = apogeeExpTime * 2.
-
-    # Determine how many BOSS exposures we can fit in that time.
-    n_boss_exposures_float = apogee_total_exptime / (mangaExpTime + readoutDuration)
-
-    if mangaLeads:
-        # If MaNGA leads, take as many exposures as needed but it's ok to go
-        # beyond the apogee_total_exptime.
-        n_boss_exposures = int(numpy.ceil(n_boss_exposures_float)) or 1
-    else:
-        # If APOGEE leads, make sure the total MaNGA exposure time does not dominate.
-        n_boss_exposures = int(n_boss_exposures_float) or 1
+    # Determine how many BOSS exposures to take during the APOGEE dither set.
+    # If MaNGA leads, take as many exposures as needed but it's ok to go
+    # beyond the APOGEE exposure time. If APOGEE leads, make sure the total
+    # MaNGA exposure time does not dominate.
+    plan = plan_coobserving(actorState, mangaExpTime, apogeeExpTime,
+                            lead='boss' if mangaLeads else 'apogee')
 
-    for ii in range(n_boss_exposures):
-        multiCmd.append(
-            sopActor.BOSS_ACTOR,
-            Msg.EXPOSE,
-            expTime=mangaExpTime,
-            expType='science',
-            readout=readout,
-            finish_msg=finish_msg)
+    if ledger is None:
+        ledger = BossExposureLedger(cmd, cmdState, actorState)
+    for ii in range(plan.nBoss):
+        ledger.expose(multiCmd, mangaExpTime, 'science', readout=readout, finish_msg=finish_msg)
 
     prep_for_science(multiCmd, precondition=True)
     prep_apogee_shutter(multiCmd, open=True)
-    prep_manga_dither(multiCmd, dither=mangaDither, precondition=True)
+    metric = '%s.ditherTransition' % (sequenceState or cmdState).name
+    prep_manga_dither(multiCmd, dither=mangaDither, precondition=True, metric=metric)
 
     cmdState.setStageState(stageName, 'running')
-    return multiCmd.run()
+    startTime = time.time()
+    if not multiCmd.run():
+        return False
+    report_coobserving(cmd, actorState, plan, startTime, (sequenceState or cmdState).name)
+    return True
 
 
 def do_apogeemanga_dither(cmd, cmdState, actorState):
@@ -898,9 +1152,9 @@ def do_apogeemanga_sequence(cmd, cmdState, actorState):
 
     finishMsg = 'Your Nobel Prize is a little closer!'
     failMsg = ''  # message to use if we've failed
-    pendingReadout = False
     if not is_gang_at_cart(cmd, cmdState, actorState):
         return False
+    ledger = BossExposureLedger(cmd, cmdState, actorState)
 
     # set at start, and then update after each exposure.
     mangaDither = cmdState.mangaDitherSeq[cmdState.index]
@@ -916,10 +1170,9 @@ def do_apogeemanga_sequence(cmd, cmdState, actorState):
         ditherState.readout = cmdState.readout
         ditherState.apogee_long = cmdState.apogee_long
         ditherState.manga_lead = cmdState.manga_lead
-        pendingReadout = not cmdState.readout
         stageName = 'expose'
         cmdState.setStageState(stageName, 'running')
-        if not do_one_apogeemanga_dither(cmd, ditherState, actorState, cmdState):
+        if not do_one_apogeemanga_dither(cmd, ditherState, actorState, cmdState, ledger=ledger):
             cmdState.setStageState(stageName, 'failed')
             failMsg = 'failed one dither of a MaNGA dither sequence'
             break
@@ -931,17 +1184,15 @@ def do_apogeemanga_sequence(cmd, cmdState, actorState):
         # Don't command a move to a new position early if we aren't reading out.
         # this usually only happens for APOGEE lead plates, where there is no
         # dithering, and thus also no separate readout.
-        if pendingReadout:
-            duration = actorState.timeout + readoutDuration
-            multiCmd = SopMultiCommand(cmd, duration, cmdState.name + '.readout')
-            multiCmd.append(sopActor.BOSS_ACTOR, Msg.EXPOSE, expTime=-1, readout=True)
+        if ledger.pending:
+            multiCmd = ledger.overlap(actorState.timeout, cmdState.name + '.readout')
             try:
                 mangaDither = cmdState.mangaDitherSeq[cmdState.index]
-                prep_manga_dither(multiCmd, dither=mangaDither, precondition=False)
+                prep_manga_dither(multiCmd, dither=mangaDither, precondition=False,
+                                  metric='%s.ditherTransition' % cmdState.name)
             except IndexError:
                 # We're at the end, so don't need to move to new dither position.
                 pass
-            pendingReadout = False
             if not multiCmd.run():
                 failMsg = 'failed to readout exposure/change dither position'
                 break
@@ -949,32 +1200,9 @@ def do_apogeemanga_sequence(cmd, cmdState, actorState):
     show_status(cmdState.cmd, cmdState, actorState.actor, oneCommand=cmdState.name)
     deactivate_guider_decenter(cmd, cmdState, actorState, 'dither')
 
-    if pendingReadout:
-        multiCmd = SopMultiCommand(
-            cmd,
-            actorState.timeout + readoutDuration,
-            cmdState.name + '.readout',
-            sopActor.BOSS_ACTOR,
-            Msg.EXPOSE,
-            expTime=-1,
-            readout=True)
-    else:
-        multiCmd = SopMultiCommand(cmd, actorState.timeout, cmdState.name + '.cleanup')
-
     if failMsg:
-
         # handle the readout, but don't touch lamps, guider state, etc.
-
-        # If we get here when the exposure has been aborted the multicommand
-        # won't do anything unless we set ignoreAborting to True.
-        if actorState.aborting is True:
-            actorState.ignoreAborting = True
-
-        if pendingReadout and not multiCmd.run():
-            cmd.error('text="Failed to readout last exposure"')
-
-        actorState.ignoreAborting = False  # Resets ignoreAborting
-
+        ledger.cleanup(cmdState.name + '.readout')
         return fail_command(cmd, cmdState, failMsg)
 
     finish_command(cmd, cmdState, actorState, finishMsg)
@@ -984,7 +1212,7 @@ def do_boss_calibs(cmd, cmdState, actorState):
     """Start a BOSS instrument calibration sequence (flats, arcs, Hartmanns)"""
 
     ffsInitiallyOpen = SopPrecondition(None).ffsAreOpen()
-    pendingReadout = False
+    ledger = BossExposureLedger(cmd, cmdState, actorState)
     finishMsg = 'Your calibration data are ready.'
     failMsg = ''  # message to use if we've failed
 
@@ -1004,36 +1232,34 @@ def do_boss_calibs(cmd, cmdState, actorState):
             failMsg = 'failed to offset telescope'
             return fail_command(cmd, cmdState, failMsg)
 
+    order = plan_boss_calibs(cmd, cmdState, actorState, ffsInitiallyOpen)
+
     while cmdState.exposures_remain():
         show_status(cmdState.cmd, cmdState, actorState.actor, oneCommand=cmdState.name)
 
-        if cmdState.nBiasDone < cmdState.nBias:
-            expTime, expType = 0.0, 'bias'
-        elif cmdState.nDarkDone < cmdState.nDark:
-            expTime, expType = cmdState.darkTime, 'dark'
-        elif cmdState.nFlatDone < cmdState.nFlat:
-            expTime, expType = cmdState.flatTime, 'flat'
-        elif cmdState.nArcDone < cmdState.nArc:
-            expTime, expType = cmdState.arcTime, 'arc'
+        expType = next_calib(cmdState, order)
+        if expType == 'bias':
+            expTime = 0.0
+        elif expType == 'dark':
+            expTime = cmdState.darkTime
+        elif expType == 'flat':
+            expTime = cmdState.flatTime
+        elif expType == 'arc':
+            expTime = cmdState.arcTime
         else:
             failMsg = 'Impossible condition: no exposures left after restart of while loop!'
             break
 
-        if pendingReadout:
-            # We will only get here if the next exposure to be taken is an arc or flat.
+        if ledger.pending and expType in ('arc', 'flat'):
+            # Overlap the readout of the last flat/arc with the lamp changes.
             # Darks/biases don't have pending readout: we don't want lamps
-            # turning on while a dark is reading out!
-            multiCmd = SopMultiCommand(cmd, actorState.timeout + readoutDuration,
-                                       cmdState.name + '.pendingReadout')
-            multiCmd.append(sopActor.BOSS_ACTOR, Msg.EXPOSE, expTime=-1, readout=True)
-            pendingReadout = False
+            # turning on while a dark is reading out! Before a bias/dark the
+            # lamps are turned off first, and the exposure multiCmd reads out.
+            multiCmd = ledger.overlap(actorState.timeout, cmdState.name + '.pendingReadout')
             if expType == 'arc':
                 prep_for_arc(multiCmd)
-            elif expType == 'flat':
-                prep_for_flat(multiCmd)
             else:
-                failMsg = 'Impossible condition: exposure type is not arc or flat!'
-                break
+                prep_for_flat(multiCmd)
 
             if not multiCmd.run():
                 failMsg = 'Failed to prepare for %s' % expType
@@ -1053,25 +1279,20 @@ def do_boss_calibs(cmd, cmdState, actorState):
         multiCmd = SopMultiCommand(cmd, timeout, cmdState.name + '.expose')
 
         if expType in ('bias', 'dark'):
-            pendingReadout = False
-            multiCmd.append(
-                sopActor.BOSS_ACTOR, Msg.EXPOSE, expTime=expTime, expType=expType, readout=True)
+            ledger.expose(multiCmd, expTime, expType, readout=True)
             prep_lamps_off(multiCmd, precondition=True)
         elif expType == 'flat':
             if cmdState.flatTime > 0:
-                pendingReadout = True
-                multiCmd.append(sopActor.BOSS_ACTOR, Msg.EXPOSE, expTime=expTime,
-                                expType=expType, readout=False)
+                ledger.expose(multiCmd, expTime, expType, readout=False)
             if cmdState.guiderFlatTime > 0:
                 cmd.inform('text="Taking a %gs guider flat exposure"' % (cmdState.guiderFlatTime))
                 multiCmd.append(
                     sopActor.GUIDER, Msg.EXPOSE, expTime=cmdState.guiderFlatTime, expType='flat')
             prep_for_flat(multiCmd, precondition=True)
         elif expType == 'arc':
-            pendingReadout = True
-            multiCmd.append(
-                sopActor.BOSS_ACTOR, Msg.EXPOSE, expTime=expTime, expType=expType, readout=False)
-            prep_for_arc(multiCmd, precondition=True)
+            ledger.expose(
+                multiCmd, arc_exposure_time(cmd, actorState, expTime), expType, readout=False)
+            prep_for_arc(multiCmd, precondition=True, partialWarmup=True)
         else:
             failMsg = ('Impossible condition: unknown exposure type '
                        'when setting up for next exposure!')
@@ -1090,28 +1311,13 @@ def do_boss_calibs(cmd, cmdState, actorState):
 
     # Did we break out of the while loop?
     if failMsg:
-        if pendingReadout:
-            if not SopMultiCommand(
-                    cmd,
-                    actorState.timeout + readoutDuration,
-                    cmdState.name + '.readoutCleanup',
-                    sopActor.BOSS_ACTOR,
-                    Msg.EXPOSE,
-                    expTime=-1,
-                    readout=True).run():
-                cmd.error('text="Failed to readout last exposure"')
+        ledger.cleanup(cmdState.name + '.readoutCleanup')
         cmdState.disable_slews = False
         return fail_command(cmd, cmdState, failMsg)
 
     # Readout any pending data and return telescope to initial state
     cmdState.disable_slews = False  # It is ok to slew again
-    multiCmd = SopMultiCommand(cmd, actorState.timeout + (readoutDuration
-                                                          if pendingReadout else 0),
-                               cmdState.name + '.readoutFinish')
-
-    if pendingReadout:
-        multiCmd.append(sopActor.BOSS_ACTOR, Msg.EXPOSE, expTime=-1, readout=True)
-        pendingReadout = False
+    multiCmd = ledger.overlap(actorState.timeout, cmdState.name + '.readoutFinish')
     multiCmd.append(sopActor.FFS, Msg.FFS_MOVE, open=ffsInitiallyOpen)
     prep_lamps_off(multiCmd)
 
@@ -1190,6 +1396,22 @@ def goto_field_apogee(cmd, cmdState, actorState, slewTimeout):
     return True
 
 
+def hartmann_still_good(cmd, cmdState, actorState):
+    """
+    Return True if the last Hartmann collimation still holds, so gotoField
+    can skip its Hartmann, and output the decision.
+    """
+    focusCache = actorState.focusCache
+    if focusCache.maxAge <= 0:
+        return False
+    skip, reason = focusCache.check(actorState.models, getattr(actorState, 'cartridge', None))
+    cmd.inform('hartmannCache=%s,%s' % (qstr('skip' if skip else 'take'), qstr(reason)))
+    if skip:
+        cmd.inform('text="Skipping the Hartmann: %s."' % reason)
+        cmdState.setStageState('hartmann', 'done')
+    return skip
+
+
 def do_goto_field_hartmann(cmd, cmdState, actorState):
     """Handles taking hartmanns for goto_field, depending on survey."""
 
@@ -1208,7 +1430,9 @@ def do_goto_field_hartmann(cmd, cmdState, actorState):
     multiCmd.append(sopActor.BOSS_ACTOR, Msg.HARTMANN, args=args)
     if not handle_multiCmd(multiCmd, cmd, cmdState, stageName,
                            'Failed to take hartmann sequence. Lamps are on.'):
+        actorState.focusCache.invalidate()
         return False
+    actorState.focusCache.record(actorState.models, getattr(actorState, 'cartridge', None))
 
     # Because we always use ignoreResiduals we need to check the model to see if the
     # cameras are actually focused.
@@ -1230,25 +1454,73 @@ def do_goto_field_hartmann(cmd, cmdState, actorState):
     return True
 
 
+def reuse_calibs(cmd, cmdState, actorState, field):
+    """
+    Skip the gotoField arcs/flats that were already taken recently on this
+    field (unless forceCalibs was given), and output the ones being reused.
+    """
+    if cmdState.forceCalibs:
+        return
+    reused = []
+    for expType in ('arc', 'flat'):
+        name = expType + 'Time'
+        expTime = getattr(cmdState, name)
+        if expTime <= 0:
+            continue
+        calibration = actorState.calibrations.find(expType, expTime, field)
+        if calibration is None:
+            continue
+        setattr(cmdState, name, 0)
+        reused.append(expType)
+        cmd.inform('calibsReused=%s,%g,%0.1f' % (qstr(expType), expTime,
+                                                 (time.time() - calibration.time) / 60.))
+
+    if reused and cmdState.arcTime <= 0 and cmdState.flatTime <= 0:
+        cmdState.doCalibs = False
+        cmdState.setStageState('calibs', 'done')
+
+
+def record_calibs(actorState, unread, field):
+    """Record the calibrations in unread, which have now been read out, and empty it."""
+    for expType, expTime in unread:
+        actorState.calibrations.record(expType, expTime, field)
+    del unread[:]
+
+
 def goto_field_boss(cmd, cmdState, actorState, slewTimeout):
     """Process a goto field sequence for a BOSS plate."""
 
-    pendingReadout = False
+    ledger = BossExposureLedger(cmd, cmdState, actorState)
     stageName = ''
 
     doGuiderFlat = True if (cmdState.doGuiderFlat and cmdState.doGuider and
                             cmdState.guiderFlatTime > 0) else False
     doingCalibs = False
+    if cmdState.doHartmann and hartmann_still_good(cmd, cmdState, actorState):
+        cmdState.doHartmann = False
+
+    field = CalibrationRegistry.field(actorState.models)
+    unread = []  # the (expType, expTime) of the calibrations waiting for their readout
+    if cmdState.doCalibs:
+        reuse_calibs(cmd, cmdState, actorState, field)
+
     if cmdState.doSlew:
         stageName = 'slew'
+        slewStart = time.time()
         multiCmd = start_slew(cmd, cmdState, actorState, slewTimeout)
         if cmdState.arcTime > 0 or cmdState.doHartmann:
+            prepared = actorState.cartLoad.current()
+            slewTime = prepared.slewTime if prepared is not None else None
+            if slewTime is None:
+                slewTime = actorState.metrics.mean('gotoField.slew', 0)
+            hint_arc_lamps(cmd, actorState, slewStart + slewTime)
             prep_for_arc(multiCmd)
         elif doGuiderFlat or cmdState.flatTime > 0:
             prep_for_flat(multiCmd)
 
         if not _run_slew(cmd, cmdState, actorState, multiCmd):
             return False
+        actorState.metrics.record('gotoField.slew', time.time() - slewStart)
 
         if 'Halted' in list(actorState.models['tcc'].keyVarDict['axisCmdState']):
             cmd.warn('text="TCC axes are halted. Stopping gotoField."')
@@ -1271,7 +1543,7 @@ def goto_field_boss(cmd, cmdState, actorState, slewTimeout):
         if cmdState.arcTime > 0:
             timeout = actorState.timeout + myGlobals.warmupTime[sopActor.HGCD_LAMP]
             multiCmd = SopMultiCommand(cmd, timeout, cmdState.name + '.calibs.arc')
-            prep_for_arc(multiCmd, precondition=True)
+            prep_for_arc(multiCmd, precondition=True, partialWarmup=True)
             if not handle_multiCmd(multiCmd, cmd, cmdState, stageName,
                                    'Failed to prepare for arcs'):
                 return False
@@ -1279,50 +1551,37 @@ def goto_field_boss(cmd, cmdState, actorState, slewTimeout):
             # Now take the exposure: separate from above so we can check to see
             # if the arc stage was aborted/cancelled/stopped before the exposure started.
             if cmdState.arcTime > 0:
-                if SopMultiCommand(
-                        cmd,
-                        cmdState.arcTime + actorState.timeout,
-                        cmdState.name + '.calibs.arcExposure',
-                        sopActor.BOSS_ACTOR,
-                        Msg.EXPOSE,
-                        expTime=cmdState.arcTime,
-                        expType='arc',
-                        readout=False,
-                ).run():
-                    pendingReadout = True
+                arcTime = arc_exposure_time(cmd, actorState, cmdState.arcTime)
+                multiCmd = SopMultiCommand(cmd, arcTime + actorState.timeout,
+                                           cmdState.name + '.calibs.arcExposure')
+                ledger.expose(multiCmd, arcTime, 'arc', readout=False)
+                if multiCmd.run():
                     cmdState.didArc = True
+                    unread.append(('arc', cmdState.arcTime))
                 else:
+                    ledger.cleanup(cmdState.name + '.calibs.arcReadout')
                     cmdState.setStageState(stageName, 'failed')
                     return fail_command(cmd, cmdState, 'failed to take arcs')
             show_status(cmdState.cmd, cmdState, actorState.actor, oneCommand=cmdState.name)
 
         # Now the flats
         if cmdState.flatTime > 0:
-            multiCmd = SopMultiCommand(
-                cmd, actorState.timeout + (readoutDuration if pendingReadout else 0),
-                cmdState.name + '.calibs.flats')
-            if pendingReadout:
-                multiCmd.append(sopActor.BOSS_ACTOR, Msg.EXPOSE, expTime=-1, readout=True)
-                pendingReadout = False
+            multiCmd = ledger.overlap(actorState.timeout, cmdState.name + '.calibs.flats')
 
             if cmdState.flatTime > 0 or doGuiderFlat:
                 prep_for_flat(multiCmd)
             if not handle_multiCmd(multiCmd, cmd, cmdState, 'calibs',
                                    'Failed to prepare for flats'):
                 return False
+            # That read out the arc.
+            record_calibs(actorState, unread, field)
 
             # Now take the exposure, separate from the above to catch aborts/stops.
             if cmdState.flatTime > 0 or doGuiderFlat:
                 multiCmd = SopMultiCommand(cmd, cmdState.flatTime + actorState.timeout + 30,
                                            cmdState.name + '.calibs.flatExposure')
             if cmdState.flatTime > 0:
-                pendingReadout = True
-                multiCmd.append(
-                    sopActor.BOSS_ACTOR,
-                    Msg.EXPOSE,
-                    expTime=cmdState.flatTime,
-                    expType='flat',
-                    readout=False)
+                ledger.expose(multiCmd, cmdState.flatTime, 'flat', readout=False)
 
             # Recheck these, in case the command was aborted or modified since
             # we defined doGuiderFlat above.
@@ -1330,29 +1589,19 @@ def goto_field_boss(cmd, cmdState, actorState, slewTimeout):
                 multiCmd.append(
                     sopActor.GUIDER, Msg.EXPOSE, expTime=cmdState.guiderFlatTime, expType='flat')
             if not multiCmd.run():
-                if pendingReadout:
-                    # readout the previous command
-                    if not SopMultiCommand(
-                            cmd,
-                            actorState.timeout + readoutDuration,
-                            cmdState.name + '.calibs.flatReadout',
-                            sopActor.BOSS_ACTOR,
-                            Msg.EXPOSE,
-                            expTime=-1,
-                            readout=True).run():
-                        cmd.error("text='Failed to readout last exposure!'")
+                # readout the previous command
+                ledger.cleanup(cmdState.name + '.calibs.flatReadout')
                 cmdState.setStageState(stageName, 'failed')
                 return fail_command(cmd, cmdState, 'failed to take flats')
             cmdState.didFlat = True
+            if cmdState.flatTime > 0:
+                unread.append(('flat', cmdState.flatTime))
             cmdState.doGuiderFlat = False  # since we just did it.
             show_status(cmdState.cmd, cmdState, actorState.actor, oneCommand=cmdState.name)
 
     # Readout any pending data and prepare to guide
-    if pendingReadout:
-        readoutMultiCmd = SopMultiCommand(cmd, readoutDuration + actorState.timeout,
-                                          cmdState.name + '.calibs.lastReadout')
-        readoutMultiCmd.append(sopActor.BOSS_ACTOR, Msg.EXPOSE, expTime=-1, readout=True)
-        pendingReadout = False
+    if ledger.pending:
+        readoutMultiCmd = ledger.overlap(actorState.timeout, cmdState.name + '.calibs.lastReadout')
         readoutMultiCmd.start()
     else:
         if doingCalibs:
@@ -1391,6 +1640,7 @@ def goto_field_boss(cmd, cmdState, actorState, slewTimeout):
             cmdState.setStageState(stageName, 'failed')
             failMsg = ';'.join((failMsg, 'failed to readout last exposure'))
         else:
+            record_calibs(actorState, unread, field)
             cmdState.setStageState(stageName, 'done')
 
     if failMsg:
@@ -1455,7 +1705,7 @@ def do_apogee_sky_flats(cmd, cmdState, actorState):
 
     # NOTE: I don't like using raw call()s here, but it's probably not worth
     # creating a tccThread Msg just for this arc offset.
-    cmdVar = actorState.actor.cmdr.call(
+    cmdVar = actorState.gateway.call(
         actor='tcc', forUserCmd=cmd, cmdStr='offset arc 0.01,0.0', timeLim=actorState.timeout)
     if cmdVar.didFail:
         if myGlobals.bypass.get(name='axes'):
@@ -1535,7 +1785,9 @@ def collimate_boss(cmd, cmdState, actorState):
     multiCmd.append(sopActor.BOSS_ACTOR, Msg.HARTMANN, args=args)
     if not handle_multiCmd(multiCmd, cmd, cmdState, stageName,
                            'Failed to collimate BOSS for afternoon checkout'):
+        actorState.focusCache.invalidate()
         return
+    actorState.focusCache.record(actorState.models, getattr(actorState, 'cartridge', None))
 
     show_status(cmdState.cmd, cmdState, actorState.actor, oneCommand=cmdState.name)
 
@@ -1556,6 +1808,78 @@ def collimate_boss(cmd, cmdState, actorState):
     finish_command(cmd, cmdState, actorState, finishMsg)
 
 
+def dithered_flat(cmd, cmdState, actorState):
+    """
+    Take nStep flats, stepping the collimators through focus by nTick between them.
+
+    The collimators start nTick*(nStep//2) ticks out of focus and are returned
+    to where they started at the end. Each collimator move happens while the
+    previous flat reads out, with the spectrographs moving in parallel.
+    """
+    ledger = BossExposureLedger(cmd, cmdState, actorState)
+    finishMsg = 'Finished dithered flats.'
+    failMsg = ''
+    show_status(cmdState.cmd, cmdState, actorState.actor, oneCommand=cmdState.name)
+
+    stageName = 'lamps'
+    cmdState.setStageState(stageName, 'running')
+    multiCmd = SopMultiCommand(cmd, actorState.timeout, cmdState.name + '.lamps')
+    prep_lamps_for_flat(multiCmd)
+    if not handle_multiCmd(multiCmd, cmd, cmdState, stageName, 'Some lamps failed to turn on'):
+        return False
+
+    stageName = 'flats'
+    cmdState.setStageState(stageName, 'running')
+    moved = 0
+    for i in range(cmdState.nStep):
+        if cmdState.aborted:
+            break
+
+        move = cmdState.nTick * (cmdState.nStep // 2) if i == 0 else -cmdState.nTick
+        multiCmd = ledger.overlap(actorState.timeout, cmdState.name + '.move')
+        prep_collimator_move(multiCmd, cmdState.spN, move)
+        if not multiCmd.run():
+            # We don't know which collimators moved, so we can't put them back.
+            failMsg = 'Failed to move the collimators: check their positions'
+            moved = 0
+            break
+        moved += move
+        cmd.inform('text="After %dth collimator move: at %d"' % (i, moved))
+
+        multiCmd = SopMultiCommand(cmd, flushDuration + cmdState.expTime + actorState.timeout,
+                                   cmdState.name + '.expose')
+        ledger.expose(multiCmd, cmdState.expTime, 'flat', readout=False)
+        if not multiCmd.run():
+            failMsg = 'Failed to take %gs exposure' % cmdState.expTime
+            break
+        cmdState.nFlatDone += 1
+        cmdState.genKeys()
+
+    if failMsg:
+        cmdState.setStageState(stageName, 'failed')
+    elif not cmdState.aborted:
+        cmdState.setStageState(stageName, 'done')
+
+    # Read out the last flat, return the collimators and turn off the lamps all at once.
+    stageName = 'cleanup'
+    cmdState.setStageState(stageName, 'running')
+    multiCmd = ledger.overlap(actorState.timeout, cmdState.name + '.cleanup')
+    if moved:
+        cmd.inform('text="Moving collimators back to initial positions"')
+        prep_collimator_move(multiCmd, cmdState.spN, -moved)
+    prep_lamps_off(multiCmd)
+    if not run_even_if_aborting(multiCmd, actorState):
+        cmdState.setStageState(stageName, 'failed')
+        return fail_command(cmd, cmdState, failMsg or 'Failed to cleanup after dithered flats',
+                            'Failed to cleanup after dithered flats; check the collimators, '
+                            'BOSS and lamps.')
+    cmdState.setStageState(stageName, 'done')
+
+    if failMsg:
+        return fail_command(cmd, cmdState, failMsg)
+    finish_command(cmd, cmdState, actorState, finishMsg)
+
+
 def show_status(cmd, cmdState, actor, oneCommand=''):
     """Output status of a new state or just one command."""
     if cmd:
@@ -1568,7 +1892,6 @@ def main(actor, queues):
 
     threadName = 'master'
     timeout = myGlobals.actorState.timeout
-    overhead = 150  # overhead per exposure, minimum; seconds
 
     while True:
         try:
@@ -1633,94 +1956,8 @@ def main(actor, queues):
                 collimate_boss(cmd, cmdState, actorState)
 
             elif msg.type == Msg.DITHERED_FLAT:
-                # Take a set of nStep dithered flats, moving the
-                # collimator by nTick between exposures
-
-                cmd = msg.cmd
-                actorState = msg.actorState
-
-                expTime = msg.expTime
-                spN = msg.spN
-                nStep = msg.nStep
-                nTick = msg.nTick
-
-                if not doLamps(cmd, actorState, FF=True):
-                    msg.replyQueue.put(Msg.EXPOSURE_FINISHED, cmd=cmd, success=False)
-                    cmd.warn('text="Some lamps failed to turn on"')
-                    continue
-
-                success = True  # let's be optimistic
-                moved = 0
-                for i in range(nStep + 1):  # +1: final large move to get back to where we started
-                    expose = True
-                    if i == 0:
-                        move = nTick * (nStep // 2)
-                    elif i == nStep:
-                        move = -moved
-                        expose = False
-                    else:
-                        move = -nTick
-
-                    dA = dB = move
-                    dC = -dA
-
-                    for sp in spN:
-                        cmdVar = actorState.actor.cmdr.call(
-                            actor='boss',
-                            forUserCmd=cmd,
-                            cmdStr=('moveColl spec=%s a=%d b=%d c=%d' % (sp, dA, dB, dC)),
-                            keyVars=[],
-                            timeLim=timeout)
-
-                        if cmdVar.didFail:
-                            cmd.warn('text="Failed to move collimator for %s"' % sp)
-                            success = False
-                            break
-
-                    if not success:
-                        break
-
-                    moved += move
-                    cmd.inform('text="After %dth collimator move: at %d"' % (i, moved))
-
-                    if expose:
-                        if False:
-                            cmd.inform('text="XXXXX Not taking a %gs exposure"' % expTime)
-                        else:
-                            cmdVar = actorState.actor.cmdr.call(
-                                actor='boss',
-                                forUserCmd=cmd,
-                                cmdStr=('exposure %s itime=%g' % ('flat', expTime)),
-                                keyVars=[],
-                                timeLim=expTime + overhead)
-
-                            if cmdVar.didFail:
-                                cmd.warn('text="Failed to take %gs exposure"' % expTime)
-                                cmd.warn('text="Moving collimators back to initial positions"')
-
-                                dA = dB = -moved
-                                dC = -dA
-
-                                for sp in spN:
-                                    cmdVar = actorState.actor.cmdr.call(
-                                        actor='boss',
-                                        forUserCmd=cmd,
-                                        cmdStr=(
-                                            'moveColl spec=%s a=%d b=%d c=%d' % (sp, dA, dB, dC)),
-                                        keyVars=[],
-                                        timeLim=timeout)
-
-                                    if cmdVar.didFail:
-                                        cmd.warn('text="Failed to move collimator for %s '
-                                                 'back to initial position"' % sp)
-                                        break
-
-                                success = False
-                                break
-
-                doLamps(cmd, actorState)
-
-                msg.replyQueue.put(Msg.EXPOSURE_FINISHED, cmd=cmd, success=success)
+                cmd, cmdState, actorState = preprocess_msg(msg)
+                dithered_flat(cmd, cmdState, actorState)
 
             elif msg.type == Msg.EXPOSURE_FINISHED:
                 if msg.success:
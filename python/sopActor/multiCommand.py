@@ -34,6 +34,7 @@ class MultiCommand(object):
         self.timeout = timeout
         self.label = label
         self.commands = []
+        self.replies = []  # the replies received so far
         self.status = True
 
         if args:
@@ -85,6 +86,7 @@ class MultiCommand(object):
                 if msg.duration > duration:
                     duration = msg.duration
 
+                msg.sentTime = time.time()
                 queue.put(msg)
 
         if nPre:
@@ -110,6 +112,7 @@ class MultiCommand(object):
                 if msg.duration > duration:
                     duration = msg.duration
 
+                msg.sentTime = time.time()
                 queue.put(msg)
 
         if self.label:
@@ -124,12 +127,15 @@ class MultiCommand(object):
             seen[tname.name] = False
 
         failed = False
+        replies = []
         for queue, isPrecondition, msg in self.commands:
             if runningPreconditions != isPrecondition:
                 continue
 
             try:
                 msg = self._replyQueue.get(timeout=self.timeout)
+                msg.receivedTime = time.time()
+                replies.append(msg)
                 seen[msg.senderName] = True
 
                 if not msg.success and not myGlobals.bypass.get(msg.senderName0, cmd=self.cmd):
@@ -144,6 +150,9 @@ class MultiCommand(object):
                 failed = True
                 break
 
+        self.replies.extend(replies)
+        self.record(runningPreconditions, replies, not failed)
+
         if self.label:
             if failed or not self.status:
                 state = 'failed'
@@ -151,3 +160,37 @@ class MultiCommand(object):
                 state = 'done' if not runningPreconditions else 'prepped'
             self.cmd.inform('stageState="%s","%s",0.0,0.0' % (self.label, state))
         return not failed and self.status
+
+    def record(self, preconditions, replies, success):
+        """
+        Record the messages that were sent in the ledger, pairing each with the
+        reply from its thread. Messages without a matching reply (e.g. answered
+        by a helper thread, or timed out) get the overall end time and status.
+        """
+        ledger = getattr(myGlobals.actorState, 'ledger', None)
+        if ledger is None or not ledger.enabled:
+            return
+        end = time.time()
+        replies = list(replies)
+        sent = [(queue, msg) for queue, isPrecondition, msg in self.commands
+                if isPrecondition == preconditions and hasattr(msg, 'sentTime')]
+        unmatched = []
+        for queue, msg in sent:
+            reply = next((r for r in replies if r.senderName0 == str(queue)), None)
+            if reply is None:
+                unmatched.append((queue, msg))
+            else:
+                replies.remove(reply)
+                self._record_msg(ledger, queue, msg, reply.receivedTime, reply.success)
+        for queue, msg in unmatched:
+            reply = replies.pop(0) if replies else None
+            if reply is None:
+                self._record_msg(ledger, queue, msg, end, success)
+            else:
+                self._record_msg(ledger, queue, msg, reply.receivedTime, reply.success)
+
+    def _record_msg(self, ledger, queue, msg, end, success):
+        params = msg.data()
+        params['label'] = self.label
+        ledger.record_state(myGlobals.actorState, 'msg', msg.type.__name__, msg.sentTime, end,
+                            success, thread=str(queue), params=params)
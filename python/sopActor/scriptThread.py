@@ -74,7 +74,7 @@ def main(actor, queues):
 
                 msg.cmd.warn('text="firing off script line: %s %s (maxTime=%0.1f)"' %
                              (actorName, cmdStr, maxTime))
-                cmdVar = actorState.actor.cmdr.call(
+                cmdVar = actorState.gateway.call(
                     actor=actorName, forUserCmd=msg.cmd, cmdStr=cmdStr, timeLim=maxTime + 15)
                 if cmdVar.didFail:
                     msg.cmd.fail('text="Script %s failed to run %s %s"' % (runningScript.name,
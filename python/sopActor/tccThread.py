@@ -86,7 +86,7 @@ def mcp_semaphore_ok(cmd, actorState):
     try:
         sem = actorState.models['mcp'].keyVarDict['semaphoreOwner'][0]
     except IndexError:
-        cmdVar = actorState.actor.cmdr.call(actor='mcp', forUserCmd=cmd, cmdStr='sem.show')
+        cmdVar = actorState.gateway.call(actor='mcp', forUserCmd=cmd, cmdStr='sem.show')
         if cmdVar.didFail:
             cmd.error('text="Error: Cannot get mcp semaphore. Is the mcp alive?"')
             return False
@@ -107,7 +107,7 @@ def axis_init(cmd, actorState, replyQueue):
     """Send 'tcc axis init', and return status."""
 
     # need to send an axis status first, just to make sure the status bits have cleared
-    cmdVar = actorState.actor.cmdr.call(actor='tcc', forUserCmd=cmd, cmdStr='axis status')
+    cmdVar = actorState.gateway.call(actor='tcc', forUserCmd=cmd, cmdStr='axis status')
     # "tcc axis status" should never fail!
     if cmdVar.didFail:
         cmd.error('text="Cannot check axis status. Something is very wrong!"')
@@ -124,7 +124,7 @@ def axis_init(cmd, actorState, replyQueue):
         # wait a couple seconds, then try again: the stop bits behave like sticky bits,
         # and may require two "tcc axis status" queries to fully clear.
         time.sleep(2)
-        cmdVar = actorState.actor.cmdr.call(actor='tcc', forUserCmd=cmd, cmdStr='axis status')
+        cmdVar = actorState.gateway.call(actor='tcc', forUserCmd=cmd, cmdStr='axis status')
         if check_stop_in(actorState):
             cmd.error(
                 'text="Cannot tcc axis init because of bad axis status: Check stop buttons on Interlocks panel."'
@@ -149,7 +149,7 @@ def axis_init(cmd, actorState, replyQueue):
                 'text="Altitude below interlock limit! Only initializing altitude and rotator: cannot move in az."'
             )
             cmdStr = ' '.join((cmdStr, 'rot,alt'))
-        cmdVar = actorState.actor.cmdr.call(actor='tcc', forUserCmd=cmd, cmdStr=cmdStr)
+        cmdVar = actorState.gateway.call(actor='tcc', forUserCmd=cmd, cmdStr=cmdStr)
 
     if cmdVar.didFail:
         cmd.error('text="Cannot slew telescope: failed tcc axis init."')
@@ -163,7 +163,7 @@ def axis_init(cmd, actorState, replyQueue):
 
 
 def axis_stop(cmd, actorState, replyQueue):
-    cmdVar = actorState.actor.cmdr.call(actor='tcc', forUserCmd=cmd, cmdStr='axis stop')
+    cmdVar = actorState.gateway.call(actor='tcc', forUserCmd=cmd, cmdStr='axis stop')
     if cmdVar.didFail:
         cmd.error('text="Error: failed to cleanly stop telescope via tcc axis stop."')
         replyQueue.put(Msg.REPLY, cmd=cmd, success=False)
@@ -182,6 +182,8 @@ class SlewHandler(object):
         slewHandler.do_slew(msg.cmd, msg.replyQueue)
     """
 
+    handoverAttrs = ('ignoreBadAz', )  # kept when the thread is restarted
+
     def __init__(self, actorState, queue):
         self.actorState = actorState
         self.queue = queue
@@ -243,7 +245,7 @@ class SlewHandler(object):
 
     def do_slew(self, cmd, replyQueue):
         """Correctly handle a slew command, given what parse_args had received."""
-        call = self.actorState.actor.cmdr.call
+        call = self.actorState.gateway.call
         tccModel = self.actorState.models['tcc']
 
         # NOTE: TBD: We should limit which offsets are kept.
@@ -318,7 +320,8 @@ def main(actor, queues):
     threadName = 'tcc'
     actorState = myGlobals.actorState
     timeout = actorState.timeout
-    slewHandler = SlewHandler(actorState, queues[sopActor.TCC])
+    slewHandler = actorState.supervisor.adopt(threadName,
+                                              SlewHandler(actorState, queues[sopActor.TCC]))
 
     while True:
         try:
@@ -0,0 +1,108 @@
+"""
+Plan the order of the exposures in a BOSS calibration sequence.
+"""
+
+import collections
+import itertools
+
+
+CalibStep = collections.namedtuple('CalibStep', ['expType', 'n', 'start', 'end'])
+
+# The order doBossCalibs has always used; preferred when several orders are as fast.
+canonicalOrder = ('bias', 'dark', 'flat', 'arc')
+
+# The lamps that must be on (and warm) for each exposure type; all others are off.
+lampsFor = {'bias': (), 'dark': (), 'flat': ('ff', ), 'arc': ('hgcd', 'ne')}
+
+
+def simulate(order,
+             counts,
+             expTimes,
+             warmup,
+             ffsOpen=False,
+             warmFor=None,
+             flushTime=25.,
+             readoutTime=82.,
+             ffsTime=15.):
+    """
+    Return ([CalibStep], total time) for taking the exposures in order.
+
+    Parameters
+    ----------
+    order : sequence of str
+        The exposure types, in the order they are taken.
+    counts, expTimes : dict
+        The number of exposures and exposure time of each type.
+    warmup : dict
+        The warm-up time of each lamp ('ff', 'hgcd', 'ne').
+    ffsOpen : bool
+        Whether the flat field screens are open at the start (they are
+        reopened at the end).
+    warmFor : dict
+        How long each lamp that is already on has been on.
+
+    Flats and arcs are read out while the next step is prepared. Biases and
+    darks are read out before anything else happens, since the lamps must not
+    change during their readout.
+    """
+    onSince = dict((lamp, -t) for lamp, t in (warmFor or {}).items())
+    ffsClosed = not ffsOpen
+    pending = False
+    now = 0.
+    steps = []
+
+    for expType in order:
+        n = counts.get(expType, 0)
+        if n <= 0:
+            continue
+
+        lamps = lampsFor[expType]
+        prep = 0.
+        if lamps and not ffsClosed:
+            prep = ffsTime
+            ffsClosed = True
+        for lamp in list(onSince):
+            if lamp not in lamps:
+                del onSince[lamp]
+        for lamp in lamps:
+            onSince.setdefault(lamp, now)
+            prep = max(prep, onSince[lamp] + warmup.get(lamp, 0) - now)
+
+        if pending:
+            now += max(readoutTime, prep) if lamps else readoutTime + prep
+        else:
+            now += prep
+
+        start = now
+        for i in range(n):
+            if i > 0 and pending:
+                now += readoutTime
+            now += flushTime + expTimes.get(expType, 0)
+            if lamps:
+                pending = True
+            else:
+                now += readoutTime
+                pending = False
+        steps.append(CalibStep(expType, n, start, now))
+
+    restore = ffsTime if (ffsOpen and ffsClosed) else 0.
+    now += max(readoutTime if pending else 0., restore)
+    return steps, now
+
+
+def plan_calibs(counts, expTimes, warmup, **kwargs):
+    """
+    Return (order, [CalibStep], total time) for the fastest order of the exposures.
+
+    Takes the same arguments as simulate(), without the order.
+    """
+    wanted = [expType for expType in canonicalOrder if counts.get(expType, 0) > 0]
+    best = None
+    for order in itertools.permutations(wanted):
+        steps, total = simulate(order, counts, expTimes, warmup, **kwargs)
+        # permutations() starts from the canonical order, so keep the first of equals.
+        if best is None or total < best[2]:
+            best = (list(order), steps, total)
+    if best is None:
+        return [], [], 0.
+    return best
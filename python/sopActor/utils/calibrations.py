@@ -0,0 +1,61 @@
+"""
+Remember the gotoField arcs and flats, so they are not retaken when revisiting a field.
+"""
+
+import collections
+import time
+
+
+Calibration = collections.namedtuple('Calibration', ['expType', 'expTime', 'field', 'time'])
+
+
+class CalibrationRegistry(object):
+    """
+    The successful gotoField calibrations, per field.
+
+    A field is identified by (plateId, cartridgeId, pointing), as in the
+    platedb pointingInfo keyword. A calibration satisfies a new request if
+    it is of the same type and exposure time, was taken on the same field,
+    and is at most maxAge seconds old. A maxAge of 0 disables reuse.
+    """
+
+    def __init__(self, maxAge=0.):
+        self.maxAge = maxAge
+        self.calibrations = {}  # (expType, field): Calibration
+
+    @staticmethod
+    def field(models):
+        """Return the identity of the field from platedb.pointingInfo, or None if unknown."""
+        try:
+            pointingInfo = models['platedb'].keyVarDict['pointingInfo']
+            field = tuple(pointingInfo[i] for i in range(3))
+        except (KeyError, IndexError, AttributeError, TypeError):
+            return None
+        return None if None in field else field
+
+    def record(self, expType, expTime, field, now=None):
+        """Record a successful calibration exposure on field."""
+        if field is None:
+            return
+        self.calibrations[(expType, field)] = Calibration(
+            expType, expTime, field, now if now is not None else time.time())
+
+    def invalidate(self, field=None):
+        """Forget the calibrations of field, or all of them if field is None."""
+        if field is None:
+            self.calibrations = {}
+            return
+        for key in [key for key in self.calibrations if key[1] == field]:
+            del self.calibrations[key]
+
+    def find(self, expType, expTime, field, now=None):
+        """Return the Calibration that satisfies this request, or None."""
+        if self.maxAge <= 0 or field is None:
+            return None
+        calibration = self.calibrations.get((expType, field))
+        if calibration is None or calibration.expTime != expTime:
+            return None
+        now = now if now is not None else time.time()
+        if now - calibration.time > self.maxAge:
+            return None
+        return calibration
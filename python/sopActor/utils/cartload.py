@@ -0,0 +1,171 @@
+"""
+Prepare the first gotoField of a newly loaded cartridge before it is commanded.
+"""
+
+import collections
+import threading
+import time
+
+import sopActor
+import sopActor.myGlobals as myGlobals
+from sopActor import Msg
+from sopActor.utils.calibrations import CalibrationRegistry
+from sopActor.utils.nightplan import scienceCommands
+
+Prepared = collections.namedtuple(
+    'Prepared', ['cartridge', 'field', 'ra', 'dec', 'alt', 'az', 'slewTime', 'stages', 'science',
+                 'time'])
+
+# The lamps gotoField's arcs and Hartmann need, with their names.
+arcLamps = ((sopActor.HGCD_LAMP, 'HgCd'), (sopActor.NE_LAMP, 'Ne'))
+
+
+class CartLoadPrep(object):
+    """
+    Prepare, in a background thread, the first gotoField on each newly
+    loaded cartridge.
+
+    updateCartridge (on the reactor thread) only classifies the cartridge and
+    calls loaded(); prepare() then reads the slew target from platedb
+    pointingInfo, predicts its alt/az and slew time from the current tcc
+    axePos with the fieldPlanner, and notes gotoField's active stages and
+    the survey's science command. The result is output as cartLoadPrep.
+    If gotoField will take arcs or a Hartmann, the arc lamps are hinted as
+    needed at the end of that slew and turned on in time to be warm then,
+    unless gotoField is commanded first.
+
+    claim() returns the preparation while it still applies (same cartridge
+    and pointing): gotoField slews to its target, with its stages, and hints
+    the lamps with its slew time. A preparation superseded by a later load is
+    discarded. With enabled False, nothing is prepared.
+    """
+
+    def __init__(self, actorState, enabled=False):
+        self.actorState = actorState
+        self.enabled = enabled
+        self.prepared = None
+        self._lock = threading.Lock()
+        self._generation = 0  # incremented on each load, to discard stale preparations
+        self._claimed = threading.Event()  # set once the lamp pre-warm is no longer wanted
+        self._thread = None
+
+    def loaded(self, cartridge):
+        """Forget the previous cartridge, and prepare cartridge in the background."""
+        with self._lock:
+            self._generation += 1
+            generation = self._generation
+            self.prepared = None
+            self._claimed.set()
+            self._claimed = claimed = threading.Event()
+        survey = getattr(self.actorState, 'survey', None)
+        if not self.enabled or survey is None or survey is sopActor.UNKNOWN:
+            return
+        self._thread = threading.Thread(target=self._run, args=(cartridge, generation, claimed),
+                                        name='cartLoad')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self, cartridge, generation, claimed):
+        """Prepare cartridge, and keep the result unless another one was loaded meanwhile."""
+        bcast = self.actorState.actor.bcast
+        try:
+            prepared = self.prepare(cartridge)
+        except Exception as e:
+            bcast.warn('text="Could not prepare cartridge %s: %s"' % (cartridge, e))
+            return
+        with self._lock:
+            if generation != self._generation:
+                return
+            self.prepared = prepared
+        self.genKeys(bcast)
+        self.prewarm_lamps(prepared, claimed)
+
+    def prepare(self, cartridge, now=None):
+        """Return the Prepared gotoField of cartridge, from the current models."""
+        now = now if now is not None else time.time()
+        actorState = self.actorState
+        models = actorState.models
+        field = CalibrationRegistry.field(models)
+        ra = dec = alt = az = slewTime = None
+        if field is not None:
+            pointingInfo = models['platedb'].keyVarDict['pointingInfo']
+            ra, dec = pointingInfo[3], pointingInfo[4]
+            planner = actorState.fieldPlanner
+            ha, alts, azs = planner.altaz([ra], [dec], now)
+            alt, az = float(alts[0]), float(azs[0])
+            axePos = models['tcc'].keyVarDict['axePos']
+            fromAz, fromAlt = [float('nan') if axePos[i] is None else axePos[i] for i in (0, 1)]
+            slewTime = float(planner.slew_time(fromAz, fromAlt, azs, alts)[0])
+            if slewTime != slewTime:  # NaN: unknown axePos
+                slewTime = actorState.metrics.mean('gotoField.slew')
+        gotoField = actorState.gotoField
+        stages = [stage for stage in gotoField.allStages if gotoField.stages[stage] != 'off']
+        science = scienceCommands.get(actorState.survey)
+        return Prepared(cartridge, field, ra, dec, alt, az, slewTime, stages, science, now)
+
+    def lamp_turn_on_times(self, prepared):
+        """
+        Hint that the arc lamps are needed at the end of the slew, if gotoField
+        uses them, and return [(turnOnTime, lamp, name)] to have them warm by then.
+        """
+        if prepared.slewTime is None or not set(('hartmann', 'calibs')) & set(prepared.stages):
+            return []
+        lampState = self.actorState.lampState
+        neededAt = prepared.time + prepared.slewTime
+        turnOn = []
+        for lamp, name in arcLamps:
+            lampState.hint(lamp, neededAt)
+            warmupTime = myGlobals.warmupTime[lamp]
+            turnOn.append((lampState.turn_on_time(lamp, neededAt, warmupTime, prepared.time),
+                           lamp, name))
+        return sorted(turnOn, key=lambda x: x[0])
+
+    def prewarm_lamps(self, prepared, claimed):
+        """
+        Turn the arc lamps on when lamp_turn_on_times says, until claimed is set
+        (by gotoField, which then turns them on itself, or by another load).
+        """
+        bcast = self.actorState.actor.bcast
+        replyQueue = sopActor.Queue('cartLoadLamps')
+        for turnOn, lamp, name in self.lamp_turn_on_times(prepared):
+            if claimed.wait(max(turnOn - time.time(), 0)):
+                return
+            if self.actorState.lampState.is_on(lamp):
+                continue
+            bcast.inform('text="Pre-warming the %s lamps for gotoField"' % name)
+            self.actorState.queues[lamp].put(
+                Msg.LAMP_ON, cmd=bcast, replyQueue=replyQueue, on=True)
+            try:
+                reply = replyQueue.get(timeout=self.actorState.timeout)
+            except sopActor.Queue.Empty:
+                reply = None
+            if reply is None or not reply.success:
+                bcast.warn('text="Could not pre-warm the %s lamps"' % name)
+
+    def claim(self):
+        """Return current(), for gotoField, which now turns the lamps on itself."""
+        with self._lock:
+            self._claimed.set()
+        return self.current()
+
+    def current(self):
+        """Return the preparation if it is for the loaded cartridge and pointing, else None."""
+        with self._lock:
+            prepared = self.prepared
+        if prepared is None or prepared.field is None:
+            return None
+        if prepared.cartridge != getattr(self.actorState, 'cartridge', None):
+            return None
+        if prepared.field != CalibrationRegistry.field(self.actorState.models):
+            return None
+        return prepared
+
+    def genKeys(self, cmd):
+        """Output the preparation of the loaded cartridge, if there is one."""
+        prepared = self.current()
+        if prepared is None:
+            return
+        cmd.inform('cartLoadPrep=%d,%0.4f,%0.4f,%0.3f,%0.3f,%0.1f,"%s",%s' %
+                   (prepared.cartridge, prepared.ra, prepared.dec, prepared.alt, prepared.az,
+                    prepared.slewTime if prepared.slewTime is not None else -1,
+                    ' '.join(prepared.stages), prepared.science or 'None'))
@@ -0,0 +1,63 @@
+"""
+Save the progress of sop sequences to disk, so they can be resumed after an actor restart.
+"""
+
+import json
+import os
+import threading
+import time
+
+
+class CheckpointStore(object):
+    """
+    The last saved progress of each sequence command, one JSON file per command.
+
+    A checkpoint is replaced atomically (written to a temporary file, then
+    renamed), so a crash while saving leaves the previous checkpoint intact.
+    With no directory, nothing is saved and there is nothing to resume.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.directory is not None
+
+    def _path(self, name):
+        return os.path.join(self.directory, '%s.json' % name)
+
+    def save(self, name, cartridge, keywords, state, now=None):
+        """Save the keywords and other state of command name, taken with cartridge."""
+        if not self.enabled:
+            return
+        checkpoint = dict(name=name, cartridge=cartridge, keywords=keywords, state=state,
+                          time=now if now is not None else time.time())
+        path = self._path(name)
+        with self._lock:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            with open(path + '.tmp', 'w') as f:
+                json.dump(checkpoint, f, sort_keys=True)
+            os.rename(path + '.tmp', path)
+
+    def load(self, name):
+        """Return the checkpoint of command name as a dict, or None if there is none."""
+        if not self.enabled:
+            return None
+        try:
+            with open(self._path(name)) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def clear(self, name):
+        """Forget the checkpoint of command name, e.g. once it has finished."""
+        if not self.enabled:
+            return
+        with self._lock:
+            try:
+                os.remove(self._path(name))
+            except OSError:
+                pass
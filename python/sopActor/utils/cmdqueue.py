@@ -0,0 +1,103 @@
+"""
+Hold sop commands to be started as soon as the running command finishes.
+"""
+
+import threading
+
+from opscore.utility.qstr import qstr
+from twisted.internet import reactor
+
+
+class CommandQueue(object):
+    """
+    An ordered, editable list of top-level sop commands.
+
+    When a command reaches the 'done' state, the first queued command is
+    issued to sop through the hub, so there is no wait for the observer to
+    type it. If a command fails or is aborted the queue is cleared, since
+    the follow-on commands were planned on the assumption that it succeeded.
+
+    The state changes come from the master thread, the edits from the
+    reactor thread, so all access to the list is locked.
+    """
+
+    def __init__(self, actorState):
+        self.actorState = actorState
+        self._lock = threading.Lock()
+        self.commands = []
+        self.running = None  # the command string most recently started from the queue
+
+    def add(self, cmdStr, position=None):
+        """Insert cmdStr before position (1 is next), or at the end if position is None."""
+        with self._lock:
+            if position is None:
+                self.commands.append(cmdStr)
+            elif 1 <= position <= len(self.commands) + 1:
+                self.commands.insert(position - 1, cmdStr)
+            else:
+                raise IndexError('Queue position %d is not between 1 and %d' %
+                                 (position, len(self.commands) + 1))
+
+    def remove(self, position):
+        """Remove and return the command at position (1 is next)."""
+        with self._lock:
+            if not 1 <= position <= len(self.commands):
+                raise IndexError('There is no queued command at position %d' % position)
+            return self.commands.pop(position - 1)
+
+    def clear(self):
+        """Remove all queued commands, returning how many there were."""
+        with self._lock:
+            nCleared = len(self.commands)
+            self.commands = []
+        return nCleared
+
+    def pop(self):
+        """Remove and return the next command, or None if the queue is empty."""
+        with self._lock:
+            return self.commands.pop(0) if self.commands else None
+
+    def __len__(self):
+        with self._lock:
+            return len(self.commands)
+
+    def genKeys(self, cmd):
+        """Output the queued commands, in order."""
+        with self._lock:
+            commands = list(self.commands)
+        cmd.inform('sopQueue=%s' % ','.join(qstr(cmdStr) for cmdStr in commands))
+
+    def command_finished(self, cmdState, state):
+        """Called when cmdState enters a final state: start the next command, or clear the queue."""
+        if not len(self):
+            return
+        bcast = self.actorState.actor.bcast
+        if state == 'done':
+            reactor.callFromThread(self.start_next)
+        elif state in ('failed', 'aborted'):
+            self.clear()
+            bcast.warn('text="%s %s: cleared the sop command queue."' % (cmdState.name, state))
+            self.genKeys(bcast)
+
+    def start_next(self):
+        """Issue the next queued command to sop."""
+        cmdStr = self.pop()
+        if cmdStr is None:
+            return
+        self.running = cmdStr
+        bcast = self.actorState.actor.bcast
+        bcast.inform('text="Starting queued command: %s"' % cmdStr)
+        self.genKeys(bcast)
+        self.actorState.gateway.bgCall(
+            callFunc=self.startedCB,
+            actor=self.actorState.actor.name,
+            forUserCmd=None,
+            cmdStr=cmdStr)
+
+    def startedCB(self, cmdVar):
+        """Clear the queue if the queued command was rejected or failed."""
+        if cmdVar.didFail and self.clear():
+            bcast = self.actorState.actor.bcast
+            bcast.warn('text=%s' % qstr('Queued command failed: %s; cleared the sop command queue.'
+                                        % self.running))
+            self.genKeys(bcast)
@@ -0,0 +1,90 @@
+"""
+Plan the BOSS exposures that are taken during an APOGEE dither set.
+"""
+
+import collections
+import math
+
+
+CoObservingPlan = collections.namedtuple(
+    'CoObservingPlan', ['nBoss', 'bossTime', 'apogeeTime', 'duration', 'efficiency'])
+
+
+def efficiency(bossTime, apogeeTime, duration):
+    """Return the fraction of the time both instruments spent with their shutters open."""
+    if duration <= 0:
+        return 0.
+    return (bossTime + apogeeTime) / (2. * duration)
+
+
+def apogee_window(apogeeExpTime, nApogee=2, readTime=None):
+    """
+    Return how long the APOGEE dither set takes.
+
+    If the read cadence is known, each exposure lasts a whole number of reads.
+    """
+    if readTime:
+        apogeeExpTime = math.ceil(apogeeExpTime / readTime) * readTime
+    return nApogee * apogeeExpTime
+
+
+def plan_boss_exposures(bossExpTime,
+                        apogeeExpTime,
+                        flushTime,
+                        readoutTime,
+                        nApogee=2,
+                        lead=None,
+                        readTime=None,
+                        nBoss=None):
+    """
+    Choose how many BOSS exposures to take during an APOGEE dither set.
+
+    Parameters
+    ----------
+    bossExpTime, apogeeExpTime : float
+        The exposure time of each BOSS and APOGEE exposure.
+    flushTime, readoutTime : float
+        The (measured) BOSS flush and readout times.
+    nApogee : int
+        The number of APOGEE exposures in the dither set.
+    lead : str or None
+        ``'apogee'``: the BOSS exposures must not extend the dither set (only
+        the last readout may run past its end).
+        ``'boss'``: BOSS must keep exposing for the whole dither set.
+        ``None``: no constraint.
+    readTime : float or None
+        The (measured) time between APOGEE reads.
+    nBoss : int or None
+        If set, the number of BOSS exposures is fixed, and only their
+        duration and efficiency are planned.
+
+    Returns
+    -------
+    plan : `CoObservingPlan`
+        Among the numbers of exposures allowed by the lead survey (or nBoss),
+        the one with the most combined open-shutter time per unit time.
+    """
+    window = apogee_window(apogeeExpTime, nApogee, readTime)
+    cycle = flushTime + bossExpTime + readoutTime
+    apogeeTime = nApogee * apogeeExpTime
+
+    nFloor = max(int(window / cycle), 1)
+    nCeil = max(int(math.ceil(window / cycle)), 1)
+    if nBoss is not None:
+        candidates = [nBoss]
+    elif lead == 'apogee':
+        candidates = [n for n in range(nFloor, nCeil + 1) if n * cycle <= window + readoutTime]
+        candidates = candidates or [nFloor]
+    elif lead == 'boss':
+        candidates = [nCeil]
+    else:
+        candidates = range(nFloor, nCeil + 1)
+
+    plans = []
+    for n in candidates:
+        duration = max(window, n * cycle)
+        bossTime = n * bossExpTime
+        plans.append(
+            CoObservingPlan(n, bossTime, apogeeTime, duration,
+                            efficiency(bossTime, apogeeTime, duration)))
+    return max(plans, key=lambda plan: plan.efficiency)
@@ -0,0 +1,248 @@
+"""
+Break a night down into open-shutter time and overheads, from the sop ledger.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import collections
+import json
+import sys
+import time
+
+from sopActor.utils.ledger import Ledger
+
+
+# In order of precedence: when several activities overlap (e.g. a slew during
+# a BOSS readout), the time is counted in the first one.
+categories = ('integrating', 'reading', 'calibrating', 'slewing', 'lamps', 'ffs', 'guider',
+              'idle')
+
+scienceTypes = ('science', 'object')
+lampThreads = ('ff', 'hgcd', 'ne', 'uv', 'wht')
+
+# The time (seconds) the BOSS chips are flushed before the shutter opens, until
+# it has been measured (the boss.flush metric); as masterThread.flushDuration.
+bossFlushTime = 25.
+
+# The category of the time not covered by a message, by stage name.
+stageCategories = {
+    'slew': 'slewing',
+    'offset': 'slewing',
+    'hartmann': 'calibrating',
+    'left': 'calibrating',
+    'right': 'calibrating',
+    'collimate': 'calibrating',
+    'calibs': 'calibrating',
+    'bias': 'calibrating',
+    'dark': 'calibrating',
+    'flat': 'calibrating',
+    'flats': 'calibrating',
+    'arc': 'calibrating',
+    'lamps': 'lamps',
+    'guider': 'guider',
+    'dither': 'guider',
+}
+
+Interval = collections.namedtuple('Interval', ['start', 'end', 'category'])
+
+
+def current_mjd(now=None):
+    """Return the SDSS MJD (which changes at local noon at APO) of time now."""
+    now = now if now is not None else time.time()
+    return int(now / 86400. + 40587.3)
+
+
+def mjd_range(mjd):
+    """Return the start and end times of the SDSS MJD mjd."""
+    start = (mjd - 40587.3) * 86400.
+    return start, start + 86400.
+
+
+def _exposure(entry, params, openTime, flushTime=0.):
+    """Split an exposure into its flush, open-shutter time and readout."""
+    if params.get('expType') not in scienceTypes:
+        return [Interval(entry.start, entry.end, 'calibrating')]
+    openStart = min(entry.start + max(flushTime, 0), entry.end)
+    openEnd = min(openStart + max(openTime, 0), entry.end)
+    intervals = [Interval(entry.start, openStart, 'reading')] if openStart > entry.start else []
+    return intervals + [Interval(openStart, openEnd, 'integrating'),
+                        Interval(openEnd, entry.end, 'reading')]
+
+
+def classify_msg(entry, flushTime=bossFlushTime):
+    """
+    Return the Intervals of a 'msg' ledger entry.
+
+    The BOSS shutter is taken to open flushTime after the exposure message is
+    sent, and the APOGEE one when it is sent; the flush, and the time after
+    expTime (the readout, if there is one), are counted as reading. A BOSS
+    readout on its own (expTime < 0) is reading.
+    """
+    params = json.loads(entry.params) if entry.params else {}
+    thread = entry.thread
+    if thread == 'boss' and entry.name == 'EXPOSE':
+        if params.get('expTime', 0) < 0:
+            return [Interval(entry.start, entry.end, 'reading')]
+        return _exposure(entry, params, params.get('expTime', 0), flushTime)
+    if thread == 'boss' and entry.name in ('HARTMANN', 'SINGLE_HARTMANN', 'MOVE_COLLIMATOR'):
+        return [Interval(entry.start, entry.end, 'calibrating')]
+    if thread == 'apogee' and entry.name in ('APOGEE_DITHER_SET', 'EXPOSE'):
+        nDithers = len(params.get('dithers', '')) or 1
+        return _exposure(entry, params, params.get('expTime', 0) * nDithers)
+    if thread == 'gcamera' and entry.name == 'EXPOSE':
+        return [Interval(entry.start, entry.end, 'calibrating')]
+    if thread == 'guider':
+        category = 'calibrating' if entry.name == 'EXPOSE' else 'guider'
+        return [Interval(entry.start, entry.end, category)]
+    if thread in lampThreads and entry.name == 'LAMP_ON' and params.get('on', True):
+        return [Interval(entry.start, entry.end, 'lamps')]
+    if thread == 'ffs':
+        return [Interval(entry.start, entry.end, 'ffs')]
+    if thread in ('tcc', 'slew'):
+        return [Interval(entry.start, entry.end, 'slewing')]
+    return []
+
+
+def classify_stage(entry):
+    """Return the category of a 'stage' ledger entry (e.g. gotoField.slew), or None."""
+    return stageCategories.get(entry.name.split('.')[-1])
+
+
+class EfficiencyReport(object):
+    """
+    How the time between start and end was spent, in total and per stage.
+
+    The thread messages give the finest breakdown. The time not covered by
+    any message is counted by the stage it falls in (e.g. the rest of
+    gotoField.slew is slewing), and the time outside of any categorised
+    message or stage is idle.
+    """
+
+    def __init__(self, entries, start, end, mjd=None, flushTime=bossFlushTime):
+        self.start = start
+        self.end = end
+        self.mjd = mjd if mjd is not None else current_mjd(start)
+        self.flushTime = flushTime
+        self.totals = dict((category, 0.) for category in categories)
+        self.stages = collections.OrderedDict()  # stage: {category: seconds}
+        self._add(entries)
+
+    @classmethod
+    def from_ledger(cls, ledger, mjd=None, flushTime=bossFlushTime):
+        """
+        Return the report of SDSS MJD mjd (default: the current one), from the
+        first to the last command recorded in ledger during that MJD, with BOSS
+        exposures flushing for flushTime seconds.
+        """
+        mjd = mjd if mjd is not None else current_mjd()
+        nightStart, nightEnd = mjd_range(mjd)
+        entries = ledger.between(nightStart, nightEnd)
+        commands = [entry for entry in entries if entry.kind == 'command']
+        start = max(min(entry.start for entry in commands), nightStart) if commands else nightStart
+        end = min(max(entry.end for entry in commands), nightEnd) if commands else nightStart
+        return cls(entries, start, end, mjd, flushTime)
+
+    def _add(self, entries):
+        """Sweep the entries' intervals, counting each slice of time in one category."""
+        precedence = dict((category, i) for i, category in enumerate(categories))
+        events = []  # (time, +1|-1, rank or None, stage name or None)
+        for entry in entries:
+            if entry.start is None or entry.end is None:
+                continue
+            if entry.kind == 'msg':
+                for interval in classify_msg(entry, self.flushTime):
+                    rank = precedence[interval.category]
+                    events.append((interval.start, 1, rank, None))
+                    events.append((interval.end, -1, rank, None))
+            elif entry.kind == 'stage':
+                category = classify_stage(entry)
+                rank = precedence[category] + len(categories) if category else None
+                events.append((entry.start, 1, rank, entry.name))
+                events.append((entry.end, -1, rank, entry.name))
+        events.sort(key=lambda event: event[0])
+
+        active = collections.Counter()
+        activeStages = []
+        last = self.start
+        for when, change, rank, stage in events + [(self.end, 0, None, None)]:
+            when = min(max(when, self.start), self.end)
+            if when > last:
+                self._count(last, when, active, activeStages)
+                last = when
+            if rank is not None:
+                active[rank] += change
+            if stage is not None:
+                if change > 0:
+                    activeStages.append(stage)
+                elif stage in activeStages:
+                    activeStages.remove(stage)
+
+    def _count(self, start, end, active, activeStages):
+        """Count start-end in the highest-precedence active category, and the latest stage."""
+        ranks = [rank for rank, n in active.items() if n > 0]
+        category = categories[min(ranks) % len(categories)] if ranks else 'idle'
+        self.totals[category] += end - start
+        if activeStages:
+            stage = self.stages.setdefault(activeStages[-1],
+                                           dict((c, 0.) for c in categories))
+            stage[category] += end - start
+
+    @property
+    def duration(self):
+        return max(self.end - self.start, 0.)
+
+    @property
+    def open_fraction(self):
+        """Return the fraction of the time spent with a science shutter open."""
+        return self.totals['integrating'] / self.duration if self.duration > 0 else 0.
+
+    def genKeys(self, cmd):
+        """Output the night's efficiency, its breakdown by category and by stage."""
+        cmd.inform('nightEfficiency=%d,%0.1f,%0.1f,%0.3f' %
+                   (self.mjd, self.start, self.duration,
+                    self.open_fraction))
+        for category in categories:
+            seconds = self.totals[category]
+            cmd.inform('nightEfficiencyTime=%s,%0.1f,%0.3f' %
+                       (category, seconds, seconds / self.duration if self.duration > 0 else 0))
+        for name, stage in self.stages.items():
+            total = sum(stage.values())
+            cmd.inform('nightEfficiencyStage=%s,%0.1f,%0.1f,%0.1f' %
+                       (name, total, stage['integrating'], total - stage['integrating']))
+
+    def format(self):
+        """Return the report as text."""
+        lines = ['MJD %d: %s to %s, %0.2f h, shutter open %0.1f%%' %
+                 (self.mjd, time.strftime('%H:%M:%S', time.gmtime(self.start)),
+                  time.strftime('%H:%M:%S', time.gmtime(self.end)), self.duration / 3600.,
+                  100 * self.open_fraction), '']
+        for category in categories:
+            seconds = self.totals[category]
+            lines.append('%-12s %8.1f min %6.1f%%' %
+                         (category, seconds / 60.,
+                          100 * seconds / self.duration if self.duration > 0 else 0))
+        if self.stages:
+            lines += ['', '%-32s %8s %8s %8s' % ('stage (minutes)', 'total', 'open', 'overhead')]
+            for name, stage in self.stages.items():
+                total = sum(stage.values())
+                lines.append('%-32s %8.1f %8.1f %8.1f' %
+                             (name, total / 60., stage['integrating'] / 60.,
+                              (total - stage['integrating']) / 60.))
+        return '\n'.join(lines)
+
+
+def main(argv=None):
+    """Print the efficiency report of a night from a sop ledger file."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('ledger', help='the sop ledger (SQLite) file')
+    parser.add_argument('--mjd', type=int, default=None, help='the SDSS MJD; default: today')
+    args = parser.parse_args(argv)
+
+    report = EfficiencyReport.from_ledger(Ledger(args.ledger), args.mjd)
+    print(report.format())
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
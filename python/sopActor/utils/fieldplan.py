@@ -0,0 +1,130 @@
+"""
+Predict where candidate fields are, and how long it takes to slew to them, all at once.
+"""
+
+import time
+
+import numpy
+
+
+def read_fields(path):
+    """
+    Return the fields of a plate list file as (plates, cartridges, ra, dec) arrays.
+
+    Each line is "plate ra dec [cartridge]", with ra and dec in degrees;
+    blank lines and # comments are ignored. An unknown cartridge is -1.
+    """
+    plates, cartridges, ras, decs = [], [], [], []
+    with open(path) as f:
+        for n, line in enumerate(f, 1):
+            words = line.split('#')[0].split()
+            if not words:
+                continue
+            if len(words) not in (3, 4):
+                raise ValueError('%s line %d: expected "plate ra dec [cartridge]"' % (path, n))
+            plates.append(int(words[0]))
+            ras.append(float(words[1]))
+            decs.append(float(words[2]))
+            cartridges.append(int(words[3]) if len(words) == 4 else -1)
+    return (numpy.array(plates, dtype=int), numpy.array(cartridges, dtype=int),
+            numpy.array(ras, dtype=float), numpy.array(decs, dtype=float))
+
+
+def lst(longitude, now):
+    """Return the local apparent sidereal time in degrees at longitude (east positive) and now."""
+    jd = now / 86400. + 2440587.5
+    return (280.46061837 + 360.98564736629 * (jd - 2451545.0) + longitude) % 360.
+
+
+class FieldPlan(object):
+    """
+    The predicted hour angle, alt/az, airmass and slew time of a batch of fields.
+
+    Each quantity is an array with one value per field, in the order given;
+    order() sorts them with the fields above minAlt first, by slew time.
+    """
+
+    def __init__(self, plates, cartridges, ha, alt, az, airmass, slewTime, now, lst, minAlt):
+        self.plates = plates
+        self.cartridges = cartridges
+        self.ha = ha
+        self.alt = alt
+        self.az = az
+        self.airmass = airmass
+        self.slewTime = slewTime
+        self.now = now
+        self.lst = lst
+        self.minAlt = minAlt
+
+    def __len__(self):
+        return len(self.plates)
+
+    def order(self):
+        """Return the indexes of the fields, the observable ones first, by slew time."""
+        return numpy.lexsort((self.slewTime, self.alt < self.minAlt))
+
+    def genKeys(self, cmd):
+        """Output the time of the plan, then one fieldPlan keyword per field, in order()."""
+        cmd.inform('fieldPlanTime=%0.1f,%0.4f,%d' % (self.now, self.lst, len(self)))
+        for i in self.order():
+            cmd.inform('fieldPlan=%d,%d,%0.4f,%0.3f,%0.3f,%0.3f,%0.1f' %
+                       (self.plates[i], self.cartridges[i], self.ha[i], self.alt[i], self.az[i],
+                        self.airmass[i], self.slewTime[i]))
+
+
+class FieldPlanner(object):
+    """
+    Compute a FieldPlan for many candidate pointings with NumPy, in one pass.
+
+    Positions are geometric (no refraction or precession), which is plenty to
+    compare fields, but not to point the telescope. Azimuth follows the TCC
+    convention (0 = south, 90 = east). The slew time is the time of the
+    slower of the az and alt axes at their maximum speeds, taking the short
+    way around in az, plus the settling time.
+    """
+
+    def __init__(self, longitude=-105.820417, latitude=32.780361, azSpeed=1.5, altSpeed=1.5,
+                 settleTime=30., minAlt=30., fieldFile=None):
+        self.longitude = longitude  # degrees east
+        self.latitude = latitude
+        self.azSpeed = azSpeed  # degrees/second
+        self.altSpeed = altSpeed
+        self.settleTime = settleTime  # seconds
+        self.minAlt = minAlt  # degrees: lower fields are listed last
+        self.fieldFile = fieldFile  # default plate list
+
+    def altaz(self, ra, dec, now):
+        """Return the (ha, alt, az) arrays in degrees of the ra, dec arrays at time now."""
+        ha = (lst(self.longitude, now) - numpy.asarray(ra) + 180.) % 360. - 180.
+        haRad, decRad, latRad = numpy.radians(ha), numpy.radians(dec), numpy.radians(self.latitude)
+        sinAlt = (numpy.sin(decRad) * numpy.sin(latRad) +
+                  numpy.cos(decRad) * numpy.cos(latRad) * numpy.cos(haRad))
+        alt = numpy.degrees(numpy.arcsin(numpy.clip(sinAlt, -1., 1.)))
+        azNorth = numpy.degrees(
+            numpy.arctan2(-numpy.cos(decRad) * numpy.sin(haRad),
+                          numpy.sin(decRad) * numpy.cos(latRad) -
+                          numpy.cos(decRad) * numpy.sin(latRad) * numpy.cos(haRad)))
+        return ha, alt, (180. - azNorth) % 360.
+
+    @staticmethod
+    def airmass(alt):
+        """Return the plane-parallel airmass at alt (degrees); NaN below the horizon."""
+        alt = numpy.asarray(alt, dtype=float)
+        airmass = numpy.full(alt.shape, numpy.nan)
+        up = alt > 0
+        airmass[up] = 1. / numpy.sin(numpy.radians(alt[up]))
+        return airmass
+
+    def slew_time(self, fromAz, fromAlt, az, alt):
+        """Return the predicted times (seconds) to slew from fromAz, fromAlt to arrays az, alt."""
+        dAz = numpy.abs((numpy.asarray(az) - fromAz + 180.) % 360. - 180.)
+        dAlt = numpy.abs(numpy.asarray(alt) - fromAlt)
+        return numpy.maximum(dAz / self.azSpeed, dAlt / self.altSpeed) + self.settleTime
+
+    def plan(self, plates, cartridges, ra, dec, fromAz, fromAlt, now=None):
+        """Return the FieldPlan of the fields, slewing from fromAz, fromAlt (NaN if unknown)."""
+        now = now if now is not None else time.time()
+        ha, alt, az = self.altaz(ra, dec, now)
+        return FieldPlan(plates, cartridges, ha, alt, az, self.airmass(alt),
+                         self.slew_time(fromAz, fromAlt, az, alt), now,
+                         lst(self.longitude, now), self.minAlt)
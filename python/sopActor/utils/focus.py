@@ -0,0 +1,87 @@
+"""
+Remember the last BOSS Hartmann collimation, to skip redundant gotoField Hartmanns.
+"""
+
+import collections
+import time
+
+
+FocusResult = collections.namedtuple('FocusResult',
+                                     ['time', 'temperature', 'cartridge', 'residuals'])
+
+
+class FocusCache(object):
+    """
+    The result of the last Hartmann collimation and the conditions it was taken in.
+
+    A new gotoField Hartmann is not needed if the last collimation succeeded
+    at most maxAge seconds ago, and the temperature has changed by at most
+    maxTempChange degrees since (and, with perCartridge, the same cartridge
+    is loaded). A maxAge of 0 disables the cache: the Hartmann is always taken.
+    """
+
+    spectrographs = ('sp1', 'sp2')
+
+    def __init__(self,
+                 maxAge=0.,
+                 maxTempChange=1.,
+                 perCartridge=False,
+                 temperatureKey='apo.airTempPT'):
+        self.maxAge = maxAge
+        self.maxTempChange = maxTempChange
+        self.perCartridge = perCartridge
+        self.temperatureKey = temperatureKey
+        self.last = None
+
+    def temperature(self, models):
+        """Return the current temperature from temperatureKey (actor.keyword), or None."""
+        actor, key = self.temperatureKey.split('.', 1)
+        try:
+            return models[actor].keyVarDict[key][0]
+        except (KeyError, IndexError, AttributeError):
+            return None
+
+    def residuals(self, models):
+        """Return a dict of the Hartmann residuals status of each spectrograph."""
+        residuals = {}
+        for sp in self.spectrographs:
+            try:
+                residuals[sp] = models['hartmann'].keyVarDict['%sResiduals' % sp][2]
+            except (KeyError, IndexError, AttributeError):
+                continue
+        return residuals
+
+    def record(self, models, cartridge, now=None):
+        """Record the result of the Hartmann collimation that has just finished."""
+        self.last = FocusResult(now if now is not None else time.time(),
+                                self.temperature(models), cartridge, self.residuals(models))
+
+    def invalidate(self):
+        """Forget the last collimation, so that the next gotoField takes a Hartmann."""
+        self.last = None
+
+    def check(self, models, cartridge, now=None):
+        """Return (True if the last collimation still holds, the reason why or why not)."""
+        if self.maxAge <= 0:
+            return False, 'Hartmann cache disabled'
+        last = self.last
+        if last is None:
+            return False, 'no previous Hartmann'
+        if not last.residuals or any(r != 'OK' for r in last.residuals.values()):
+            return False, 'last Hartmann residuals were not OK'
+
+        now = now if now is not None else time.time()
+        age = (now - last.time) / 60.
+        if now - last.time > self.maxAge:
+            return False, 'last Hartmann was %.0f min ago' % age
+        if self.perCartridge and cartridge != last.cartridge:
+            return False, 'last Hartmann was with cartridge %s' % last.cartridge
+
+        temperature = self.temperature(models)
+        if temperature is None or last.temperature is None:
+            return False, 'temperature unknown'
+        change = abs(temperature - last.temperature)
+        if change > self.maxTempChange:
+            return False, 'temperature changed by %.1fC' % change
+        return True, 'last Hartmann was %.0f min ago, temperature changed by %.1fC' % (age,
+                                                                                       change)
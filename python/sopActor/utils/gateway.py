@@ -0,0 +1,162 @@
+"""
+Send all of sop's commands to other actors through one place.
+"""
+
+import threading
+import time
+
+from opscore.utility.qstr import qstr
+
+from sopActor.utils.retry import RetryPolicy
+
+
+class CommandGateway(object):
+    """
+    Wrap actor.cmdr's call() and bgCall(), to coordinate and measure the
+    commands that the sop threads send to other actors.
+
+    call() is the only blocking call, so it is there that:
+
+    * identical idempotent queries (the (actor, cmdStr) in coalesce, e.g.
+      tcc axis status) that are already in flight are not sent again: the
+      later callers wait for, and share, the reply to the first one;
+    * at most limits[actor] commands are in flight to actor at a time, the
+      others waiting their turn (no limit for an actor not in limits);
+    * a failed command is sent again if the retry policy says so (unless sop
+      is aborting), with a warning for each retry.
+
+    Both calls record the round-trip time of every command as the timing
+    cmdr.actor.verb (verb being the first word of cmdStr) in the metrics,
+    and count the failed, coalesced, limited (had to wait) and retried ones.
+    """
+
+    def __init__(self, actorState, coalesce=(), limits=None, retry=None):
+        self.actorState = actorState
+        self.retry = retry if retry is not None else RetryPolicy()
+        self.coalesce = set(coalesce)  # (actor, cmdStr) of the idempotent queries
+        self.limits = {}
+        self._semaphores = {}
+        self._lock = threading.Lock()
+        self._inFlight = {}  # (actor, cmdStr): [threading.Event, cmdVar] of a coalesced query
+        for actor, limit in (limits or {}).items():
+            self.set_limit(actor, limit)
+
+    @staticmethod
+    def parse_coalesce(text):
+        """Return the (actor, cmdStr) pairs of text, e.g. 'tcc axis status, mcp sem.show'."""
+        pairs = []
+        for query in text.split(','):
+            words = query.split(None, 1)
+            if len(words) == 2:
+                pairs.append((words[0], words[1].strip()))
+        return pairs
+
+    @staticmethod
+    def parse_limits(text):
+        """Return the concurrency limits of text, e.g. 'boss:1 guider:2', as a dict."""
+        limits = {}
+        for limit in text.split():
+            actor, n = limit.split(':')
+            limits[actor] = int(n)
+        return limits
+
+    def set_limit(self, actor, limit):
+        """Allow at most limit commands in flight to actor (None for no limit)."""
+        with self._lock:
+            if limit is None:
+                self.limits.pop(actor, None)
+                self._semaphores.pop(actor, None)
+            else:
+                self.limits[actor] = limit
+                self._semaphores[actor] = threading.BoundedSemaphore(limit)
+
+    @staticmethod
+    def metric(actor, cmdStr):
+        """Return the name of the timing of cmdStr sent to actor."""
+        words = (cmdStr or '').split()
+        return 'cmdr.%s.%s' % (actor, words[0] if words else '')
+
+    def _record(self, name, start, cmdVar):
+        """Record the round trip of a command started at start, and whether it failed."""
+        metrics = self.actorState.metrics
+        metrics.record(name, time.time() - start)
+        if cmdVar is None or cmdVar.didFail:
+            metrics.increment(name + '.failed')
+
+    def call(self, retry=True, **kwargs):
+        """
+        actor.cmdr.call(**kwargs), coalesced, limited and retried as configured
+        (never retried if not retry, e.g. when not waiting for the reply). Return the cmdVar.
+        """
+        key = (kwargs.get('actor'), kwargs.get('cmdStr'))
+        if key not in self.coalesce:
+            return self._call(kwargs, retry)
+
+        with self._lock:
+            inFlight = self._inFlight.get(key)
+            leader = inFlight is None
+            if leader:
+                inFlight = self._inFlight[key] = [threading.Event(), None]
+        if not leader:
+            self.actorState.metrics.increment(self.metric(*key) + '.coalesced')
+            inFlight[0].wait()
+            # If the first query raised, send this one on its own.
+            return inFlight[1] if inFlight[1] is not None else self._call(kwargs, retry)
+
+        try:
+            inFlight[1] = self._call(kwargs, retry)
+        finally:
+            with self._lock:
+                del self._inFlight[key]
+            inFlight[0].set()
+        return inFlight[1]
+
+    def _call(self, kwargs, retry=True):
+        """Send one command, retrying it as the retry policy says. Return the last cmdVar."""
+        actor, cmdStr = kwargs.get('actor'), kwargs.get('cmdStr')
+        rule = self.retry.lookup(actor, cmdStr) if retry else None
+        attempt = 0
+        while True:
+            cmdVar = self._send(kwargs)
+            if not cmdVar.didFail or rule is None or attempt >= rule.retries:
+                return cmdVar
+            if getattr(self.actorState, 'aborting', False):
+                return cmdVar
+            attempt += 1
+            delay = self.retry.delay(rule, attempt)
+            cmd = kwargs.get('forUserCmd') or self.actorState.actor.bcast
+            cmd.warn('text=%s' % qstr('%s %s failed: retrying (%d/%d) in %g s.' %
+                                      (actor, cmdStr, attempt, rule.retries, delay)))
+            self.actorState.metrics.increment(self.metric(actor, cmdStr) + '.retried')
+            time.sleep(delay)
+
+    def _send(self, kwargs):
+        """Send one command, waiting for a free slot if its actor is limited."""
+        actor = kwargs.get('actor')
+        name = self.metric(actor, kwargs.get('cmdStr'))
+        semaphore = self._semaphores.get(actor)
+        if semaphore is not None and not semaphore.acquire(False):
+            self.actorState.metrics.increment(name + '.limited')
+            semaphore.acquire()
+
+        start = time.time()
+        cmdVar = None
+        try:
+            cmdVar = self.actorState.actor.cmdr.call(**kwargs)
+        finally:
+            if semaphore is not None:
+                semaphore.release()
+            self._record(name, start, cmdVar)
+        return cmdVar
+
+    def bgCall(self, callFunc, **kwargs):
+        """actor.cmdr.bgCall(callFunc, **kwargs), recording the command's round trip."""
+        name = self.metric(kwargs.get('actor'), kwargs.get('cmdStr'))
+        start = time.time()
+
+        def recordCB(cmdVar):
+            if getattr(cmdVar, 'isDone', True):
+                self._record(name, start, cmdVar)
+            return callFunc(cmdVar)
+
+        return self.actorState.actor.cmdr.bgCall(callFunc=recordCB, **kwargs)
@@ -0,0 +1,84 @@
+"""
+Model the flux of a warming-up arc lamp, to start arcs before the lamp is fully warm.
+"""
+
+import math
+
+
+class LampFluxModel(object):
+    """
+    The relative flux of a lamp as a function of the time since it was turned on.
+
+    The flux rises exponentially towards its fully-warm value (1):
+        flux(t) = 1 - (1 - f0) * exp(-t / tau)
+
+    Arcs may start once the flux has reached minFlux; their exposure time is
+    then scaled so that they collect the same counts as a fully-warm arc.
+    """
+
+    def __init__(self, name, f0=0., tau=1., minFlux=1.):
+        self.name = name
+        self.f0 = f0
+        self.tau = tau
+        self.minFlux = minFlux
+
+    @classmethod
+    def fit(cls, name, samples, minFlux=1.):
+        """
+        Return the model fitted to a list of (time since turn-on, relative flux).
+
+        Fits a straight line to log(1 - flux) vs. time; samples with flux >= 1
+        carry no information on the warm-up and are ignored.
+        """
+        points = [(float(t), math.log(1. - f)) for t, f in samples if f < 1]
+        if len(points) < 2:
+            raise ValueError('Need at least two samples below full flux to fit a lamp model.')
+        n = len(points)
+        meanT = sum(t for t, y in points) / n
+        meanY = sum(y for t, y in points) / n
+        covariance = sum((t - meanT) * (y - meanY) for t, y in points)
+        variance = sum((t - meanT)**2 for t, y in points)
+        slope = covariance / variance
+        if slope >= 0:
+            raise ValueError('Lamp flux samples do not increase with time.')
+        intercept = meanY - slope * meanT
+        return cls(name, f0=max(1. - math.exp(intercept), 0.), tau=-1. / slope, minFlux=minFlux)
+
+    def flux(self, t):
+        """Return the relative flux t seconds after turn-on."""
+        return 1. - (1. - self.f0) * math.exp(-max(t, 0) / self.tau)
+
+    def ready_time(self):
+        """Return how long after turn-on the flux reaches minFlux."""
+        if self.minFlux <= self.f0:
+            return 0.
+        if self.minFlux >= 1:
+            return float('inf')
+        return self.tau * math.log((1. - self.f0) / (1. - self.minFlux))
+
+    def counts(self, start, expTime):
+        """Return the integrated relative flux of an exposure starting start seconds after turn-on."""
+        start = max(start, 0)
+        return expTime - (1. - self.f0) * self.tau * (math.exp(-start / self.tau) -
+                                                      math.exp(-(start + expTime) / self.tau))
+
+    def scaled_exposure(self, start, expTime, tolerance=0.01):
+        """
+        Return the exposure time starting start seconds after turn-on that
+        collects as many counts as expTime with a fully-warm lamp.
+        """
+        if expTime <= 0:
+            return expTime
+        low, high = expTime, expTime / self.flux(start)
+        while high - low > tolerance:
+            middle = (low + high) / 2.
+            if self.counts(start, middle) < expTime:
+                low = middle
+            else:
+                high = middle
+        return high
+
+    def genKeys(self, cmd):
+        """Output the model parameters."""
+        cmd.inform('lampFluxModel=%s,%0.3f,%0.1f,%0.2f,%0.1f' % (self.name, self.f0, self.tau,
+                                                                 self.minFlux, self.ready_time()))
@@ -0,0 +1,140 @@
+"""
+Track how warm each lamp is across sop commands, and when it will be ready.
+"""
+
+import collections
+import math
+import threading
+import time
+
+
+LampState = collections.namedtuple('LampState', ['isOn', 'since', 'warmth'])
+
+
+class LampStateTracker(object):
+    """
+    The on/off history of each lamp, kept across sop commands.
+
+    A lamp's warmth is the equivalent time it has been on: it grows while the
+    lamp is on, up to the lamp's warm-up time (a lamp is no warmer for having
+    been on longer), and decays exponentially (with time constant coolingTime)
+    once it is off, so a lamp turned back on shortly after it was turned off
+    does not start cold. A coolingTime of 0 makes a lamp cold as soon as it is off.
+
+    Only real transitions are recorded: the lamp keywords are output again
+    without a change of state, and their timestamps are not turn-on times.
+
+    Stages can hint that they will need a lamp at some time, to report when
+    the lamp will be ready compared with when it is needed.
+
+    The transitions come from the reactor thread and the queries from the
+    master thread, so all access is locked.
+    """
+
+    def __init__(self, coolingTime=0., warmupTimes=None):
+        self.coolingTime = coolingTime
+        # lamp: warm-up time, the most warmth the lamp can have (no limit if missing)
+        self.warmupTimes = warmupTimes if warmupTimes is not None else {}
+        self._lock = threading.Lock()
+        self.lamps = {}  # lamp: LampState
+        self.hints = {}  # lamp: time the lamp is needed
+
+    def _warmth(self, lamp, state, now):
+        """Return the warmth of lamp, in state, at time now (no lock)."""
+        elapsed = max(now - state.since, 0)
+        if state.isOn:
+            warmth = state.warmth + elapsed
+            warmupTime = self.warmupTimes.get(lamp)
+            return min(warmth, warmupTime) if warmupTime is not None else warmth
+        if self.coolingTime <= 0:
+            return 0.
+        return state.warmth * math.exp(-elapsed / self.coolingTime)
+
+    def update(self, lamp, isOn, when=None):
+        """Record that lamp is on (or off) as of when, if that is a change."""
+        when = when if when is not None else time.time()
+        with self._lock:
+            state = self.lamps.get(lamp)
+            if state is not None and state.isOn == bool(isOn):
+                return
+            warmth = self._warmth(lamp, state, when) if state is not None else 0.
+            self.lamps[lamp] = LampState(bool(isOn), when, warmth)
+            if isOn:
+                self.hints.pop(lamp, None)
+
+    def keyVarChanged(self, lamp, keyVar):
+        """keyVar callback: lamp is on if all its elements are on."""
+        values = list(keyVar)
+        if not values or None in values:
+            return
+        self.update(lamp, all(values), getattr(keyVar, 'timestamp', None))
+
+    def known(self, lamp):
+        """Return True if a state has been recorded for lamp."""
+        with self._lock:
+            return lamp in self.lamps
+
+    def is_on(self, lamp):
+        """Return True if lamp is on."""
+        with self._lock:
+            state = self.lamps.get(lamp)
+            return state is not None and state.isOn
+
+    def warmth(self, lamp, now=None):
+        """Return the equivalent time lamp has been on, as of now."""
+        now = now if now is not None else time.time()
+        with self._lock:
+            state = self.lamps.get(lamp)
+            return self._warmth(lamp, state, now) if state is not None else 0.
+
+    def warm_at(self, lamp, t, warmupTime):
+        """Return True if lamp will be warm at time t, if it stays in its current state."""
+        return self.warmth(lamp, t) >= warmupTime
+
+    def time_until_warm(self, lamp, warmupTime, now=None):
+        """Return how long until lamp is warm, if it is on (or turned on) now."""
+        return max(warmupTime - self.warmth(lamp, now), 0.)
+
+    def turn_on_time(self, lamp, neededAt, warmupTime, now=None, tolerance=0.1):
+        """
+        Return the latest time to turn lamp on so that it is warm at neededAt,
+        allowing for it cooling further until then, but not before now.
+        """
+        now = now if now is not None else time.time()
+        if self.is_on(lamp):
+            return now
+
+        def shortfall(turnOn):
+            return warmupTime - self.warmth(lamp, turnOn) - (neededAt - turnOn)
+
+        if shortfall(now) >= 0:
+            return now
+        if shortfall(neededAt) <= 0:
+            return neededAt
+        low, high = now, neededAt
+        while high - low > tolerance:
+            middle = (low + high) / 2.
+            if shortfall(middle) < 0:
+                low = middle
+            else:
+                high = middle
+        return low
+
+    def hint(self, lamp, neededAt):
+        """Note that lamp will be needed (warm) at time neededAt."""
+        with self._lock:
+            self.hints[lamp] = neededAt
+
+    def genKeys(self, cmd, warmupTimes, now=None):
+        """Output the state of each lamp, with how long until it is warm."""
+        now = now if now is not None else time.time()
+        with self._lock:
+            lamps = sorted(self.lamps.items(), key=lambda x: str(x[0]))
+            hints = dict(self.hints)
+        for lamp, state in lamps:
+            name = getattr(lamp, '__name__', str(lamp))
+            warmth = self.warmth(lamp, now)
+            readyIn = max(warmupTimes.get(lamp, 0) - warmth, 0) if state.isOn else -1
+            neededIn = hints[lamp] - now if lamp in hints else -1
+            cmd.inform('lampState=%s,%s,%0.1f,%0.1f,%0.1f' % (name, 'on' if state.isOn else 'off',
+                                                              warmth, readyIn, neededIn))
@@ -0,0 +1,177 @@
+"""
+Keep a persistent record of the sop commands, stages and messages in SQLite.
+"""
+
+import collections
+import json
+import os
+import Queue
+import sqlite3
+import threading
+
+from opscore.utility.qstr import qstr
+
+
+columns = ('kind', 'name', 'thread', 'start', 'end', 'success', 'cartridge', 'survey', 'params')
+
+Entry = collections.namedtuple('Entry', columns)
+
+
+class Ledger(object):
+    """
+    An append-only record of what sop did, that survives actor restarts.
+
+    Each entry is a top-level command ('command'), one of its stages
+    ('stage'), or a message sent to a thread ('msg'), with its start and end
+    times, the thread it ran in, whether it succeeded, the cartridge and
+    survey, and its parameters (e.g. exposure type and time) as JSON.
+
+    record() only queues the entry, so it never blocks the sop threads: a
+    background writer thread, which owns the only writing connection, inserts
+    the entries in batches. With no path, the ledger records nothing.
+    """
+
+    batchSize = 100  # maximum number of entries per insert
+    flushInterval = 2.  # seconds to wait for more entries before writing a batch
+
+    def __init__(self, path=None):
+        self.path = path
+        self.nErrors = 0  # entries that could not be written
+        self._queue = Queue.Queue()
+        self._writer = None
+
+    @property
+    def enabled(self):
+        return self.path is not None
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    def start(self):
+        """Create the database if needed, and start the writer thread."""
+        if not self.enabled or self._writer is not None:
+            return
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute('CREATE TABLE IF NOT EXISTS ledger '
+                             '(id INTEGER PRIMARY KEY, kind TEXT, name TEXT, thread TEXT, '
+                             'start REAL, end REAL, success INTEGER, cartridge INTEGER, '
+                             'survey TEXT, params TEXT)')
+                conn.execute('CREATE INDEX IF NOT EXISTS ledger_start ON ledger (start)')
+                conn.execute(
+                    'CREATE INDEX IF NOT EXISTS ledger_cartridge ON ledger (cartridge, start)')
+        finally:
+            conn.close()
+
+        self._writer = threading.Thread(target=self._write, name='ledgerWriter')
+        self._writer.daemon = True
+        self._writer.start()
+
+    def stop(self):
+        """Write the queued entries and stop the writer thread."""
+        if self._writer is None:
+            return
+        self._queue.put(None)
+        self._writer.join()
+        self._writer = None
+
+    def flush(self):
+        """Wait until all the queued entries have been written."""
+        if self._writer is not None:
+            self._queue.join()
+
+    def record(self, kind, name, start, end, success=None, thread=None, cartridge=None,
+               survey=None, params=None):
+        """Queue an entry to be written; params is a dict of its parameters."""
+        if not self.enabled:
+            return
+        if success is not None:
+            success = int(bool(success))
+        params = json.dumps(params, sort_keys=True, default=str) if params else None
+        self._queue.put((kind, name, thread, start, end, success, cartridge, survey, params))
+
+    def record_state(self, actorState, kind, name, start, end, success=None, thread=None,
+                     params=None):
+        """record(), with the cartridge and survey currently loaded according to actorState."""
+        survey = getattr(actorState, 'survey', None)
+        cartridge = getattr(actorState, 'cartridge', None)
+        self.record(kind, name, start, end, success, thread,
+                    cartridge=cartridge if cartridge is not None and cartridge >= 0 else None,
+                    survey=getattr(survey, '__name__', survey), params=params)
+
+    def _write(self):
+        """Writer thread: insert the queued entries in batches, until stopped."""
+        conn = self._connect()
+        running = True
+        while running:
+            try:
+                batch = [self._queue.get(timeout=self.flushInterval)]
+            except Queue.Empty:
+                continue
+            while len(batch) < self.batchSize:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except Queue.Empty:
+                    break
+
+            entries = [entry for entry in batch if entry is not None]
+            running = len(entries) == len(batch)
+            try:
+                with conn:
+                    conn.executemany(
+                        'INSERT INTO ledger (%s) VALUES (%s)' % (', '.join(columns), ', '.join(
+                            '?' * len(columns))), entries)
+            except sqlite3.Error:
+                self.nErrors += len(entries)
+            for entry in batch:
+                self._queue.task_done()
+        conn.close()
+
+    def recent(self, nEntries=20, cartridge=None, kind=None):
+        """Return the latest nEntries Entries, newest first, optionally of one cartridge or kind."""
+        if not self.enabled or not os.path.exists(self.path):
+            return []
+        where = []
+        args = []
+        if cartridge is not None:
+            where.append('cartridge = ?')
+            args.append(cartridge)
+        if kind is not None:
+            where.append('kind = ?')
+            args.append(kind)
+        query = 'SELECT %s FROM ledger' % ', '.join(columns)
+        if where:
+            query += ' WHERE ' + ' AND '.join(where)
+        query += ' ORDER BY start DESC, id DESC LIMIT ?'
+        args.append(nEntries)
+
+        conn = self._connect()
+        try:
+            return [Entry(*row) for row in conn.execute(query, args)]
+        finally:
+            conn.close()
+
+    def between(self, start, end):
+        """Return the Entries that overlap the time range start-end, oldest first."""
+        if not self.enabled or not os.path.exists(self.path):
+            return []
+        query = ('SELECT %s FROM ledger WHERE "end" >= ? AND start <= ? ORDER BY start, id' %
+                 ', '.join(columns))
+        conn = self._connect()
+        try:
+            return [Entry(*row) for row in conn.execute(query, (start, end))]
+        finally:
+            conn.close()
+
+    def genKeys(self, cmd, entries):
+        """Output entries, one sopHistory keyword each."""
+        for entry in entries:
+            cmd.inform('sopHistory=%s,%s,%s,%0.1f,%0.1f,%s,%s,%s,%s' % (
+                entry.kind, qstr(entry.name), qstr(entry.thread or ''), entry.start or 0,
+                entry.end or 0, 'NaN' if entry.success is None else entry.success,
+                'NaN' if entry.cartridge is None else entry.cartridge, qstr(entry.survey or ''),
+                qstr(entry.params or '')))
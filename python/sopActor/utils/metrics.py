@@ -0,0 +1,93 @@
+"""
+Accumulate timing and counter statistics from the sop threads.
+"""
+
+import bisect
+import collections
+import threading
+
+
+class Metrics(object):
+    """
+    Thread-safe store of named timing samples and counters.
+
+    Timings are kept as a bounded history of the most recent samples (in
+    seconds), so that averages reflect the current state of the hardware.
+    Counters simply accumulate until reset.
+    """
+
+    maxSamples = 500  # number of samples to keep for each timing
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Clear all timings and counters."""
+        with self._lock:
+            self.timings = {}
+            self.counters = {}
+
+    def record(self, name, value):
+        """Record a new timing sample for name."""
+        with self._lock:
+            if name not in self.timings:
+                self.timings[name] = collections.deque(maxlen=self.maxSamples)
+            self.timings[name].append(float(value))
+
+    def increment(self, name, n=1):
+        """Increment the counter name by n."""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def get(self, name):
+        """Return a list of the recorded samples for name."""
+        with self._lock:
+            return list(self.timings.get(name, []))
+
+    def count(self, name):
+        """Return the current value of counter name."""
+        with self._lock:
+            return self.counters.get(name, 0)
+
+    def last(self, name, default=None):
+        """Return the most recent sample for name, or default if there is none."""
+        with self._lock:
+            samples = self.timings.get(name)
+            return samples[-1] if samples else default
+
+    def mean(self, name, default=None):
+        """Return the mean of the samples for name, or default if there are none."""
+        samples = self.get(name)
+        if not samples:
+            return default
+        return sum(samples) / len(samples)
+
+    def summary(self, name):
+        """Return (n, mean, min, max) for the samples of name."""
+        samples = self.get(name)
+        if not samples:
+            return 0, 0., 0., 0.
+        return len(samples), sum(samples) / len(samples), min(samples), max(samples)
+
+    def histogram(self, name, edges):
+        """
+        Return the number of samples of name in each bin defined by edges.
+
+        The first bin counts the samples below edges[0] and the last one those
+        at or above edges[-1], so there are len(edges) + 1 bins.
+        """
+        counts = [0] * (len(edges) + 1)
+        for value in self.get(name):
+            counts[bisect.bisect_right(edges, value)] += 1
+        return counts
+
+    def genKeys(self, cmd):
+        """Output all timings and counters as keywords."""
+        with self._lock:
+            timingNames = sorted(self.timings)
+            counterNames = sorted(self.counters)
+        for name in timingNames:
+            cmd.inform('metric="%s",%d,%0.2f,%0.2f,%0.2f' % ((name, ) + self.summary(name)))
+        for name in counterNames:
+            cmd.inform('counter="%s",%d' % (name, self.count(name)))
@@ -0,0 +1,171 @@
+"""
+Predict when the observations of the loaded cartridge will be done.
+"""
+
+import collections
+import time
+
+import sopActor
+
+Step = collections.namedtuple('Step', ['command', 'stage', 'expected', 'remaining'])
+
+# The science sequence run on a cartridge of each survey.
+scienceCommands = {
+    sopActor.BOSS: 'doBossScience',
+    sopActor.BHM: 'doBossScience',
+    sopActor.APOGEE: 'doApogeeScience',
+    sopActor.MANGA: 'doMangaSequence',
+    sopActor.APOGEEMANGA: 'doApogeeMangaSequence',
+    sopActor.BHMMWM: 'doApogeeBossScience',
+}
+
+# Commands whose time is predicted stage by stage.
+stagedCommands = ('gotoField', )
+
+
+class ObservingPlan(object):
+    """
+    The expected timeline of the loaded cartridge: gotoField, the science
+    sequence of its survey (and surveyMode, through the command's etr), any
+    calibrations (the MaStar post-cals), then the other queued commands.
+
+    Each stage and command is expected to take its mean measured duration
+    (the stage.* and command.* metrics), or defaultTimes (in seconds) until
+    it has been measured; the science sequences use their own etr, and
+    doBossScience its number of exposures times the mean boss.exposure. A step
+    counts as done once it has finished since the cartridge was loaded, and
+    a running step as its expected time minus the time spent on it so far.
+
+    update() outputs the total as planEtr (minutes) and planEnd (the
+    predicted end, as a unix time); it is called whenever a stage, command
+    or exposure completes. With enabled False, nothing is output.
+    """
+
+    defaultTimes = {
+        'gotoField.slew': 180.,
+        'gotoField.hartmann': 150.,
+        'gotoField.calibs': 240.,
+        'gotoField.guider': 120.,
+        'gotoField.cleanup': 30.,
+        'doBossCalibs': 600.,
+        'boss.overhead': 60.,  # BOSS flush and readout, until boss.exposure is measured
+    }
+
+    def __init__(self, actorState, defaultTimes=None, enabled=False):
+        self.actorState = actorState
+        self.defaultTimes = dict(self.defaultTimes, **(defaultTimes or {}))
+        self.enabled = enabled
+        self.loadTime = 0.  # when the cartridge was loaded
+
+    @staticmethod
+    def parse_times(text):
+        """Return the default times of text, e.g. 'gotoField.slew:180 doBossCalibs:600'."""
+        times = {}
+        for item in text.split():
+            name, seconds = item.rsplit(':', 1)
+            times[name] = float(seconds)
+        return times
+
+    def cartridge_loaded(self, now=None):
+        """Start a new plan, for the cartridge that has just been loaded."""
+        self.loadTime = now if now is not None else time.time()
+        self.update()
+
+    def expected(self, name):
+        """Return the expected duration (seconds) of the stage or command name."""
+        metrics = self.actorState.metrics
+        prefix = 'stage.' if '.' in name else 'command.'
+        return metrics.mean(prefix + name, self.defaultTimes.get(name, 0.))
+
+    def commands(self):
+        """Return the names of the commands in the plan of the loaded cartridge, in order."""
+        actorState = self.actorState
+        names = ['gotoField']
+        science = scienceCommands.get(getattr(actorState, 'survey', None))
+        if science is not None:
+            names.append(science)
+        if getattr(actorState, 'surveyMode', None) is sopActor.MASTAR:
+            names.append('doBossCalibs')
+        commandQueue = getattr(actorState, 'commandQueue', None)
+        for cmdStr in (list(commandQueue.commands) if commandQueue is not None else []):
+            name = cmdStr.split()[0]
+            if name not in names:
+                names.append(name)
+        return names
+
+    def _done(self, cmdState):
+        """Has cmdState finished since the cartridge was loaded?"""
+        return cmdState.cmdState == 'done' and getattr(cmdState, 'endTime', 0) >= self.loadTime
+
+    def _full(self, name, cmdState):
+        """Return the expected time of the whole of command name, when it is not running."""
+        if 'etr' in cmdState.keywords:
+            return cmdState.keywords['etr'] * 60.
+        if name == 'doBossScience':
+            return max(cmdState.nExp, 1) * self.exposure_time(cmdState)
+        return self.expected(name)
+
+    def exposure_time(self, cmdState):
+        """Return the expected time (seconds) of one BOSS exposure of cmdState, read out."""
+        default = cmdState.expTime + self.defaultTimes['boss.overhead']
+        return self.actorState.metrics.mean('boss.exposure', default)
+
+    def steps(self, now=None):
+        """Return the Steps of the plan, with their expected and remaining seconds."""
+        now = now if now is not None else time.time()
+        steps = []
+        for name in self.commands():
+            cmdState = getattr(self.actorState, name, None)
+            if cmdState is None:
+                continue
+            done = self._done(cmdState)
+            running = cmdState.cmdState == 'running'
+            if name in stagedCommands:
+                for stage in cmdState.allStages:
+                    expected = self.expected('%s.%s' % (name, stage))
+                    state = cmdState.stages[stage]
+                    if done or state in ('done', 'off'):
+                        remaining = 0.
+                    elif state == 'running':
+                        started = cmdState.stageStartTimes.get(stage, now)
+                        remaining = max(expected - (now - started), 0.)
+                    else:
+                        remaining = expected
+                    steps.append(Step(name, stage, expected, remaining))
+                continue
+
+            expected = self._full(name, cmdState)
+            if done:
+                remaining = 0.
+            elif running and hasattr(cmdState, 'etr'):
+                remaining = cmdState.etr * 60.
+            elif running and name == 'doBossScience':
+                remaining = max(cmdState.nExp - cmdState.index, 0) * self.exposure_time(cmdState)
+            elif running:
+                remaining = max(expected - (now - cmdState.startTime), 0.)
+            else:
+                remaining = expected
+            steps.append(Step(name, '', expected, remaining))
+        return steps
+
+    def etr(self, now=None):
+        """Return the time (seconds) remaining until the plan is done."""
+        return sum(step.remaining for step in self.steps(now))
+
+    def update(self, cmd=None, now=None):
+        """Output the plan's etr and end, if enabled."""
+        if not self.enabled or getattr(self.actorState, 'survey', None) is None:
+            return
+        now = now if now is not None else time.time()
+        etr = self.etr(now)
+        cmd = cmd if cmd is not None else self.actorState.actor.bcast
+        cmd.inform('planEtr=%0.1f; planEnd=%0.1f' % (etr / 60., now + etr))
+
+    def genKeys(self, cmd, now=None):
+        """Output each step of the plan, then the plan's etr and end."""
+        if not self.enabled:
+            return
+        for step in self.steps(now):
+            cmd.inform('planStep=%s,%s,%0.1f,%0.1f' % (step.command, step.stage or 'NaN',
+                                                       step.expected, step.remaining))
+        self.update(cmd, now)
@@ -0,0 +1,51 @@
+"""
+Decide which failed commands to other actors are worth sending again.
+"""
+
+import collections
+import fnmatch
+
+Rule = collections.namedtuple('Rule', ['actor', 'pattern', 'retries', 'backoff'])
+
+
+class RetryPolicy(object):
+    """
+    Per actor and command rules for retrying commands that failed, e.g. on a
+    transient timeout.
+
+    Each rule applies to the commands sent to actor whose cmdStr matches the
+    shell-style pattern (e.g. ``ff.*``). A failed command is sent again up
+    to retries times, waiting backoff seconds before the first retry and
+    twice as long before each following one. The first matching rule is
+    used, so a specific rule (e.g. never retry boss exposures) goes before a
+    general one; commands that match no rule are never retried.
+    """
+
+    def __init__(self, rules=()):
+        self.rules = list(rules)
+
+    @classmethod
+    def from_items(cls, items):
+        """
+        Return the policy of config items (option, value) such as
+        ('mcp ff.*', '2 2'): 'actor pattern' = 'retries [backoff]'.
+        """
+        rules = []
+        for option, value in items:
+            actor, pattern = option.split(None, 1)
+            values = value.split()
+            backoff = float(values[1]) if len(values) > 1 else 0.
+            rules.append(Rule(actor, pattern.strip(), int(values[0]), backoff))
+        return cls(rules)
+
+    def lookup(self, actor, cmdStr):
+        """Return the Rule for cmdStr sent to actor, or None if it is never retried."""
+        for rule in self.rules:
+            if rule.actor == actor and fnmatch.fnmatchcase(cmdStr or '', rule.pattern):
+                return rule if rule.retries > 0 else None
+        return None
+
+    @staticmethod
+    def delay(rule, attempt):
+        """Return how long to wait before retry number attempt (1, 2, ...) under rule."""
+        return rule.backoff * 2**(attempt - 1)
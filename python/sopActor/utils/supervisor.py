@@ -0,0 +1,161 @@
+"""
+Restart or reload single sop threads, keeping their queues and handler state.
+"""
+
+import sys
+import threading
+import types
+
+from sopActor import Msg
+
+
+class ThreadSupervisor(object):
+    """
+    Restart (and optionally reload the code of) individual threads of the
+    actor's threadList, by thread name (e.g. tcc) or module (e.g. lampThreads,
+    which restarts all the lamp threads).
+
+    The thread's queue is kept, so messages waiting in it are handled by the
+    new thread. Handlers registered with adopt() hand their handoverAttrs over
+    to the handler the new thread creates.
+
+    A thread that is handling a message (its queue's current message), or
+    whose handler's busy property is True (e.g. an exposure is running),
+    is not restarted. Other threads are not touched, so a restart does not
+    interrupt an exposure elsewhere.
+    """
+
+    joinTimeout = 5.  # seconds to wait for an old thread to exit
+
+    def __init__(self, actorState):
+        self.actorState = actorState
+        self.handlers = {}  # thread name: handler object
+        self._lock = threading.Lock()
+
+    def adopt(self, threadName, handler):
+        """
+        Register handler as the state of thread threadName, and return it,
+        after taking over the handoverAttrs of the handler it replaces.
+        """
+        with self._lock:
+            old = self.handlers.get(threadName)
+            if old is not None:
+                for attr in getattr(handler, 'handoverAttrs', ()):
+                    if hasattr(old, attr):
+                        setattr(handler, attr, getattr(old, attr))
+            self.handlers[threadName] = handler
+        return handler
+
+    @staticmethod
+    def _module_name(target):
+        """Return the (short) name of the module that holds thread target."""
+        name = target.__name__ if isinstance(target, types.ModuleType) else target.__module__
+        return name.split('.')[-1]
+
+    def find(self, name):
+        """Return the threadList indexes of a thread or module name."""
+        threadList = getattr(self.actorState.actor, 'threadList', [])
+        return [i for i, (tname, tid, target) in enumerate(threadList)
+                if name in (tname, self._module_name(target))]
+
+    def busy(self, tname, tid):
+        """Return why thread tname is busy, or None if it can be restarted."""
+        queue = self.actorState.queues.get(tid)
+        msg = getattr(queue, 'handling', None)
+        if msg is not None and msg.type != Msg.EXIT:
+            return '%s thread is handling %s' % (tname, msg.type.__name__)
+        handler = self.handlers.get(tname)
+        if handler is not None and getattr(handler, 'busy', False):
+            return '%s thread is busy' % tname
+        return None
+
+    @staticmethod
+    def _reload(target, reloaded):
+        """Reload the module of target (once, using reloaded), and return the new target."""
+        isModule = isinstance(target, types.ModuleType)
+        moduleName = target.__name__ if isModule else target.__module__
+        if moduleName not in reloaded:
+            reloaded[moduleName] = reload(sys.modules[moduleName])
+        module = reloaded[moduleName]
+        return module if isModule else getattr(module, target.__name__)
+
+    def restart(self, cmd, name, reloadCode=False):
+        """
+        Restart the threads of name (a thread or module name), reloading
+        their module first if reloadCode. Return None if done, else why not.
+        """
+        threadList = self.actorState.actor.threadList
+        indexes = self.find(name)
+        if not indexes:
+            return 'No thread or thread module named %s.' % name
+        for i in indexes:
+            tname, tid, target = threadList[i]
+            reason = self.busy(tname, tid)
+            if reason is not None:
+                return 'Not restarting %s: %s.' % (name, reason)
+
+        # Reload before stopping anything, so that broken code leaves the threads running.
+        targets = dict((i, threadList[i][2]) for i in indexes)
+        if reloadCode:
+            reloaded = {}
+            try:
+                for i in indexes:
+                    targets[i] = self._reload(targets[i], reloaded)
+            except Exception as e:
+                return 'Failed to reload %s: %s' % (name, e)
+
+        for i in indexes:
+            tname, tid, target = threadList[i][0], threadList[i][1], targets[i]
+            main = target.main if isinstance(target, types.ModuleType) else target
+            threadList[i] = (tname, tid, target)
+            old = self.actorState.threads.get(tid)
+            if old is not None and old.is_alive():
+                self.actorState.queues[tid].put(Msg.EXIT, cmd, priority=Msg.CRITICAL)
+                old.join(self.joinTimeout)
+            if old is not None and old.is_alive():
+                # It took a message just before the EXIT: replace it once that is done.
+                waiter = threading.Thread(
+                    target=self._start_after, args=(old, tname, tid, main), name='supervisor')
+                waiter.daemon = True
+                waiter.start()
+                cmd.warn('text="%s thread is finishing a message: it will be restarted then."' %
+                         tname)
+                continue
+            self._start(tname, tid, main)
+            cmd.inform('text="%s %s thread"' % ('Reloaded' if reloadCode else 'Restarted', tname))
+        return None
+
+    def replace(self, cmd, tname, tid):
+        """
+        Replace thread tname, which has died or is hung, without waiting for it.
+
+        The message it was handling is failed, and a new thread is started on
+        its queue. A hung thread is retired: it exits as soon as it asks its
+        queue for another message, so it never takes one from the new thread.
+        """
+        queue = self.actorState.queues[tid]
+        old = self.actorState.threads.get(tid)
+        msg = queue.handling
+        if old is not None and old.is_alive():
+            queue.retire(old)
+        queue.handling = None
+        if msg is not None and msg.type != Msg.EXIT and getattr(msg, 'replyQueue', None):
+            msg.replyQueue.put(Msg.REPLY, msg.cmd, success=False)
+
+        target = [t for name, i, t in self.actorState.actor.threadList if name == tname][0]
+        self._start(tname, tid, target.main if isinstance(target, types.ModuleType) else target)
+        cmd.warn('text="Replaced %s thread%s"' %
+                 (tname, ', failing its %s' % msg.type.__name__ if msg is not None else ''))
+
+    def _start(self, tname, tid, main):
+        """Start a new thread tname, running main on the existing queues."""
+        thread = threading.Thread(
+            target=main, name=tname, args=[self.actorState.actor, self.actorState.queues])
+        thread.daemon = True
+        self.actorState.threads[tid] = thread
+        thread.start()
+
+    def _start_after(self, old, tname, tid, main):
+        """Wait for thread old to exit, then start its replacement."""
+        old.join()
+        self._start(tname, tid, main)
@@ -0,0 +1,133 @@
+"""
+Detect sop threads that have died or are stuck on a message, and recover them.
+"""
+
+import threading
+import time
+
+from sopActor import Msg
+
+
+class Watchdog(object):
+    """
+    Check the sop threads every interval seconds, using their queues' heartbeats.
+
+    A thread has died if it is no longer alive, and is hung if it has been
+    handling a message for longer than factor times the message's expected
+    duration plus grace seconds. The expected duration is the message's
+    duration (e.g. an exposure's), or the total exposure time of an APOGEE
+    dither set; the grace covers the messages that have no expected duration.
+
+    Each dead or hung thread is reported once with a threadHung keyword. If
+    recover is set, the message it was handling is failed (so that the
+    command waiting for it fails at once, rather than at its timeout) and the
+    thread is replaced by the supervisor. Threads in exempt (e.g. master,
+    which handles a whole command at a time) are only checked for dying.
+    """
+
+    interval = 10.  # seconds between checks
+
+    def __init__(self, actorState, factor=2., grace=300., recover=False,
+                 exempt=('master', 'script', 'apogeeScript')):
+        self.actorState = actorState
+        self.factor = factor
+        self.grace = grace
+        self.recover = recover
+        self.exempt = set(exempt)
+        self.alerted = {}  # thread name: the message (or None if it died) it was reported for
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def expected_duration(msg):
+        """Return how long msg is expected to take, in seconds."""
+        expTime = getattr(msg, 'expTime', 0) or 0
+        nDithers = len(getattr(msg, 'dithers', '') or '') or 1
+        return max(getattr(msg, 'duration', 0) or 0, expTime * nDithers, 0)
+
+    def limit(self, msg):
+        """Return how long msg may be handled before its thread is considered hung."""
+        return self.factor * self.expected_duration(msg) + self.grace
+
+    def status(self, tname, tid, now=None):
+        """Return (state, msg, elapsed) of thread tname: state is idle, busy, hung or dead."""
+        now = now if now is not None else time.time()
+        queue = self.actorState.queues.get(tid)
+        thread = self.actorState.threads.get(tid)
+        msg = getattr(queue, 'handling', None)
+        if msg is not None and msg.type == Msg.EXIT:
+            msg = None
+        elapsed = now - queue.handlingSince if msg is not None else 0.
+        if thread is not None and not thread.is_alive():
+            return 'dead', msg, elapsed
+        if msg is None:
+            return 'idle', None, 0.
+        if tname not in self.exempt and elapsed > self.limit(msg):
+            return 'hung', msg, elapsed
+        return 'busy', msg, elapsed
+
+    def check(self, now=None):
+        """
+        Report (and recover, if enabled) the threads that have died or hung since
+        the last check. Return the names of the threads that were reported.
+        """
+        reported = []
+        threadList = getattr(self.actorState.actor, 'threadList', [])
+        for tname, tid, target in threadList:
+            if tid not in self.actorState.queues or tid not in self.actorState.threads:
+                continue
+            state, msg, elapsed = self.status(tname, tid, now)
+            if state not in ('dead', 'hung'):
+                self.alerted.pop(tname, None)
+                continue
+            if tname in self.alerted and self.alerted[tname] is msg:
+                continue
+            self.alerted[tname] = msg
+
+            bcast = self.actorState.actor.bcast
+            bcast.warn('threadHung=%s,%s,%s,%0.1f,%0.1f' %
+                       (tname, state, msg.type.__name__ if msg is not None else 'None',
+                        elapsed, self.limit(msg) if msg is not None else 0))
+            self.actorState.metrics.increment('watchdog.%s.%s' % (tname, state))
+            if self.recover:
+                self.actorState.supervisor.replace(bcast, tname, tid)
+            reported.append(tname)
+        return reported
+
+    def _run(self):
+        """Watchdog thread: check the threads every interval, until stopped."""
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                self.actorState.actor.bcast.warn('text="Watchdog check failed: %s"' % e)
+
+    def start(self):
+        """Start checking the threads in the background."""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='watchdog')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop checking the threads."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def genKeys(self, cmd, now=None):
+        """Output the state of each thread, with the message it is handling and for how long."""
+        now = now if now is not None else time.time()
+        threadList = getattr(self.actorState.actor, 'threadList', [])
+        for tname, tid, target in threadList:
+            if tid not in self.actorState.queues:
+                continue
+            state, msg, elapsed = self.status(tname, tid, now)
+            heartbeat = self.actorState.queues[tid].heartbeat
+            cmd.inform('threadState=%s,%s,%s,%0.1f,%0.1f' %
+                       (tname, state, msg.type.__name__ if msg is not None else 'None', elapsed,
+                        now - heartbeat if heartbeat is not None else -1))
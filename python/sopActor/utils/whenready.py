@@ -0,0 +1,85 @@
+"""
+Hold a slew command until slewing is allowed, then start it.
+"""
+
+import time
+
+from opscore.utility.qstr import qstr
+from twisted.internet import reactor
+
+
+class SlewWhenReady(object):
+    """
+    Keep one slew command armed until isSlewingDisabled clears.
+
+    Instead of polling, the slew conditions are re-checked whenever the BOSS
+    or APOGEE exposureState changes, or a sop command changes state. As soon
+    as nothing disables slews, the armed command is started by calling the
+    function it was armed with.
+    """
+
+    def __init__(self, actorState, isSlewingDisabled):
+        """isSlewingDisabled(cmd) returns why slewing is disabled, or False."""
+        self.actorState = actorState
+        self.isSlewingDisabled = isSlewingDisabled
+        self._reset()
+
+    def _reset(self):
+        self.cmd = None
+        self.name = None
+        self.fire = None
+        self.armedTime = None
+
+    @property
+    def armed(self):
+        return self.cmd is not None
+
+    def _keyVars(self):
+        keyVars = []
+        for actor in ('boss', 'apogee'):
+            try:
+                keyVars.append(self.actorState.models[actor].keyVarDict['exposureState'])
+            except (AttributeError, KeyError):
+                pass
+        return keyVars
+
+    def arm(self, cmd, name, blocked, fire):
+        """Arm command name (on cmd), to call fire() once slewing is allowed."""
+        if self.armed:
+            self.disarm(text='superseded by %s' % name)
+        self.cmd = cmd
+        self.name = name
+        self.fire = fire
+        self.armedTime = time.time()
+        for keyVar in self._keyVars():
+            keyVar.addCallback(self.check, callNow=False)
+        cmd.inform('slewWhenReady=%s,%s' % (qstr(name), qstr(blocked)))
+
+    def disarm(self, name=None, text='disarmed'):
+        """Fail the armed command (if it is name), returning True if there was one."""
+        if not self.armed or (name is not None and name != self.name):
+            return False
+        cmd, armedName = self.cmd, self.name
+        self._disconnect()
+        cmd.fail('text=%s' % qstr('%s %s' % (armedName, text)))
+        return True
+
+    def _disconnect(self):
+        for keyVar in self._keyVars():
+            keyVar.removeCallback(self.check, doRaise=False)
+        self._reset()
+
+    def check(self, *args):
+        """Start the armed command if slewing is now allowed."""
+        if not self.armed or self.isSlewingDisabled(self.cmd):
+            return
+        cmd, name, fire = self.cmd, self.name, self.fire
+        self.actorState.metrics.record('slewWhenReady.wait', time.time() - self.armedTime)
+        self._disconnect()
+        cmd.inform('text="Slewing is allowed: starting %s"' % name)
+        fire()
+
+    def state_changed(self):
+        """A sop command changed state (from any thread): re-check in the reactor thread."""
+        if self.armed:
+            reactor.callFromThread(self.check)
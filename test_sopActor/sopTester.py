@@ -12,8 +12,21 @@ import sopActor.myGlobals as myGlobals
 from actorcore import TestHelper
 from sopActor.bypass import Bypass
 from sopActor.Commands import SopCmd
+from sopActor.utils.calibrations import CalibrationRegistry
+from sopActor.utils.cartload import CartLoadPrep
+from sopActor.utils.checkpoint import CheckpointStore
+from sopActor.utils.cmdqueue import CommandQueue
+from sopActor.utils.fieldplan import FieldPlanner
+from sopActor.utils.focus import FocusCache
+from sopActor.utils.gateway import CommandGateway
 from sopActor.utils.gang import ApogeeGang
 from sopActor.utils.guider import GuiderState
+from sopActor.utils.lampstate import LampStateTracker
+from sopActor.utils.ledger import Ledger
+from sopActor.utils.metrics import Metrics
+from sopActor.utils.nightplan import ObservingPlan
+from sopActor.utils.supervisor import ThreadSupervisor
+from sopActor.utils.watchdog import Watchdog
 
 
 class TEST_QUEUE():
@@ -65,11 +78,26 @@ class SopTester(TestHelper.ActorTester):
         actorState = myGlobals.actorState
         actorState.guiderState = GuiderState(actorState.models['guider'])
         actorState.apogeeGang = ApogeeGang()
+        actorState.metrics = Metrics()
+        actorState.gateway = CommandGateway(actorState)
+        actorState.commandQueue = CommandQueue(actorState)
+        actorState.focusCache = FocusCache()
+        actorState.calibrations = CalibrationRegistry()
+        actorState.lampFlux = {}
+        actorState.lampState = LampStateTracker()
+        actorState.ledger = Ledger()
+        actorState.checkpoints = CheckpointStore()
+        actorState.supervisor = ThreadSupervisor(actorState)
+        actorState.fieldPlanner = FieldPlanner()
+        actorState.plan = ObservingPlan(actorState)
+        actorState.cartLoad = CartLoadPrep(actorState)
+        actorState.watchdog = Watchdog(actorState)
         actorState.threads = {}  # so things that look for threads here don't fail.
 
         actorState.timeout = 10
         actorState.aborting = False
         self._load_lamptimes()
+        actorState.lampState.warmupTimes = myGlobals.warmupTime
         # so we can set bypasses!
         myGlobals.bypass = Bypass()
         self._clear_bypasses()
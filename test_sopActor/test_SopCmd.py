@@ -7,7 +7,11 @@ queue with an appropriately crafted CmdState and other relevant parameters.
 If these tests work correctly, each masterThread function should work
 correctly when called via a SopCmd (assuming test_masterThread clears).
 """
+import os
+import shutil
+import tempfile
 import threading
+import time
 import unittest
 
 import sopActor
@@ -15,6 +19,10 @@ import sopActor.myGlobals as myGlobals
 import sopTester
 from actorcore import TestHelper
 from sopActor import CmdState, Queue
+from sopActor.utils.calibrations import CalibrationRegistry
+from sopActor.utils.cartload import Prepared
+from sopActor.utils.checkpoint import CheckpointStore
+from sopActor.utils.ledger import Ledger
 
 
 def build_active_stages(allStages, activeStages):
@@ -199,6 +207,148 @@ class TestStopCmd(SopCmdTester, unittest.TestCase):
         self._check_cmd(0, 0, 0, 0, True, True)
 
 
+class TestHistory(SopCmdTester, unittest.TestCase):
+
+    def setUp(self):
+        super(TestHistory, self).setUp()
+        self.tempdir = tempfile.mkdtemp()
+        self.ledger = Ledger(os.path.join(self.tempdir, 'ledger.sqlite'))
+        self.ledger.start()
+        self.ledger.record('command', 'gotoField', 100, 200, True, 'master', cartridge=11)
+        self.ledger.record('stage', 'gotoField.slew', 100, 150, True, 'master', cartridge=11)
+        self.ledger.record('command', 'doBossCalibs', 300, 400, False, 'master', cartridge=12)
+        self.ledger.flush()
+        self.actorState.ledger = self.ledger
+
+    def tearDown(self):
+        self.ledger.stop()
+        shutil.rmtree(self.tempdir)
+        super(TestHistory, self).tearDown()
+
+    def test_history(self):
+        self._run_cmd('history', None)
+        self._check_cmd(0, 3, 0, 0, True)
+
+    def test_history_nEntries(self):
+        self._run_cmd('history nEntries=1', None)
+        self._check_cmd(0, 1, 0, 0, True)
+
+    def test_history_cartridge(self):
+        self._run_cmd('history cartridge=11 kind=command', None)
+        self._check_cmd(0, 1, 0, 0, True)
+
+    def test_history_disabled(self):
+        self.actorState.ledger = Ledger()
+        self._run_cmd('history', None)
+        self._check_cmd(0, 0, 0, 0, True, True)
+
+    def test_efficiency(self):
+        # entries at 100-400s are on SDSS MJD 40587: one line per category, plus one stage.
+        self._run_cmd('efficiency mjd=40587', None)
+        self._check_cmd(0, 10, 0, 0, True)
+
+    def test_efficiency_empty_night(self):
+        self._run_cmd('efficiency', None)
+        self._check_cmd(0, 9, 0, 0, True)
+
+    def test_efficiency_disabled(self):
+        self.actorState.ledger = Ledger()
+        self._run_cmd('efficiency', None)
+        self._check_cmd(0, 0, 0, 0, True, True)
+
+
+class TestPlanFields(SopCmdTester, unittest.TestCase):
+
+    def setUp(self):
+        super(TestPlanFields, self).setUp()
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, 'fields.txt')
+        with open(self.path, 'w') as f:
+            f.write('8000 120.5 30.25 11\n8001 200 -5\n8002 10 60\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+        super(TestPlanFields, self).tearDown()
+
+    def test_planFields(self):
+        self._run_cmd('planFields fieldFile=%s' % self.path, None)
+        self._check_cmd(0, 4, 0, 0, True)
+
+    def test_planFields_default(self):
+        self.actorState.fieldPlanner.fieldFile = self.path
+        self._run_cmd('planFields', None)
+        self._check_cmd(0, 4, 0, 0, True)
+
+    def test_planFields_no_file(self):
+        self._run_cmd('planFields', None)
+        self._check_cmd(0, 0, 0, 0, True, True)
+
+    def test_planFields_bad_file(self):
+        self._run_cmd('planFields fieldFile=%s' % os.path.join(self.tempdir, 'nope'), None)
+        self._check_cmd(0, 0, 0, 0, True, True)
+
+
+class TestRestart(SopCmdTester, unittest.TestCase):
+
+    def test_restart_unknown_thread(self):
+        self._run_cmd('restart threads=nonsense', None)
+        self._check_cmd(0, 0, 0, 0, True, True)
+
+
+class TestQueue(SopCmdTester, unittest.TestCase):
+
+    def setUp(self):
+        super(TestQueue, self).setUp()
+        self.commandQueue = self.actorState.commandQueue
+
+    def test_queue_empty(self):
+        self._run_cmd('queue', None)
+        self._check_cmd(0, 1, 0, 0, True)
+
+    def test_queue_add(self):
+        self._run_cmd('queue command="doApogeeMangaSequence count=2"', None)
+        self.assertEqual(self.commandQueue.commands, ['doApogeeMangaSequence count=2'])
+        self._check_cmd(0, 1, 0, 0, True)
+
+    def test_queue_insert(self):
+        self.commandQueue.add('doBossScience')
+        self._run_cmd('queue command="gotoField noSlew" position=1', None)
+        self.assertEqual(self.commandQueue.commands, ['gotoField noSlew', 'doBossScience'])
+        self._check_cmd(0, 1, 0, 0, True)
+
+    def test_queue_insert_bad_position(self):
+        self._run_cmd('queue command="doBossScience" position=3', None)
+        self.assertEqual(self.commandQueue.commands, [])
+        self._check_cmd(0, 0, 0, 0, True, True)
+
+    def test_queue_remove(self):
+        self.commandQueue.add('gotoField')
+        self.commandQueue.add('doBossScience')
+        self._run_cmd('queue remove=1', None)
+        self.assertEqual(self.commandQueue.commands, ['doBossScience'])
+        self._check_cmd(0, 2, 0, 0, True)
+
+    def test_queue_clear(self):
+        self.commandQueue.add('gotoField')
+        self._run_cmd('queue clear', None)
+        self.assertEqual(self.commandQueue.commands, [])
+        self._check_cmd(0, 1, 0, 0, True)
+
+    def test_queue_not_queueable(self):
+        self._run_cmd('queue command="bypass subSystem=ffs"', None)
+        self.assertEqual(self.commandQueue.commands, [])
+        self._check_cmd(0, 0, 0, 0, True, True)
+
+    def test_check_queueable(self):
+        self.assertEqual(self.sopCmd.check_queueable('doMangaSequence count=3 dithers=NSE'), '')
+        self.assertEqual(self.sopCmd.check_queueable('gotoField noSlew noHartmann'), '')
+        self.assertNotEqual(self.sopCmd.check_queueable(''), '')
+        self.assertNotEqual(self.sopCmd.check_queueable('doMangaSequence abort'), '')
+        self.assertNotEqual(self.sopCmd.check_queueable('doMangaSequence foo=3'), '')
+        self.assertNotEqual(self.sopCmd.check_queueable('doMangaSequence count='), '')
+        self.assertNotEqual(self.sopCmd.check_queueable('gotoField slew'), '')
+
+
 class TestClassifyCartridge(SopCmdTester, unittest.TestCase):
 
     def _classifyCartridge(self, nCart, plateType, surveyMode, expect):
@@ -626,10 +776,10 @@ class TestStatus(SopCmdTester, unittest.TestCase):
         self._check_cmd(0, nInfo, 0, 0, True)
 
     def test_status(self):
-        self._status(64)
+        self._status(68)
 
     def test_status_geek(self):
-        self._status(66, args='geek')
+        self._status(70, args='geek')
 
     def test_status_noFinish(self):
         self.sopCmd.status(self.cmd, finish=False)
@@ -817,6 +967,26 @@ class TestDoMangaSequence(SopCmdTester, unittest.TestCase):
         self._run_cmd('doMangaSequence abort', None)
         self.assertTrue(self.actorState.aborting)
 
+    def _save_checkpoint(self, cartridge):
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        self.actorState.checkpoints = CheckpointStore(tempdir)
+        self.actorState.cartridge = 11
+        self.actorState.checkpoints.save(
+            'doMangaSequence', cartridge, {'expTime': 900., 'dithers': 'NSE', 'count': 1,
+                                           'etr': 144.}, {'index': 1, 'ditherSeq': 'NSE'})
+
+    def test_doMangaSequence_resume(self):
+        self._save_checkpoint(11)
+        expect = {'expTime': 900, 'ditherSeq': 'NSE'}
+        self._doMangaSequence(expect, 'resume', cmd_levels=(0, 3, 0, 0))
+        self.assertEqual(self.actorState.doMangaSequence.index, 1)
+
+    def test_doMangaSequence_resume_other_cartridge(self):
+        self._save_checkpoint(12)
+        self._run_cmd('doMangaSequence resume', None)
+        self._check_cmd(0, 2, 0, 0, True, True)
+
     def _doMangaSequence_modify(self, args1, args2, cmd_levels=(0, 12, 0, 0), didFail=False):
         queue = myGlobals.actorState.queues[sopActor.MASTER]
         # create something we can modify.
@@ -1108,6 +1278,23 @@ class TestGotoField(SopCmdTester, unittest.TestCase):
         expect = {'ra': 30, 'dec': 40}
         self._gotoField(2, 'MaNGA', expect, stages, '')
 
+    def test_gotoField_boss_prepared(self):
+        """gotoField slews to the target, with the stages, prepared on the cartridge load."""
+        self._update_cart(11, 'BOSS')
+        cartLoad = self.actorState.cartLoad
+        field = CalibrationRegistry.field(self.actorState.models)
+        cartLoad.prepared = Prepared(11, field, 15., 25., 60., 120., 90.,
+                                     ['slew', 'guider', 'cleanup'], 'doBossScience', time.time())
+        queue = myGlobals.actorState.queues[sopActor.MASTER]
+        msg = self._run_cmd('gotoField', queue)
+        allStages = ['slew', 'hartmann', 'calibs', 'guider', 'cleanup']
+        self.assertEqual(msg.cmdState.stages,
+                         build_active_stages(allStages, ['slew', 'guider', 'cleanup']))
+        self.assertEqual((msg.cmdState.ra, msg.cmdState.dec), (15., 25.))
+        self.assertFalse(msg.cmdState.doHartmann)
+        self.assertFalse(msg.cmdState.doCalibs)
+        self.assertTrue(cartLoad._claimed.is_set())
+
     def test_gotoField_abort(self):
         self.actorState.gotoField.cmd = self.cmd
         self._run_cmd('gotoField abort', None)
@@ -1347,6 +1534,31 @@ class TestCollimateBoss(SopCmdTester, unittest.TestCase):
         self._collimateBoss()
 
 
+class TestDitheredFlat(SopCmdTester, unittest.TestCase):
+
+    def _ditheredFlat(self, expect, args):
+        stages = ['lamps', 'flats', 'cleanup']
+        stages = dict(zip(stages, ['idle'] * len(stages)))
+        queue = myGlobals.actorState.queues[sopActor.MASTER]
+        msg = self._run_cmd('ditheredFlat %s' % args, queue)
+        self.assertEqual(msg.type, sopActor.Msg.DITHERED_FLAT)
+        self.assertEqual(msg.cmdState.stages, stages)
+        self.assertEqual(msg.cmdState.spN, expect.get('spN', ['sp1', 'sp2']))
+        self.assertEqual(msg.cmdState.expTime, expect.get('expTime', 30))
+        self.assertEqual(msg.cmdState.nStep, expect.get('nStep', 22))
+        self.assertEqual(msg.cmdState.nTick, expect.get('nTick', 62))
+
+    def test_ditheredFlat_default(self):
+        self._ditheredFlat({}, '')
+
+    def test_ditheredFlat_sp2(self):
+        self._ditheredFlat({'spN': ['sp2'], 'nStep': 4, 'nTick': 10}, 'sp2 nStep=4 nTick=10')
+
+    def test_ditheredFlat_abort_idle(self):
+        self._run_cmd('ditheredFlat abort', None)
+        self._check_cmd(0, 0, 0, 0, True, True)
+
+
 class TestDoApogeeScience(SopCmdTester, unittest.TestCase):
 
     def _doApogeeScience(self, expect, args, cmd_levels=(0, 2, 0, 0), didFail=False):
@@ -1459,6 +1671,59 @@ class TestDoApogeeDomeFlat(SopCmdTester, unittest.TestCase):
         self._check_cmd(0, 2, 0, 0, True, True)
 
 
+class TestSlewWhenReady(SopCmdTester, unittest.TestCase):
+
+    def setUp(self):
+        super(TestSlewWhenReady, self).setUp()
+        self._update_cart(11, 'BOSS')
+        sopTester.updateModel('boss', TestHelper.bossState['integrating'])
+        # a separate cmd for the running science command that disables slews.
+        self.scienceCmd = TestHelper.Cmd(verbose=self.verbose)
+        self.actorState.doBossScience.reinitialize(cmd=self.scienceCmd)
+        self.slewWhenReady = self.actorState.slewWhenReady
+        self.queue = myGlobals.actorState.queues[sopActor.SLEW]
+
+    def test_blocked(self):
+        self._run_cmd('gotoGangChange', None)
+        self.assertFalse(self.slewWhenReady.armed)
+        self._check_cmd(0, 0, 0, 0, True, True)
+
+    def test_armed(self):
+        self._run_cmd('gotoGangChange whenReady', None)
+        self.assertTrue(self.slewWhenReady.armed)
+        self.assertEqual(self.slewWhenReady.name, 'gotoGangChange')
+        self._check_cmd(0, 1, 0, 0, False)
+
+    def test_still_blocked(self):
+        self._run_cmd('gotoGangChange whenReady', None)
+        self.slewWhenReady.check()
+        self.assertTrue(self.slewWhenReady.armed)
+        self.assertTrue(self.queue.empty())
+
+    def test_fires_when_allowed(self):
+        self._run_cmd('gotoGangChange whenReady', None)
+        sopTester.updateModel('boss', TestHelper.bossState['reading'])
+        self.slewWhenReady.check()
+        self.assertFalse(self.slewWhenReady.armed)
+        msg = self.queue.get(block=False)
+        self.assertEqual(msg.type, sopActor.Msg.GOTO_GANG_CHANGE)
+        self.assertEqual(len(self.actorState.metrics.get('slewWhenReady.wait')), 1)
+
+    def test_fires_when_command_done(self):
+        self._run_cmd('gotoStow whenReady', None)
+        self.scienceCmd.finished = True
+        self.slewWhenReady.check()
+        msg = self.queue.get(block=False)
+        self.assertEqual(msg.type, sopActor.Msg.GOTO_POSITION)
+
+    def test_disarm(self):
+        self._run_cmd('gotoGangChange whenReady', None)
+        self.assertFalse(self.slewWhenReady.disarm('gotoStow'))
+        self.assertTrue(self.slewWhenReady.disarm('gotoGangChange'))
+        self.assertFalse(self.slewWhenReady.armed)
+        self._check_cmd(0, 1, 0, 0, True, True)
+
+
 class TestIsSlewingDisabled(SopCmdTester, unittest.TestCase):
 
     def _slewing_is_disabled(self, expect):
@@ -116,6 +116,137 @@ class TestApogeeThread(sopTester.SopThreadTester, unittest.TestCase):
         self._check_cmd(0, 0, 1, 0, finish=False)
 
 
+class TestApogeeMechanisms(sopTester.SopThreadTester, unittest.TestCase):
+    """Tests of the APOGEE shutter cache."""
+
+    def setUp(self):
+        self.verbose = verbose
+        self.useThreads = []
+        super(TestApogeeMechanisms, self).setUp()
+        self.mechanisms = apogeeThread.ApogeeMechanisms(myGlobals.actorState)
+        self.metrics = myGlobals.actorState.metrics
+
+    def test_shutter_not_needed(self):
+        self.mechanisms.shutterCB([True, False])
+        self.assertFalse(self.mechanisms.shutter_needed(self.cmd, True))
+        self.assertEqual(self.metrics.count('apogee.skipped.shutter'), 1)
+        self._check_cmd(0, 1, 0, 0, False)
+
+    def test_shutter_needed(self):
+        self.mechanisms.shutterCB([True, False])
+        self.assertTrue(self.mechanisms.shutter_needed(self.cmd, False))
+        self._check_cmd(0, 0, 0, 0, False)
+
+    def test_shutter_unknown(self):
+        self.mechanisms.shutterCB([False, False])
+        self.assertTrue(self.mechanisms.shutter_needed(self.cmd, True))
+        self.assertTrue(self.mechanisms.shutter_needed(self.cmd, False))
+
+    def test_moved_shutter(self):
+        self.mechanisms.shutterCB([False, True])
+        self.mechanisms.moved_shutter(True)
+        self.assertFalse(self.mechanisms.shutter_needed(self.cmd, True))
+
+
+class TestApogeeProgress(sopTester.SopThreadTester, unittest.TestCase):
+    """Tests of the APOGEE read progress tracker."""
+
+    def setUp(self):
+        self.verbose = verbose
+        self.useThreads = []
+        super(TestApogeeProgress, self).setUp()
+        self.progress = apogeeThread.ApogeeProgress(myGlobals.actorState)
+        self.progress.start_set(self.cmd, 2, 500)
+        self.progress.start_exposure(1)
+
+    def test_reads(self):
+        self.progress.readCB(['apRaw-1', 'Reading', 10, 47])
+        self.assertEqual(self.progress.reads(), (10, 37, 57, 37))
+        self.assertAlmostEqual(self.progress.elapsed(), 500 + 500 * 10 / 47.)
+        self._check_cmd(0, 1, 0, 0, False)
+
+    def test_not_reading(self):
+        self.progress.readCB(['apRaw-1', 'Done', 47, 47])
+        self.assertEqual(self.progress.readNum, 0)
+        self._check_cmd(0, 0, 0, 0, False)
+
+    def test_no_dither_set(self):
+        self.progress.reset()
+        self.progress.readCB(['apRaw-1', 'Reading', 10, 47])
+        self._check_cmd(0, 0, 0, 0, False)
+
+    def test_updates_etr(self):
+        cmdState = myGlobals.actorState.doApogeeScience
+        cmdState.reinitialize(self.cmd, output=False)
+        cmdState.ditherPairs = 1
+        self.progress.readCB(['apRaw-1', 'Reading', 47, 47])
+        # Both exposures of the only pair are done: just the readout time remains.
+        self.assertAlmostEqual(cmdState.etr, 2 * cmdState.readout_time / 60.)
+        self._check_cmd(0, 2, 0, 0, False)
+
+
+class FakeCmdVar(object):
+
+    def __init__(self, didFail=False):
+        self.didFail = didFail
+
+
+class TestReadSyncedLampFlasher(sopTester.SopThreadTester, unittest.TestCase):
+    """Tests of the latency bookkeeping of the APOGEE lamp flasher."""
+
+    def setUp(self):
+        self.verbose = verbose
+        self.useThreads = []
+        super(TestReadSyncedLampFlasher, self).setUp()
+        self.flasher = apogeeThread.ReadSyncedLampFlasher(myGlobals.actorState)
+        self.flasher.cmd = self.cmd
+        self.metrics = myGlobals.actorState.metrics
+
+    def _flash(self, onSent=100.):
+        flash = apogeeThread.LampFlash(self.cmd, onSent)
+        flash.onSent = onSent
+        return flash
+
+    def test_onCB(self):
+        self.flasher.onCB(self._flash(), FakeCmdVar())
+        self.assertEqual(len(self.metrics.get('apogeeFlash.commandToOn')), 1)
+        self._check_cmd(0, 1, 0, 0, False)
+
+    def test_onCB_fails(self):
+        self.flasher.onCB(self._flash(), FakeCmdVar(didFail=True))
+        self.assertEqual(self.metrics.get('apogeeFlash.commandToOn'), [])
+        self.assertEqual(self.metrics.count('apogeeFlash.failed'), 1)
+        self._check_cmd(0, 0, 0, 1, False)
+
+    def test_onCB_fails_bypassed(self):
+        self._prep_bypass('lamp_ff', clear=True)
+        self.flasher.onCB(self._flash(), FakeCmdVar(didFail=True))
+        self._check_cmd(0, 0, 1, 0, False)
+
+    def test_offCB(self):
+        flash = self._flash()
+        flash.onDone = 100.
+        flash.offSent = 104.
+        self.flasher.offCB(flash, FakeCmdVar())
+        self.assertEqual(len(self.metrics.get('apogeeFlash.commandToOff')), 1)
+        self.assertEqual(len(self.metrics.get('apogeeFlash.onDuration')), 1)
+        self._check_cmd(0, 0, 0, 0, False)
+
+    def test_overlapping_flashes(self):
+        first, second = self._flash(100.), self._flash(200.)
+        self.flasher.onCB(second, FakeCmdVar())
+        self.flasher.onCB(first, FakeCmdVar())
+        self.assertEqual(first.onSent, 100.)
+        self.assertEqual(second.onSent, 200.)
+        self.assertLess(self.metrics.get('apogeeFlash.commandToOn')[0],
+                        self.metrics.get('apogeeFlash.commandToOn')[1])
+
+    def test_ignored_lamp(self):
+        flasher = apogeeThread.ReadSyncedLampFlasher(myGlobals.actorState, lampName='wht')
+        self.assertIsNone(flasher.flash(self.cmd))
+        self._check_cmd(0, 0, 0, 0, False)
+
+
 # NOTE: commented out, as it doesn't actually test the thing I want it to test:
 # the failure of RO.AddCallback on ApogeeCB.listenToReads.
 # class TestApogeeThreadExit(sopTester.ThreadExitTester,unittest.TestCase):
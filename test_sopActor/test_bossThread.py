@@ -2,6 +2,8 @@
 Test the various commands in SOP bossThread
 """
 
+import threading
+import time
 import unittest
 
 import sopActor
@@ -76,6 +78,114 @@ class TestBossThread(sopTester.SopThreadTester, unittest.TestCase):
         self.cmd.failOn = 'hartmann collimate'
         self._hartmann(1, 1, 0, 1, didFail=True)
 
+    def _move_collimator(self, nCall, nInfo, nWarn, nErr, didFail=False):
+        replyQueue = self.queues['boss']
+        bossThread.move_collimator(self.cmd, myGlobals.actorState, replyQueue, 'sp1', 62, 62, -62)
+        self._check_cmd(
+            nCall, nInfo, nWarn, nErr, False, didFail, reply=['boss', sopActor.Msg.REPLY])
+
+    def test_move_collimator(self):
+        self._move_collimator(1, 0, 0, 0)
+
+    def test_move_collimator_fails(self):
+        self.cmd.failOn = 'boss moveColl spec=sp1 a=62 b=62 c=-62'
+        self._move_collimator(1, 0, 1, 0, didFail=True)
+
+    def test_move_collimator_for(self):
+        """The boss thread is told the move is done, so that it sends the reply."""
+        msg = sopActor.Msg(sopActor.Msg.MOVE_COLLIMATOR, self.cmd, replyQueue=Queue('master'),
+                           spec='sp1', a=62, b=62, c=-62)
+        bossThread.move_collimator_for(msg, myGlobals.actorState, self.queues['boss'])
+        self._check_cmd(1, 0, 0, 0, False, reply=['boss', sopActor.Msg.COLLIMATOR_MOVED])
+
+
+class TestExposureController(sopTester.SopThreadTester, unittest.TestCase):
+    """Test the non-blocking boss exposure controller."""
+
+    def setUp(self):
+        self.useThreads = []
+        self.verbose = True
+        super(TestExposureController, self).setUp()
+        myGlobals.actorState.queues['boss'] = Queue('boss')
+        self.queues = myGlobals.actorState.queues
+        self.controller = bossThread.ExposureController(myGlobals.actorState,
+                                                        Queue('bossController'))
+
+    def _expose_msg(self, expTime=900, **kwargs):
+        return sopActor.Msg(
+            sopActor.Msg.EXPOSE,
+            self.cmd,
+            replyQueue=self.queues['boss'],
+            expTime=expTime,
+            expType='science',
+            readout=True,
+            **kwargs)
+
+    def _set_busy(self):
+        self.controller.current = self._expose_msg()
+        self.controller.startTime = time.time()
+
+    def test_submit_busy(self):
+        self._set_busy()
+        msg = self._expose_msg()
+        self.controller.submit(msg)
+        self.assertEqual(self.controller.pending, [msg])
+        self._check_cmd(0, 1, 0, 0, False)
+
+    def test_stop_clear_queue(self):
+        self._set_busy()
+        self.controller.pending.append(self._expose_msg())
+        self.controller.stop(self.cmd, clear_queue=True)
+        self.assertEqual(self.controller.pending, [])
+        self._check_cmd(0, 0, 1, 0, False, reply=['boss', sopActor.Msg.REPLY])
+
+    def test_stop_clear_queue_keeps_others(self):
+        """Exposures waiting on the queue are dropped, without touching the other messages."""
+        queue = self.controller.queue
+        status = sopActor.Msg(sopActor.Msg.STATUS, self.cmd, replyQueue=self.queues['boss'])
+        sender = threading.Thread(target=queue.put, args=(status, ), name='master')
+        sender.start()
+        sender.join()
+        queue.put(self._expose_msg())
+        self.controller.stop(self.cmd, clear_queue=True)
+        self.assertIsNone(queue.handling)
+        self.assertIsNone(queue.heartbeat)
+        self.assertEqual(queue.qsize(), 1)
+        self.assertEqual(status.senderName, 'master')
+        self.assertIs(queue.get(False), status)
+        self._check_cmd(0, 0, 1, 0, False, reply=['boss', sopActor.Msg.REPLY])
+
+    def test_stop_keep_queue(self):
+        self._set_busy()
+        self.controller.pending.append(self._expose_msg())
+        self.controller.stop(self.cmd)
+        self.assertEqual(len(self.controller.pending), 1)
+        self._check_cmd(0, 0, 0, 0, False)
+
+    def _finish(self, nInfo, nErr, success):
+        self.controller.current = self._expose_msg(finish_msg='text="done"')
+        self.controller.startTime = time.time()
+        msg = sopActor.Msg(
+            sopActor.Msg.EXPOSURE_FINISHED,
+            self.cmd,
+            exposeMsg=self.controller.current,
+            success=success)
+        self.controller.finish(msg)
+        self.assertFalse(self.controller.busy)
+        self.assertEqual(len(myGlobals.actorState.metrics.get('boss.exposure')), 1)
+        self._check_cmd(
+            0, nInfo, 0, nErr, False, reply=['boss', sopActor.Msg.EXPOSURE_FINISHED])
+
+    def test_finish(self):
+        self._finish(1, 0, True)
+
+    def test_finish_fails(self):
+        self._finish(1, 1, False)
+
+    def test_genKeys_idle(self):
+        self.controller.genKeys(self.cmd)
+        self._check_cmd(0, 1, 0, 0, False)
+
 
 if __name__ == '__main__':
     verbosity = 2
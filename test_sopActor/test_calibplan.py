@@ -0,0 +1,66 @@
+"""
+Test the BOSS calibration order planning in calibplan.py
+"""
+import unittest
+
+from sopActor.utils import calibplan
+
+
+warmup = {'ff': 1, 'hgcd': 120, 'ne': 20}
+expTimes = {'bias': 0, 'dark': 900, 'flat': 30, 'arc': 4}
+
+
+class TestSimulate(unittest.TestCase):
+
+    def test_bias(self):
+        steps, total = calibplan.simulate(['bias'], {'bias': 2}, expTimes, warmup)
+        self.assertEqual(steps, [calibplan.CalibStep('bias', 2, 0, 214)])
+        self.assertEqual(total, 214)
+
+    def test_flat_arc(self):
+        counts = {'flat': 2, 'arc': 2}
+        steps, total = calibplan.simulate(['flat', 'arc'], counts, expTimes, warmup, ffsOpen=True)
+        self.assertEqual([step.expType for step in steps], ['flat', 'arc'])
+        # close the FFS, then wait for the HgCd lamps to warm up during the flat readout.
+        self.assertEqual(steps[0].start, 15)
+        self.assertEqual(steps[1].start, 327)
+        self.assertEqual(total, 549)
+
+    def test_skips_empty(self):
+        steps, total = calibplan.simulate(['dark', 'bias'], {'bias': 2}, expTimes, warmup)
+        self.assertEqual(len(steps), 1)
+        self.assertEqual(total, 214)
+
+
+class TestPlanCalibs(unittest.TestCase):
+
+    def test_cold_lamps(self):
+        counts = {'flat': 2, 'arc': 2}
+        order, steps, total = calibplan.plan_calibs(counts, expTimes, warmup, ffsOpen=True)
+        self.assertEqual(order, ['flat', 'arc'])
+        self.assertEqual(total, 549)
+
+    def test_warm_arc_lamps(self):
+        counts = {'flat': 2, 'arc': 2}
+        warmFor = {'hgcd': 200, 'ne': 200}
+        order, steps, total = calibplan.plan_calibs(counts, expTimes, warmup, warmFor=warmFor)
+        self.assertEqual(order, ['arc', 'flat'])
+
+    def test_warm_arc_lamps_bias_last(self):
+        counts = {'bias': 2, 'flat': 2, 'arc': 2}
+        warmFor = {'hgcd': 200, 'ne': 200}
+        order, steps, total = calibplan.plan_calibs(counts, expTimes, warmup, warmFor=warmFor)
+        self.assertEqual(order, ['arc', 'flat', 'bias'])
+        self.assertEqual(total, 710)
+
+    def test_canonical_on_ties(self):
+        counts = {'bias': 2, 'dark': 1, 'flat': 2, 'arc': 2}
+        order, steps, total = calibplan.plan_calibs(counts, expTimes, warmup)
+        self.assertEqual(order, list(calibplan.canonicalOrder))
+
+    def test_nothing_to_do(self):
+        self.assertEqual(calibplan.plan_calibs({}, expTimes, warmup), ([], [], 0.))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+"""
+Test the gotoField calibration registry in calibrations.py
+"""
+import unittest
+
+from sopActor.utils.calibrations import CalibrationRegistry
+
+
+class FakeModel(object):
+
+    def __init__(self, keyVarDict):
+        self.keyVarDict = keyVarDict
+
+
+class TestCalibrationRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = CalibrationRegistry(maxAge=3600)
+        self.field = (7000, 11, 'A')
+        self.registry.record('arc', 4, self.field, now=1000.)
+
+    def test_field(self):
+        models = {'platedb': FakeModel({'pointingInfo': [7000, 11, 'A', 10., 20.]})}
+        self.assertEqual(CalibrationRegistry.field(models), self.field)
+
+    def test_field_unknown(self):
+        self.assertIsNone(CalibrationRegistry.field({}))
+        models = {'platedb': FakeModel({'pointingInfo': [None, None, None, None, None]})}
+        self.assertIsNone(CalibrationRegistry.field(models))
+
+    def test_find(self):
+        calibration = self.registry.find('arc', 4, self.field, now=2000.)
+        self.assertEqual(calibration.time, 1000.)
+
+    def test_other_type(self):
+        self.assertIsNone(self.registry.find('flat', 4, self.field, now=2000.))
+
+    def test_other_expTime(self):
+        self.assertIsNone(self.registry.find('arc', 10, self.field, now=2000.))
+
+    def test_other_field(self):
+        self.assertIsNone(self.registry.find('arc', 4, (7000, 12, 'A'), now=2000.))
+
+    def test_too_old(self):
+        self.assertIsNone(self.registry.find('arc', 4, self.field, now=5000.))
+
+    def test_disabled(self):
+        self.registry.maxAge = 0
+        self.assertIsNone(self.registry.find('arc', 4, self.field, now=1001.))
+
+    def test_invalidate(self):
+        self.registry.record('arc', 4, (7000, 12, 'A'), now=1000.)
+        self.registry.invalidate(self.field)
+        self.assertIsNone(self.registry.find('arc', 4, self.field, now=2000.))
+        self.assertIsNotNone(self.registry.find('arc', 4, (7000, 12, 'A'), now=2000.))
+        self.registry.invalidate()
+        self.assertEqual(self.registry.calibrations, {})
+
+    def test_record_unknown_field(self):
+        self.registry.record('flat', 25, None)
+        self.assertEqual(len(self.registry.calibrations), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+"""
+Test preparing gotoField on a cartridge load in cartload.py
+"""
+import threading
+import unittest
+
+import sopActor
+import sopActor.myGlobals as myGlobals
+import sopTester
+from sopActor.utils.cartload import CartLoadPrep
+
+
+class FakeModel(object):
+
+    def __init__(self, keyVarDict):
+        self.keyVarDict = keyVarDict
+
+
+class TestCartLoadPrep(sopTester.SopTester, unittest.TestCase):
+
+    def setUp(self):
+        self.verbose = True
+        super(TestCartLoadPrep, self).setUp()
+        self._update_cart(11, 'eBOSS')
+        self.models = self.actorState.models
+        self.models['platedb'] = FakeModel({'pointingInfo': [7000, 11, 'A', 150., 30.]})
+        self.models['tcc'] = FakeModel({'axePos': [121., 60., 0.]})
+        self.cartLoad = CartLoadPrep(self.actorState, enabled=True)
+        self.now = 1.5e9
+
+    def test_prepare(self):
+        prepared = self.cartLoad.prepare(11, self.now)
+        self.assertEqual(prepared.field, (7000, 11, 'A'))
+        self.assertEqual((prepared.ra, prepared.dec), (150., 30.))
+        ha, alt, az = self.actorState.fieldPlanner.altaz([150.], [30.], self.now)
+        self.assertAlmostEqual(prepared.alt, alt[0])
+        self.assertAlmostEqual(prepared.az, az[0])
+        self.assertGreaterEqual(prepared.slewTime, self.actorState.fieldPlanner.settleTime)
+        self.assertEqual(prepared.stages, ['slew', 'hartmann', 'calibs', 'guider', 'cleanup'])
+        self.assertEqual(prepared.science, 'doBossScience')
+
+    def test_prepare_unknown_axePos(self):
+        self.models['tcc'] = FakeModel({'axePos': [None, None, None]})
+        self.actorState.metrics.record('gotoField.slew', 100)
+        self.assertEqual(self.cartLoad.prepare(11, self.now).slewTime, 100)
+
+    def test_prepare_unknown_field(self):
+        self.models['platedb'] = FakeModel({'pointingInfo': [None] * 5})
+        prepared = self.cartLoad.prepare(11, self.now)
+        self.assertIsNone(prepared.ra)
+        self.assertIsNone(prepared.slewTime)
+
+    def _no_arcs(self):
+        self.actorState.gotoField.stages['hartmann'] = 'off'
+        self.actorState.gotoField.stages['calibs'] = 'off'
+
+    def test_lamp_turn_on_times(self):
+        prepared = self.cartLoad.prepare(11, self.now)
+        neededAt = self.now + prepared.slewTime
+        turnOn = self.cartLoad.lamp_turn_on_times(prepared)
+        self.assertEqual([name for t, lamp, name in turnOn], ['HgCd', 'Ne'])
+        for t, lamp, name in turnOn:
+            self.assertAlmostEqual(t, neededAt - myGlobals.warmupTime[lamp], delta=0.1)
+        hints = self.actorState.lampState.hints
+        self.assertEqual(hints[sopActor.HGCD_LAMP], neededAt)
+        self.assertEqual(hints[sopActor.NE_LAMP], neededAt)
+
+    def test_lamp_turn_on_times_no_arcs(self):
+        self._no_arcs()
+        prepared = self.cartLoad.prepare(11, self.now)
+        self.assertEqual(self.cartLoad.lamp_turn_on_times(prepared), [])
+        self.assertEqual(self.actorState.lampState.hints, {})
+
+    def test_prewarm_lamps_claimed(self):
+        claimed = threading.Event()
+        claimed.set()
+        self.cartLoad.prewarm_lamps(self.cartLoad.prepare(11, self.now), claimed)
+        self._check_cmd(0, 0, 0, 0, False)
+
+    def test_claim(self):
+        self._no_arcs()
+        self.cartLoad.prepared = self.cartLoad.prepare(11, self.now)
+        self.assertIs(self.cartLoad.claim(), self.cartLoad.prepared)
+        self.assertTrue(self.cartLoad._claimed.is_set())
+        self.cartLoad.loaded(12)
+        self.assertFalse(self.cartLoad._claimed.is_set())
+
+    def test_current(self):
+        self.cartLoad.prepared = self.cartLoad.prepare(11, self.now)
+        self.assertIs(self.cartLoad.current(), self.cartLoad.prepared)
+        self.models['platedb'] = FakeModel({'pointingInfo': [7000, 11, 'B', 151., 30.]})
+        self.assertIsNone(self.cartLoad.current())
+
+    def test_current_other_cartridge(self):
+        self.cartLoad.prepared = self.cartLoad.prepare(12, self.now)
+        self.assertIsNone(self.cartLoad.current())
+
+    def test_loaded(self):
+        self._no_arcs()
+        self.cartLoad.loaded(11)
+        self.cartLoad._thread.join(5)
+        self.assertEqual(self.cartLoad.current().cartridge, 11)
+        self._check_cmd(0, 1, 0, 0, False)
+
+    def test_loaded_disabled(self):
+        self.cartLoad.enabled = False
+        self.cartLoad.loaded(11)
+        self.assertIsNone(self.cartLoad._thread)
+        self.assertIsNone(self.cartLoad.current())
+
+    def test_superseded(self):
+        self._no_arcs()
+        self.cartLoad.loaded(11)
+        self.cartLoad._thread.join(5)
+        self.cartLoad._run(12, self.cartLoad._generation - 1, threading.Event())
+        self.assertEqual(self.cartLoad.prepared.cartridge, 11)
+
+
+if __name__ == '__main__':
+    unittest.main()
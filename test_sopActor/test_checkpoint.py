@@ -0,0 +1,57 @@
+"""
+Test the sequence checkpoints in checkpoint.py
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from sopActor.utils.checkpoint import CheckpointStore
+
+
+class TestCheckpointStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.checkpoints = CheckpointStore(os.path.join(self.tempdir, 'checkpoints'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_disabled(self):
+        checkpoints = CheckpointStore()
+        checkpoints.save('doMangaSequence', 11, {}, {'index': 1})
+        self.assertIsNone(checkpoints.load('doMangaSequence'))
+
+    def test_save_load(self):
+        self.checkpoints.save('doMangaSequence', 11, {'expTime': 900.}, {'index': 2}, now=100)
+        checkpoint = self.checkpoints.load('doMangaSequence')
+        self.assertEqual(checkpoint['cartridge'], 11)
+        self.assertEqual(checkpoint['keywords'], {'expTime': 900.})
+        self.assertEqual(checkpoint['state'], {'index': 2})
+        self.assertEqual(checkpoint['time'], 100)
+
+    def test_replace(self):
+        self.checkpoints.save('doMangaSequence', 11, {}, {'index': 1})
+        self.checkpoints.save('doMangaSequence', 11, {}, {'index': 2})
+        self.assertEqual(self.checkpoints.load('doMangaSequence')['state'], {'index': 2})
+        self.assertEqual(os.listdir(self.checkpoints.directory), ['doMangaSequence.json'])
+
+    def test_missing(self):
+        self.assertIsNone(self.checkpoints.load('doBossCalibs'))
+
+    def test_corrupt(self):
+        os.makedirs(self.checkpoints.directory)
+        with open(os.path.join(self.checkpoints.directory, 'doBossCalibs.json'), 'w') as f:
+            f.write('{"name": ')
+        self.assertIsNone(self.checkpoints.load('doBossCalibs'))
+
+    def test_clear(self):
+        self.checkpoints.save('doBossCalibs', 11, {}, {'nArcDone': 1})
+        self.checkpoints.clear('doBossCalibs')
+        self.assertIsNone(self.checkpoints.load('doBossCalibs'))
+        self.checkpoints.clear('doBossCalibs')
+
+
+if __name__ == '__main__':
+    unittest.main()
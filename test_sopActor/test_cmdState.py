@@ -4,11 +4,15 @@ Test creating, modifying, and destroying the many different CmdStates.
 
 import abc
 import copy
+import os
+import shutil
+import tempfile
 import unittest
 
 import sopActor
 import sopTester
 from actorcore import TestHelper
+from sopActor.utils.checkpoint import CheckpointStore
 
 
 class TestKeywords(sopTester.SopTester, unittest.TestCase):
@@ -103,6 +107,12 @@ class CmdStateTester(sopTester.SopTester):
         self.assertEqual(self.cmd.levels.count('i'), self.inform)
         self.assertEqual(self.cmd.levels.count('w'), 0)
 
+    def _enable_checkpoints(self, cartridge=11):
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        self.actorState.checkpoints = CheckpointStore(tempdir)
+        self.actorState.cartridge = cartridge
+
     def test_took_exposure(self):
         self.cmdState.index = 0
         self.cmdState.took_exposure()
@@ -317,6 +327,36 @@ class TestDoBossCalibs(CmdStateTester, unittest.TestCase):
         self.cmdState.aborted = True
         self.assertFalse(self.cmdState.exposures_remain())
 
+    def test_setStageState_no_checkpoint(self):
+        """Only exposures are checkpointed, not stage changes."""
+        self._enable_checkpoints()
+        self.cmdState.setStageState('flat', 'running')
+        self.assertIsNone(self.actorState.checkpoints.load(self.cmdState.name))
+
+    def test_checkpoint_unwritable(self):
+        """A checkpoint that cannot be saved is warned about, and the sequence continues."""
+        self._enable_checkpoints()
+        checkpoints = self.actorState.checkpoints
+        notADirectory = os.path.join(checkpoints.directory, 'file')
+        open(notADirectory, 'w').close()
+        checkpoints.directory = os.path.join(notADirectory, 'checkpoints')
+        self.cmdState.nArcDone = 1
+        self.cmdState.checkpoint()
+        self.assertEqual(self.cmd.levels.count('w'), 1)
+
+    def test_resume_after_abort(self):
+        """The checkpoint keeps the progress from before abort truncated the sequence."""
+        self._enable_checkpoints()
+        self.cmdState.nArc = 2
+        self.cmdState.offset = 10
+        self.cmdState.nArcDone = 1
+        self.cmdState.checkpoint()
+        self.cmdState.abort()
+        cmdState = sopActor.CmdState.DoBossCalibsCmd()
+        self.assertIsNone(cmdState.resume())
+        self.assertEqual((cmdState.nArc, cmdState.nArcDone), (2, 1))
+        self.assertEqual(cmdState.offset, 0)
+
 
 class TestDoApogeeScience(CmdStateTester, unittest.TestCase):
 
@@ -597,6 +637,54 @@ class TestDoMangaSequence(CmdStateTester, unittest.TestCase):
         self.cmdState.aborted = True
         self.assertFalse(self.cmdState.exposures_remain())
 
+    def test_resume(self):
+        self._enable_checkpoints()
+        self.cmdState.dithers = 'CCC'
+        self.cmdState.count = 1
+        self.cmdState.reset_ditherSeq()
+        self.cmdState.took_exposure()
+        self.cmdState.took_exposure()
+        cmdState = sopActor.CmdState.DoMangaSequenceCmd()
+        self.assertIsNone(cmdState.resume())
+        self.assertEqual(cmdState.index, 2)
+        self.assertEqual(cmdState.ditherSeq, 'CCC')
+        self.assertEqual(cmdState.remaining_exposures(), 1)
+
+    def test_resume_other_cartridge(self):
+        self._enable_checkpoints()
+        self.cmdState.took_exposure()
+        self.actorState.cartridge = 12
+        self.assertIn('cartridge 11', self.cmdState.resume())
+
+    def test_resume_no_checkpoint(self):
+        self._enable_checkpoints()
+        self.assertIsNotNone(self.cmdState.resume())
+
+    def test_resume_done(self):
+        self._enable_checkpoints()
+        self.cmdState.took_exposure()
+        self.cmdState.setCommandState('done')
+        self.assertIsNotNone(self.cmdState.resume())
+
+    def _update_etr_measured(self):
+        self.actorState.metrics.record('boss.flush', 20.)
+        self.actorState.metrics.record('boss.read', 70.)
+        self.cmdState.expTime = 900.
+        self.cmdState.dithers = 'NSE'
+        self.cmdState.count = 1
+        self.cmdState.reset_ditherSeq()
+        self.cmdState.update_etr()
+
+    def test_update_etr_measured_plan_disabled(self):
+        self.actorState.plan.enabled = False
+        self._update_etr_measured()
+        self.assertAlmostEqual(self.cmdState.etr, 3 * (900 + self.cmdState.readout_time) / 60.)
+
+    def test_update_etr_measured_plan_enabled(self):
+        self.actorState.plan.enabled = True
+        self._update_etr_measured()
+        self.assertAlmostEqual(self.cmdState.etr, 3 * (900 + 90) / 60.)
+
     def _update_ditherSeq(self, count):
         self.assertEqual(3, self.cmdState.count)
         self.assertEqual(self.cmdState.dithers * 3, self.cmdState.ditherSeq)
@@ -0,0 +1,83 @@
+"""
+Test the sop command queue in cmdqueue.py
+"""
+import unittest
+
+import sopTester
+from sopActor import CmdState
+from sopActor.utils.cmdqueue import CommandQueue
+
+
+class FakeCmdVar(object):
+
+    def __init__(self, didFail=False):
+        self.didFail = didFail
+
+
+class TestCommandQueue(sopTester.SopTester, unittest.TestCase):
+
+    def setUp(self):
+        self.verbose = True
+        super(TestCommandQueue, self).setUp()
+        self.commandQueue = CommandQueue(self.actorState)
+        self.cmdState = CmdState.CmdState('gotoField', ['slew'])
+
+    def test_add(self):
+        self.commandQueue.add('doBossScience')
+        self.commandQueue.add('doBossCalibs narc=1')
+        self.commandQueue.add('gotoField', position=1)
+        self.assertEqual(self.commandQueue.commands,
+                         ['gotoField', 'doBossScience', 'doBossCalibs narc=1'])
+
+    def test_add_bad_position(self):
+        with self.assertRaises(IndexError):
+            self.commandQueue.add('gotoField', position=2)
+
+    def test_remove(self):
+        self.commandQueue.add('gotoField')
+        self.commandQueue.add('doBossScience')
+        self.assertEqual(self.commandQueue.remove(2), 'doBossScience')
+        with self.assertRaises(IndexError):
+            self.commandQueue.remove(2)
+
+    def test_pop(self):
+        self.commandQueue.add('gotoField')
+        self.assertEqual(self.commandQueue.pop(), 'gotoField')
+        self.assertIsNone(self.commandQueue.pop())
+
+    def test_genKeys(self):
+        self.commandQueue.add('doApogeeMangaSequence count=2')
+        self.commandQueue.genKeys(self.cmd)
+        self._check_cmd(0, 1, 0, 0, False)
+
+    def test_failed_clears(self):
+        self.commandQueue.add('doBossScience')
+        self.commandQueue.command_finished(self.cmdState, 'failed')
+        self.assertEqual(len(self.commandQueue), 0)
+        self._check_cmd(0, 1, 1, 0, False)
+
+    def test_aborted_clears(self):
+        self.commandQueue.add('doBossScience')
+        self.commandQueue.command_finished(self.cmdState, 'aborted')
+        self.assertEqual(len(self.commandQueue), 0)
+
+    def test_empty_does_nothing(self):
+        self.commandQueue.command_finished(self.cmdState, 'done')
+        self._check_cmd(0, 0, 0, 0, False)
+
+    def test_startedCB_failed(self):
+        self.commandQueue.running = 'gotoField'
+        self.commandQueue.add('doBossScience')
+        self.commandQueue.startedCB(FakeCmdVar(didFail=True))
+        self.assertEqual(len(self.commandQueue), 0)
+        self._check_cmd(0, 1, 1, 0, False)
+
+    def test_startedCB_ok(self):
+        self.commandQueue.add('doBossScience')
+        self.commandQueue.startedCB(FakeCmdVar())
+        self.assertEqual(len(self.commandQueue), 1)
+        self._check_cmd(0, 0, 0, 0, False)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+"""
+Test the BOSS exposure planning for APOGEE dither sets in coobserving.py
+"""
+import unittest
+
+from sopActor.utils import coobserving
+
+# The default BOSS flush and readout times, from masterThread.
+bossTimes = dict(flushTime=25., readoutTime=82.)
+
+
+class TestPlanBossExposures(unittest.TestCase):
+
+    def test_apogee_lead(self):
+        plan = coobserving.plan_boss_exposures(900, 500, lead='apogee', **bossTimes)
+        self.assertEqual(plan.nBoss, 1)
+
+    def test_apogee_lead_short_boss(self):
+        plan = coobserving.plan_boss_exposures(300, 500, lead='apogee', **bossTimes)
+        self.assertEqual(plan.nBoss, 2)
+        self.assertEqual(plan.duration, 1000)
+
+    def test_apogee_lead_long_apogee(self):
+        plan = coobserving.plan_boss_exposures(900, 1000, lead='apogee', **bossTimes)
+        self.assertEqual(plan.nBoss, 2)
+
+    def test_boss_lead(self):
+        plan = coobserving.plan_boss_exposures(300, 500, lead='boss', **bossTimes)
+        self.assertEqual(plan.nBoss, 3)
+        self.assertEqual(plan.duration, 3 * (25 + 300 + 82))
+
+    def test_no_lead(self):
+        self.assertEqual(coobserving.plan_boss_exposures(900, 487, **bossTimes).nBoss, 1)
+        self.assertEqual(coobserving.plan_boss_exposures(900, 1000, **bossTimes).nBoss, 2)
+
+    def test_measured_times(self):
+        plan = coobserving.plan_boss_exposures(
+            450, 500, lead='apogee', flushTime=10, readoutTime=40)
+        self.assertEqual(plan.nBoss, 2)
+        plan = coobserving.plan_boss_exposures(450, 500, lead='apogee', **bossTimes)
+        self.assertEqual(plan.nBoss, 1)
+
+    def test_fixed_nBoss(self):
+        plan = coobserving.plan_boss_exposures(300, 487, nBoss=1, **bossTimes)
+        self.assertEqual(plan.nBoss, 1)
+        self.assertEqual(plan.duration, 974)
+        plan = coobserving.plan_boss_exposures(900, 1000, nBoss=2, **bossTimes)
+        self.assertEqual(plan.nBoss, 2)
+        self.assertEqual(plan.duration, 2 * (25 + 900 + 82))
+
+    def test_apogee_window(self):
+        self.assertEqual(coobserving.apogee_window(500), 1000)
+        self.assertAlmostEqual(coobserving.apogee_window(500, readTime=10.6), 2 * 48 * 10.6)
+
+    def test_efficiency(self):
+        self.assertEqual(coobserving.efficiency(900, 1000, 1000), 0.95)
+        self.assertEqual(coobserving.efficiency(900, 1000, 0), 0.)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+"""
+Test the night efficiency report in efficiency.py
+"""
+import json
+import unittest
+
+from sopActor.utils.efficiency import (EfficiencyReport, classify_msg, classify_stage,
+                                       current_mjd, mjd_range)
+from sopActor.utils.ledger import Entry
+
+
+def entry(kind, name, start, end, thread='master', **params):
+    return Entry(kind, name, thread, start, end, 1, 11, 'MANGA',
+                 json.dumps(params) if params else None)
+
+
+class TestClassify(unittest.TestCase):
+
+    def test_boss_science(self):
+        intervals = classify_msg(
+            entry('msg', 'EXPOSE', 0, 980, 'boss', expTime=900, expType='science'))
+        self.assertEqual([(i.start, i.end, i.category) for i in intervals],
+                         [(0, 25, 'reading'), (25, 925, 'integrating'), (925, 980, 'reading')])
+
+    def test_boss_science_flushTime(self):
+        intervals = classify_msg(
+            entry('msg', 'EXPOSE', 0, 980, 'boss', expTime=900, expType='science'), 30)
+        self.assertEqual([(i.start, i.end, i.category) for i in intervals],
+                         [(0, 30, 'reading'), (30, 930, 'integrating'), (930, 980, 'reading')])
+
+    def test_boss_readout(self):
+        interval, = classify_msg(entry('msg', 'EXPOSE', 0, 60, 'boss', expTime=-1))
+        self.assertEqual(interval.category, 'reading')
+
+    def test_boss_arc(self):
+        interval, = classify_msg(entry('msg', 'EXPOSE', 0, 100, 'boss', expTime=4, expType='arc'))
+        self.assertEqual(interval.category, 'calibrating')
+
+    def test_apogee_dither_set(self):
+        intervals = classify_msg(
+            entry('msg', 'APOGEE_DITHER_SET', 0, 1000, 'apogee', expTime=450, dithers='AB',
+                  expType='object'))
+        self.assertEqual(intervals[0].end, 900)
+
+    def test_threads(self):
+        self.assertEqual(classify_msg(entry('msg', 'SLEW', 0, 1, 'slew'))[0].category, 'slewing')
+        self.assertEqual(classify_msg(entry('msg', 'FFS_MOVE', 0, 1, 'ffs'))[0].category, 'ffs')
+        self.assertEqual(
+            classify_msg(entry('msg', 'LAMP_ON', 0, 1, 'hgcd', on=True))[0].category, 'lamps')
+        self.assertEqual(classify_msg(entry('msg', 'LAMP_ON', 0, 1, 'hgcd', on=False)), [])
+        self.assertEqual(classify_msg(entry('msg', 'START', 0, 1, 'guider'))[0].category, 'guider')
+        self.assertEqual(classify_msg(entry('msg', 'STATUS', 0, 1, 'apogee')), [])
+
+    def test_stage(self):
+        self.assertEqual(classify_stage(entry('stage', 'gotoField.slew', 0, 1)), 'slewing')
+        self.assertIsNone(classify_stage(entry('stage', 'doMangaSequence.expose', 0, 1)))
+
+
+class TestEfficiencyReport(unittest.TestCase):
+
+    def setUp(self):
+        self.entries = [
+            entry('command', 'gotoField', 0, 600),
+            entry('stage', 'gotoField.slew', 0, 300),
+            entry('msg', 'SLEW', 0, 200, 'slew'),
+            entry('msg', 'LAMP_ON', 100, 400, 'hgcd', on=True),
+            entry('stage', 'gotoField.calibs', 300, 500),
+            entry('msg', 'EXPOSE', 400, 500, 'boss', expTime=4, expType='arc'),
+            entry('command', 'doMangaSequence', 700, 1700),
+            entry('msg', 'EXPOSE', 700, 1680, 'boss', expTime=900, expType='science'),
+        ]
+        self.report = EfficiencyReport(self.entries, 0, 1700)
+
+    def test_totals(self):
+        totals = self.report.totals
+        self.assertEqual(totals['integrating'], 900)
+        self.assertEqual(totals['reading'], 80)
+        # after the slew message, waiting on the lamp takes precedence over the slew stage
+        self.assertEqual(totals['slewing'], 200)
+        self.assertEqual(totals['lamps'], 200)
+        self.assertEqual(totals['calibrating'], 100)
+        self.assertEqual(totals['idle'], 220)
+        self.assertEqual(sum(totals.values()), 1700)
+
+    def test_open_fraction(self):
+        self.assertAlmostEqual(self.report.open_fraction, 900 / 1700.)
+
+    def test_stages(self):
+        self.assertEqual(self.report.stages['gotoField.slew']['slewing'], 200)
+        self.assertEqual(self.report.stages['gotoField.slew']['lamps'], 100)
+        self.assertEqual(self.report.stages['gotoField.calibs']['lamps'], 100)
+        self.assertEqual(self.report.stages['gotoField.calibs']['calibrating'], 100)
+
+    def test_flushTime(self):
+        report = EfficiencyReport(self.entries, 1600, 1700, flushTime=0)
+        self.assertEqual(report.totals['integrating'], 0)
+        self.assertEqual(report.totals['reading'], 80)
+
+    def test_clipped(self):
+        report = EfficiencyReport(self.entries, 800, 1000)
+        self.assertEqual(report.totals['integrating'], 200)
+        self.assertEqual(sum(report.totals.values()), 200)
+
+    def test_mjd(self):
+        start, end = mjd_range(58000)
+        self.assertEqual(current_mjd(start), 58000)
+        self.assertEqual(current_mjd(end - 1), 58000)
+
+    def test_format(self):
+        self.assertIn('integrating', self.report.format())
+
+
+if __name__ == '__main__':
+    unittest.main()
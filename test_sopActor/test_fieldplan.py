@@ -0,0 +1,100 @@
+"""
+Test the vectorised field planning in fieldplan.py
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+from sopActor.utils.fieldplan import FieldPlanner, lst, read_fields
+
+
+class TestFieldPlanner(unittest.TestCase):
+
+    def setUp(self):
+        self.planner = FieldPlanner()
+        self.now = 1.5e9
+        lat = self.planner.latitude
+        here = lst(self.planner.longitude, self.now)
+        # on the meridian: 10 and 30 degrees south of the zenith, 30 north, and below the horizon.
+        self.plates = numpy.array([1, 2, 3, 4])
+        self.cartridges = numpy.array([10, 11, -1, 12])
+        self.ra = numpy.array([here, here, here, (here + 180) % 360])
+        self.dec = numpy.array([lat - 10, lat - 30, lat + 30, -30])
+
+    def test_lst(self):
+        self.assertAlmostEqual(lst(0, 946728000.), 280.46061837, places=6)  # J2000.0
+        self.assertAlmostEqual(lst(-105, 946728000.), 175.46061837, places=6)
+
+    def test_altaz(self):
+        ha, alt, az = self.planner.altaz(self.ra, self.dec, self.now)
+        numpy.testing.assert_allclose(ha[:3], 0, atol=1e-6)
+        numpy.testing.assert_allclose(alt[:3], [80, 60, 60], atol=1e-6)
+        self.assertLess(alt[3], 0)
+        # TCC azimuth: 0 is south, 180 is north.
+        numpy.testing.assert_allclose(az[:3], [0, 0, 180], atol=1e-6)
+
+    def test_altaz_east_west(self):
+        here = lst(self.planner.longitude, self.now)
+        # on the equator, 6 hours east (rising) and 6 hours west (setting) of the meridian.
+        ha, alt, az = self.planner.altaz([(here + 90) % 360, (here - 90) % 360], [0, 0], self.now)
+        numpy.testing.assert_allclose(ha, [-90, 90], atol=1e-6)
+        numpy.testing.assert_allclose(alt, 0, atol=1e-6)
+        # TCC azimuth: 90 is east, 270 (-90) is west.
+        numpy.testing.assert_allclose(az, [90, 270], atol=1e-6)
+
+    def test_airmass(self):
+        airmass = FieldPlanner.airmass([90, 30, -10])
+        numpy.testing.assert_allclose(airmass[:2], [1, 2])
+        self.assertTrue(numpy.isnan(airmass[2]))
+
+    def test_slew_time(self):
+        slewTime = self.planner.slew_time(350, 60, numpy.array([10, 180]), numpy.array([30, 60]))
+        # 20 degrees in az (the short way round) and 30 in alt; then 170 in az.
+        numpy.testing.assert_allclose(slewTime, [20 + 30, 170 / 1.5 + 30])
+
+    def test_plan(self):
+        plan = self.planner.plan(self.plates, self.cartridges, self.ra, self.dec, 0, 60,
+                                 now=self.now)
+        self.assertEqual(len(plan), 4)
+        numpy.testing.assert_allclose(plan.slewTime[:3], [20 / 1.5 + 30, 30, 180 / 1.5 + 30])
+        # observable fields by slew time, then the one below minAlt.
+        self.assertEqual(list(plan.plates[plan.order()]), [2, 1, 3, 4])
+
+    def test_unknown_position(self):
+        plan = self.planner.plan(self.plates, self.cartridges, self.ra, self.dec,
+                                 float('nan'), float('nan'), now=self.now)
+        self.assertTrue(numpy.isnan(plan.slewTime).all())
+
+
+class TestReadFields(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, 'fields.txt')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def _write(self, text):
+        with open(self.path, 'w') as f:
+            f.write(text)
+
+    def test_read_fields(self):
+        self._write('# plate ra dec cartridge\n8000 120.5 30.25 11\n\n8001 200 -5  # no cart\n')
+        plates, cartridges, ra, dec = read_fields(self.path)
+        self.assertEqual(list(plates), [8000, 8001])
+        self.assertEqual(list(cartridges), [11, -1])
+        self.assertEqual(list(ra), [120.5, 200])
+        self.assertEqual(list(dec), [30.25, -5])
+
+    def test_read_fields_bad_line(self):
+        self._write('8000 120.5\n')
+        with self.assertRaises(ValueError):
+            read_fields(self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+"""
+Test the Hartmann collimation cache in focus.py
+"""
+import unittest
+
+from sopActor.utils.focus import FocusCache
+
+
+class FakeModel(object):
+
+    def __init__(self, keyVarDict):
+        self.keyVarDict = keyVarDict
+
+
+def make_models(temperature=10., sp1='OK'):
+    return {
+        'apo': FakeModel({'airTempPT': [temperature]}),
+        'hartmann': FakeModel({'sp1Residuals': [0, 0, sp1]})
+    }
+
+
+class TestFocusCache(unittest.TestCase):
+
+    def setUp(self):
+        self.focusCache = FocusCache(maxAge=1800, maxTempChange=1.)
+        self.focusCache.record(make_models(), 11, now=1000.)
+
+    def test_record(self):
+        self.assertEqual(self.focusCache.last.temperature, 10.)
+        self.assertEqual(self.focusCache.last.residuals, {'sp1': 'OK'})
+        self.assertEqual(self.focusCache.last.cartridge, 11)
+
+    def test_still_good(self):
+        ok, reason = self.focusCache.check(make_models(10.5), 12, now=2000.)
+        self.assertTrue(ok)
+
+    def test_too_old(self):
+        ok, reason = self.focusCache.check(make_models(), 11, now=3000.)
+        self.assertFalse(ok)
+        self.assertIn('min ago', reason)
+
+    def test_temperature_changed(self):
+        ok, reason = self.focusCache.check(make_models(12.), 11, now=2000.)
+        self.assertFalse(ok)
+        self.assertIn('temperature changed', reason)
+
+    def test_temperature_unknown(self):
+        ok, reason = self.focusCache.check({}, 11, now=2000.)
+        self.assertFalse(ok)
+
+    def test_per_cartridge(self):
+        self.focusCache.perCartridge = True
+        self.assertFalse(self.focusCache.check(make_models(), 12, now=2000.)[0])
+        self.assertTrue(self.focusCache.check(make_models(), 11, now=2000.)[0])
+
+    def test_residuals_not_ok(self):
+        self.focusCache.record(make_models(sp1='move blue ring'), 11, now=1000.)
+        self.assertFalse(self.focusCache.check(make_models(), 11, now=2000.)[0])
+
+    def test_invalidate(self):
+        self.focusCache.invalidate()
+        self.assertFalse(self.focusCache.check(make_models(), 11, now=2000.)[0])
+
+    def test_disabled(self):
+        self.focusCache.maxAge = 0
+        self.assertFalse(self.focusCache.check(make_models(), 11, now=1001.)[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,167 @@
+"""
+Test coalescing, limiting, retrying and timing commands in gateway.py
+"""
+import threading
+import time
+import unittest
+
+import sopTester
+from sopActor.utils.gateway import CommandGateway
+from sopActor.utils.retry import RetryPolicy, Rule
+
+
+class FakeCmdVar(object):
+
+    def __init__(self, didFail=False):
+        self.didFail = didFail
+
+
+class FakeCmdr(object):
+    """Record the commands sent, holding each one until release is set."""
+
+    def __init__(self):
+        self.sent = []
+        self.nFailures = 0  # fail this many flaky commands before succeeding
+        self.release = threading.Event()
+        self.release.set()
+        self.inFlight = 0
+        self.maxInFlight = 0
+        self._lock = threading.Lock()
+
+    def call(self, actor=None, cmdStr=None, **kwargs):
+        with self._lock:
+            self.sent.append((actor, cmdStr))
+            self.inFlight += 1
+            self.maxInFlight = max(self.maxInFlight, self.inFlight)
+        self.release.wait(5)
+        with self._lock:
+            self.inFlight -= 1
+        if cmdStr == 'flaky' and self.nFailures > 0:
+            self.nFailures -= 1
+            return FakeCmdVar(didFail=True)
+        return FakeCmdVar(didFail=cmdStr == 'fail')
+
+    def bgCall(self, callFunc=None, **kwargs):
+        self.sent.append((kwargs.get('actor'), kwargs.get('cmdStr')))
+        callFunc(FakeCmdVar())
+
+
+class TestCommandGateway(sopTester.SopTester, unittest.TestCase):
+
+    def setUp(self):
+        self.verbose = True
+        super(TestCommandGateway, self).setUp()
+        self.cmdr = FakeCmdr()
+        self.actorState.actor.cmdr = self.cmdr
+        self.gateway = CommandGateway(self.actorState, coalesce=[('tcc', 'axis status')])
+        self.metrics = self.actorState.metrics
+
+    def _in_threads(self, n, **kwargs):
+        """Make the same call from n threads at once; return their cmdVars."""
+        cmdVars = []
+        self.cmdr.release.clear()
+        threads = [threading.Thread(target=lambda: cmdVars.append(self.gateway.call(**kwargs)))
+                   for i in range(n)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.2)
+        self.cmdr.release.set()
+        for thread in threads:
+            thread.join(5)
+        return cmdVars
+
+    def test_parse(self):
+        self.assertEqual(
+            CommandGateway.parse_coalesce('tcc axis status, mcp sem.show'),
+            [('tcc', 'axis status'), ('mcp', 'sem.show')])
+        self.assertEqual(CommandGateway.parse_coalesce(''), [])
+        self.assertEqual(CommandGateway.parse_limits('boss:1 guider:2'), {'boss': 1, 'guider': 2})
+        self.assertEqual(CommandGateway.parse_limits(''), {})
+
+    def test_call_metrics(self):
+        self.gateway.call(actor='boss', forUserCmd=self.cmd, cmdStr='exposure science')
+        self.gateway.call(actor='boss', forUserCmd=self.cmd, cmdStr='fail')
+        self.assertEqual(self.metrics.summary('cmdr.boss.exposure')[0], 1)
+        self.assertEqual(self.metrics.count('cmdr.boss.exposure.failed'), 0)
+        self.assertEqual(self.metrics.count('cmdr.boss.fail.failed'), 1)
+
+    def test_coalesce(self):
+        cmdVars = self._in_threads(3, actor='tcc', forUserCmd=self.cmd, cmdStr='axis status')
+        self.assertEqual(self.cmdr.sent, [('tcc', 'axis status')])
+        self.assertEqual(len(cmdVars), 3)
+        self.assertIs(cmdVars[0], cmdVars[2])
+        self.assertEqual(self.metrics.count('cmdr.tcc.axis.coalesced'), 2)
+
+    def test_coalesce_only_in_flight(self):
+        self.gateway.call(actor='tcc', forUserCmd=self.cmd, cmdStr='axis status')
+        self.gateway.call(actor='tcc', forUserCmd=self.cmd, cmdStr='axis status')
+        self.assertEqual(len(self.cmdr.sent), 2)
+
+    def test_not_idempotent(self):
+        self._in_threads(2, actor='tcc', forUserCmd=self.cmd, cmdStr='axis stop')
+        self.assertEqual(len(self.cmdr.sent), 2)
+
+    def test_limit(self):
+        self.gateway.set_limit('boss', 1)
+        self._in_threads(3, actor='boss', forUserCmd=self.cmd, cmdStr='exposure science')
+        self.assertEqual(len(self.cmdr.sent), 3)
+        self.assertEqual(self.cmdr.maxInFlight, 1)
+        self.assertEqual(self.metrics.count('cmdr.boss.exposure.limited'), 2)
+
+    def test_no_limit(self):
+        self._in_threads(3, actor='boss', forUserCmd=self.cmd, cmdStr='exposure science')
+        self.assertEqual(self.cmdr.maxInFlight, 3)
+
+    def _retry(self, *rules):
+        self.gateway.retry = RetryPolicy([Rule(*rule) for rule in rules])
+
+    def test_retry(self):
+        self._retry(('mcp', 'fla*', 2, 0))
+        self.cmdr.nFailures = 2
+        cmdVar = self.gateway.call(actor='mcp', forUserCmd=self.cmd, cmdStr='flaky')
+        self.assertFalse(cmdVar.didFail)
+        self.assertEqual(len(self.cmdr.sent), 3)
+        self.assertEqual(self.metrics.count('cmdr.mcp.flaky.retried'), 2)
+        self._check_cmd(0, 0, 2, 0, False)
+
+    def test_retry_gives_up(self):
+        self._retry(('mcp', 'fla*', 2, 0))
+        self.cmdr.nFailures = 3
+        cmdVar = self.gateway.call(actor='mcp', forUserCmd=self.cmd, cmdStr='flaky')
+        self.assertTrue(cmdVar.didFail)
+        self.assertEqual(len(self.cmdr.sent), 3)
+
+    def test_retry_backoff(self):
+        self._retry(('mcp', 'flaky', 2, 0.1))
+        self.cmdr.nFailures = 2
+        start = time.time()
+        self.gateway.call(actor='mcp', forUserCmd=self.cmd, cmdStr='flaky')
+        self.assertGreaterEqual(time.time() - start, 0.3)
+
+    def test_never_retry(self):
+        self._retry(('mcp', 'flaky', 0, 0), ('mcp', '*', 2, 0))
+        self.cmdr.nFailures = 1
+        self.assertTrue(self.gateway.call(actor='mcp', forUserCmd=self.cmd, cmdStr='flaky').didFail)
+        self.assertEqual(len(self.cmdr.sent), 1)
+
+    def test_no_retry_when_asked(self):
+        self._retry(('mcp', 'flaky', 2, 0))
+        self.cmdr.nFailures = 1
+        cmdVar = self.gateway.call(actor='mcp', forUserCmd=self.cmd, cmdStr='flaky', retry=False)
+        self.assertTrue(cmdVar.didFail)
+
+    def test_no_retry_when_aborting(self):
+        self._retry(('mcp', 'flaky', 2, 0))
+        self.cmdr.nFailures = 1
+        self.actorState.aborting = True
+        self.assertTrue(self.gateway.call(actor='mcp', forUserCmd=self.cmd, cmdStr='flaky').didFail)
+
+    def test_bgCall(self):
+        replies = []
+        self.gateway.bgCall(callFunc=replies.append, actor='mcp', cmdStr='wht.on')
+        self.assertEqual(len(replies), 1)
+        self.assertEqual(self.metrics.summary('cmdr.mcp.wht.on')[0], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
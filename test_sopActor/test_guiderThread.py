@@ -1,6 +1,7 @@
 """
 Test the functions in guiderThread.
 """
+import threading
 import unittest
 
 import sopActor
@@ -83,6 +84,59 @@ class TestGuiderMethods(GuiderThreadTester):
         self.cmd.failOn = 'guider mangaDither ditherPos=E'
         self._manga_dither(1, 1, 0, 1, 'E', didFail=True)
 
+    def _dither_transition(self, nCall, nInfo, nWarn, nErr, dither, didFail=False):
+        success = guiderThread.dither_transition(self.cmd, myGlobals.actorState, dither)
+        self.assertEqual(success, not didFail)
+        self._check_cmd(nCall, nInfo, nWarn, nErr, False, didFail)
+
+    def test_dither_transition_N(self):
+        self._dither_transition(2, 2, 0, 0, 'N')
+        self.assertEqual(len(myGlobals.actorState.metrics.get('ditherTransition')), 1)
+
+    def test_dither_transition_already_there(self):
+        sopTester.updateModel('guider', TestHelper.guiderState['mangaDitherLoaded'])
+        guiderModel = myGlobals.actorState.models['guider'].keyVarDict
+        guiderModel['decenter'].set([1, True])
+        dither = guiderModel['mangaDither'][0]
+        self._dither_transition(0, 1, 0, 0, dither)
+        self.assertEqual(myGlobals.actorState.metrics.count('ditherTransition.skipped'), 1)
+
+    def test_dither_transition_fails(self):
+        self.cmd.failOn = 'guider mangaDither ditherPos=E'
+        self._dither_transition(2, 1, 0, 1, 'E', didFail=True)
+
+    def test_dither_transition_decenter_fails(self):
+        self.cmd.failOn = 'guider decenter on'
+        self._dither_transition(1, 1, 0, 1, 'E', didFail=True)
+
+    def test_dither_transition_keywords_first(self):
+        """The transition completes when the keywords confirm, before mangaDither returns."""
+        actorState = myGlobals.actorState
+        guiderModel = actorState.models['guider'].keyVarDict
+        gatewayCall = actorState.gateway.call
+        release = threading.Event()
+        returned = threading.Event()
+
+        def slow_call(**kwargs):
+            if kwargs['cmdStr'].startswith('mangaDither'):
+                guiderModel['decenter'].set([1, True])
+                guiderModel['mangaDither'].set(['E'])
+                release.wait(5)
+            try:
+                return gatewayCall(**kwargs)
+            finally:
+                returned.set()
+
+        actorState.gateway.call = slow_call
+        self.assertTrue(guiderThread.dither_transition(self.cmd, actorState, 'E', timeLim=5))
+        self.assertEqual(len(actorState.metrics.get('ditherTransition')), 1)
+        # only decenter on has returned: mangaDither is still running.
+        self.assertEqual(self.cmd.calls, ['guider decenter on'])
+        returned.clear()
+        release.set()
+        returned.wait(5)
+        self._check_cmd(2, 2, 0, 0, False)
+
 
 if __name__ == '__main__':
     verbosity = 1
@@ -0,0 +1,63 @@
+"""
+Test the arc lamp warm-up model in lampflux.py
+"""
+import math
+import unittest
+
+from sopActor.utils.lampflux import LampFluxModel
+
+
+class TestLampFluxModel(unittest.TestCase):
+
+    def setUp(self):
+        self.model = LampFluxModel('HgCd', f0=0.5, tau=10., minFlux=0.75)
+
+    def test_flux(self):
+        self.assertEqual(self.model.flux(0), 0.5)
+        self.assertAlmostEqual(self.model.flux(10), 1 - 0.5 * math.exp(-1))
+        self.assertAlmostEqual(self.model.flux(1000), 1)
+
+    def test_ready_time(self):
+        self.assertAlmostEqual(self.model.ready_time(), 10 * math.log(2))
+        self.assertAlmostEqual(self.model.flux(self.model.ready_time()), 0.75)
+
+    def test_ready_time_no_partial(self):
+        self.model.minFlux = 1
+        self.assertEqual(self.model.ready_time(), float('inf'))
+
+    def test_ready_time_already_bright(self):
+        self.model.minFlux = 0.4
+        self.assertEqual(self.model.ready_time(), 0)
+
+    def test_counts(self):
+        self.assertAlmostEqual(self.model.counts(1000, 4), 4)
+        self.assertAlmostEqual(self.model.counts(0, 10), 10 - 0.5 * 10 * (1 - math.exp(-1)))
+
+    def test_scaled_exposure(self):
+        scaled = self.model.scaled_exposure(self.model.ready_time(), 4)
+        self.assertGreater(scaled, 4)
+        self.assertLess(scaled, 4 / 0.75)
+        self.assertAlmostEqual(self.model.counts(self.model.ready_time(), scaled), 4, places=1)
+
+    def test_scaled_exposure_warm(self):
+        self.assertAlmostEqual(self.model.scaled_exposure(1000, 4), 4, places=2)
+
+    def test_fit(self):
+        samples = [(t, self.model.flux(t)) for t in (0, 5, 10, 20, 30)]
+        samples.append((100, 1.0))
+        model = LampFluxModel.fit('HgCd', samples, minFlux=0.75)
+        self.assertAlmostEqual(model.f0, 0.5)
+        self.assertAlmostEqual(model.tau, 10.)
+        self.assertEqual(model.minFlux, 0.75)
+
+    def test_fit_too_few(self):
+        with self.assertRaises(ValueError):
+            LampFluxModel.fit('HgCd', [(0, 0.5), (100, 1.0)])
+
+    def test_fit_not_warming(self):
+        with self.assertRaises(ValueError):
+            LampFluxModel.fit('HgCd', [(0, 0.9), (100, 0.5)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+"""
+Test the lamp warm-state tracker in lampstate.py
+"""
+import math
+import unittest
+
+from sopActor.utils.lampstate import LampStateTracker
+
+
+class FakeKeyVar(list):
+
+    def __init__(self, values, timestamp):
+        list.__init__(self, values)
+        self.timestamp = timestamp
+
+
+class TestLampStateTracker(unittest.TestCase):
+
+    def setUp(self):
+        self.tracker = LampStateTracker(coolingTime=60.)
+
+    def test_unknown(self):
+        self.assertFalse(self.tracker.known('HgCd'))
+        self.assertFalse(self.tracker.is_on('HgCd'))
+        self.assertEqual(self.tracker.warmth('HgCd', 100), 0)
+
+    def test_warmth_on(self):
+        self.tracker.update('HgCd', True, 100)
+        self.assertTrue(self.tracker.is_on('HgCd'))
+        self.assertEqual(self.tracker.warmth('HgCd', 130), 30)
+
+    def test_only_transitions(self):
+        self.tracker.update('HgCd', True, 100)
+        self.tracker.update('HgCd', True, 150)
+        self.assertEqual(self.tracker.warmth('HgCd', 160), 60)
+
+    def test_cooling(self):
+        self.tracker.update('HgCd', True, 0)
+        self.tracker.update('HgCd', False, 120)
+        self.assertAlmostEqual(self.tracker.warmth('HgCd', 180), 120 * math.exp(-1))
+        self.tracker.update('HgCd', True, 180)
+        self.assertAlmostEqual(self.tracker.warmth('HgCd', 190), 120 * math.exp(-1) + 10)
+
+    def test_no_cooling_time(self):
+        self.tracker.coolingTime = 0
+        self.tracker.update('HgCd', True, 0)
+        self.tracker.update('HgCd', False, 120)
+        self.assertEqual(self.tracker.warmth('HgCd', 121), 0)
+
+    def test_warmth_capped(self):
+        self.tracker.warmupTimes = {'HgCd': 120}
+        self.tracker.update('HgCd', True, 0)
+        self.assertEqual(self.tracker.warmth('HgCd', 600), 120)
+        self.tracker.update('HgCd', False, 600)
+        self.assertAlmostEqual(self.tracker.warmth('HgCd', 660), 120 * math.exp(-1))
+
+    def test_warm_at(self):
+        self.tracker.update('HgCd', True, 100)
+        self.assertFalse(self.tracker.warm_at('HgCd', 200, 120))
+        self.assertTrue(self.tracker.warm_at('HgCd', 220, 120))
+        self.assertEqual(self.tracker.time_until_warm('HgCd', 120, 200), 20)
+
+    def test_turn_on_time(self):
+        self.assertAlmostEqual(self.tracker.turn_on_time('HgCd', 1000, 120, now=0), 880, delta=0.1)
+        self.assertEqual(self.tracker.turn_on_time('HgCd', 100, 120, now=0), 0)
+
+    def test_turn_on_time_warm(self):
+        self.tracker.update('HgCd', True, 0)
+        self.tracker.update('HgCd', False, 120)
+        turnOn = self.tracker.turn_on_time('HgCd', 200, 120, now=120)
+        self.assertGreater(turnOn, 120)
+        self.assertAlmostEqual(200 - turnOn + self.tracker.warmth('HgCd', turnOn), 120, delta=0.2)
+
+    def test_hint_cleared_on(self):
+        self.tracker.hint('HgCd', 500)
+        self.assertEqual(self.tracker.hints['HgCd'], 500)
+        self.tracker.update('HgCd', True, 400)
+        self.assertNotIn('HgCd', self.tracker.hints)
+
+    def test_keyVarChanged(self):
+        self.tracker.keyVarChanged('HgCd', FakeKeyVar([1, 1, 1, 1], 100))
+        self.assertTrue(self.tracker.is_on('HgCd'))
+        self.tracker.keyVarChanged('HgCd', FakeKeyVar([1, 0, 1, 1], 110))
+        self.assertFalse(self.tracker.is_on('HgCd'))
+
+    def test_keyVarChanged_unknown(self):
+        self.tracker.keyVarChanged('HgCd', FakeKeyVar([None], 100))
+        self.assertFalse(self.tracker.known('HgCd'))
+
+
+if __name__ == '__main__':
+    unittest.main()
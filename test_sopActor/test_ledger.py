@@ -0,0 +1,77 @@
+"""
+Test the persistent sop ledger in ledger.py
+"""
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from sopActor.utils.ledger import Ledger
+
+
+class TestLedger(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, 'sop', 'ledger.sqlite')
+        self.ledger = Ledger(self.path)
+        self.ledger.start()
+
+    def tearDown(self):
+        self.ledger.stop()
+        shutil.rmtree(self.tempdir)
+
+    def test_disabled(self):
+        ledger = Ledger()
+        ledger.start()
+        ledger.record('command', 'gotoField', 0, 1, True)
+        ledger.flush()
+        self.assertFalse(ledger.enabled)
+        self.assertEqual(ledger.recent(), [])
+
+    def test_record(self):
+        self.ledger.record('msg', 'EXPOSE', 10, 40, True, 'boss', cartridge=11, survey='MANGA',
+                           params={'expTime': 30, 'expType': 'flat'})
+        self.ledger.flush()
+        entry, = self.ledger.recent()
+        self.assertEqual(entry.kind, 'msg')
+        self.assertEqual(entry.thread, 'boss')
+        self.assertEqual(entry.end - entry.start, 30)
+        self.assertEqual(entry.success, 1)
+        self.assertEqual(entry.params, '{"expTime": 30, "expType": "flat"}')
+
+    def test_recent_order_and_filters(self):
+        for i in range(5):
+            self.ledger.record('command' if i % 2 else 'stage', 'cmd%d' % i, i, i + 1,
+                               cartridge=10 + i % 2)
+        self.ledger.flush()
+        self.assertEqual([e.name for e in self.ledger.recent(2)], ['cmd4', 'cmd3'])
+        self.assertEqual([e.name for e in self.ledger.recent(cartridge=11)], ['cmd3', 'cmd1'])
+        self.assertEqual([e.name for e in self.ledger.recent(kind='stage')],
+                         ['cmd4', 'cmd2', 'cmd0'])
+
+    def test_batches(self):
+        self.ledger.batchSize = 7
+        for i in range(20):
+            self.ledger.record('msg', 'STATUS', i, i)
+        self.ledger.flush()
+        self.assertEqual(len(self.ledger.recent(100)), 20)
+
+    def test_survives_restart(self):
+        self.ledger.record('command', 'doBossCalibs', 0, 1, False)
+        self.ledger.stop()
+        self.ledger = Ledger(self.path)
+        self.ledger.start()
+        self.assertEqual(self.ledger.recent()[0].name, 'doBossCalibs')
+
+    def test_indexes(self):
+        conn = sqlite3.connect(self.path)
+        indexes = [row[1] for row in conn.execute("SELECT * FROM sqlite_master WHERE type='index'")]
+        conn.close()
+        self.assertIn('ledger_start', indexes)
+        self.assertIn('ledger_cartridge', indexes)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -9,6 +9,7 @@ Particularly bad in this regard are the do_boss_calibs tests.
 
 import multiprocessing as multi
 import threading
+import time
 import unittest
 
 import sopActor
@@ -19,12 +20,19 @@ from actorcore import TestHelper
 from sopActor import (apogeeThread, bossThread, ffsThread, guiderThread,
                       lampThreads, masterThread, tccThread)
 from sopActor.multiCommand import MultiCommand
+from sopActor.utils.calibrations import CalibrationRegistry
 
 
 # False for less printing, True for more printing
 verbose = True
 
 
+class FakeModel(object):
+
+    def __init__(self, keyVarDict):
+        self.keyVarDict = keyVarDict
+
+
 class MasterThreadTester(sopTester.SopThreadTester, unittest.TestCase):
     """
     Tests for the various functions in sop masterThread, that were
@@ -244,11 +252,22 @@ class TestGotoField(MasterThreadTester):
         masterThread.goto_field_boss(self.cmd, cmdState, myGlobals.actorState, self.timeout)
         self._check_cmd(nCall, nInfo, nWarn, nErr, finish, didFail)
 
+    def _set_field(self):
+        """Put us on a known field, so the calibrations are recorded."""
+        self.actorState.models['platedb'] = FakeModel({'pointingInfo': [7000, 11, 'A', 10., 20.]})
+        return (7000, 11, 'A')
+
+    def _recorded_calibs(self, field):
+        return sorted(key[0] for key in self.actorState.calibrations.calibrations
+                      if key[1] == field)
+
     def test_goto_field_boss_all(self):
         sopTester.updateModel('mcp', TestHelper.mcpState['all_off'])
+        field = self._set_field()
         cmdState = self.actorState.gotoField
         cmdState.reinitialize(self.cmd)
-        self._goto_field_boss(26, 105, 0, 0, cmdState)
+        self._goto_field_boss(26, 107, 0, 0, cmdState)
+        self.assertEqual(self._recorded_calibs(field), ['arc', 'flat'])
 
     def test_goto_field_boss_slew(self):
         """
@@ -278,6 +297,88 @@ class TestGotoField(MasterThreadTester):
         cmdState.doGuider = False
         self._goto_field_boss(5, 29, 0, 0, cmdState)
 
+    def _hartmann_still_good(self, expect, nInfo, temperature=10.):
+        focusCache = self.actorState.focusCache
+        focusCache.maxAge = 1800
+        focusCache.temperature = lambda models: temperature
+        focusCache.record(self.actorState.models, 11)
+        cmdState = self.actorState.gotoField
+        cmdState.reinitialize(self.cmd, output=False)
+        result = masterThread.hartmann_still_good(self.cmd, cmdState, myGlobals.actorState)
+        self.assertEqual(result, expect)
+        self._check_cmd(0, nInfo, 0, 0, False)
+
+    def test_hartmann_still_good(self):
+        self._hartmann_still_good(True, 3)
+        self.assertEqual(self.actorState.gotoField.stages['hartmann'], 'done')
+
+    def test_hartmann_still_good_residuals_bad(self):
+        sopTester.updateModel('hartmann', TestHelper.hartmannState['blue_fails'])
+        self._hartmann_still_good(False, 1)
+
+    def test_hartmann_still_good_disabled(self):
+        self.actorState.focusCache.maxAge = 0
+        cmdState = self.actorState.gotoField
+        self.assertFalse(masterThread.hartmann_still_good(self.cmd, cmdState, myGlobals.actorState))
+        self._check_cmd(0, 0, 0, 0, False)
+
+    def test_hint_arc_lamps(self):
+        lampState = self.actorState.lampState
+        masterThread.hint_arc_lamps(self.cmd, myGlobals.actorState, time.time() + 60)
+        self._check_cmd(0, 2, 0, 0, False)
+        self.assertIn(sopActor.HGCD_LAMP, lampState.hints)
+        lampState.update(sopActor.HGCD_LAMP, True)
+        self.assertNotIn(sopActor.HGCD_LAMP, lampState.hints)
+        self.assertIn(sopActor.NE_LAMP, lampState.hints)
+
+    def _arc_lamp_delay(self):
+        precondition = masterThread.SopPrecondition(
+            sopActor.HGCD_LAMP, sopActor.Msg.LAMP_ON, on=True)
+        self.assertTrue(precondition.required())
+        return precondition.kwargs['delay']
+
+    def test_arc_lamp_delay_cold(self):
+        self.actorState.lampState.update(sopActor.HGCD_LAMP, False, time.time() - 3600)
+        self.assertEqual(self._arc_lamp_delay(), myGlobals.warmupTime[sopActor.HGCD_LAMP])
+
+    def test_arc_lamp_delay_relit(self):
+        """A lamp turned off a moment ago needs less warm-up than a cold one."""
+        lampState = self.actorState.lampState
+        lampState.coolingTime = 60
+        now = time.time()
+        lampState.update(sopActor.HGCD_LAMP, True, now - 5)
+        lampState.update(sopActor.HGCD_LAMP, False, now - 1)
+        self.assertEqual(self._arc_lamp_delay(), myGlobals.warmupTime[sopActor.HGCD_LAMP] - 4)
+
+    def _reuse_calibs(self, recorded, nInfo, forceCalibs=False):
+        calibrations = self.actorState.calibrations
+        calibrations.maxAge = 3600
+        field = CalibrationRegistry.field(self.actorState.models)
+        cmdState = self.actorState.gotoField
+        cmdState.reinitialize(self.cmd, output=False)
+        cmdState.forceCalibs = forceCalibs
+        for expType in recorded:
+            calibrations.record(expType, getattr(cmdState, expType + 'Time'), field)
+        masterThread.reuse_calibs(self.cmd, cmdState, myGlobals.actorState, field)
+        self._check_cmd(0, nInfo, 0, 0, False)
+        return cmdState
+
+    def test_reuse_calibs_arc(self):
+        cmdState = self._reuse_calibs(['arc'], 1)
+        self.assertEqual(cmdState.arcTime, 0)
+        self.assertEqual(cmdState.flatTime, 25)
+        self.assertTrue(cmdState.doCalibs)
+
+    def test_reuse_calibs_all(self):
+        cmdState = self._reuse_calibs(['arc', 'flat'], 3)
+        self.assertFalse(cmdState.doCalibs)
+        self.assertEqual(cmdState.stages['calibs'], 'done')
+
+    def test_reuse_calibs_forced(self):
+        cmdState = self._reuse_calibs(['arc', 'flat'], 0, forceCalibs=True)
+        self.assertEqual(cmdState.arcTime, 4)
+        self.assertTrue(cmdState.doCalibs)
+
     def test_goto_field_boss_hartmann_ffs_bypassed(self):
 
         self._prep_bypass('ffs', clear=True)
@@ -322,12 +423,14 @@ class TestGotoField(MasterThreadTester):
         self._goto_field_boss(9, 37, 0, 0, cmdState)
 
     def test_goto_field_boss_flat_on_fails(self):
-        """Fail on ff.on, but still readout the arc."""
+        """Fail on ff.on, but still readout the arc (which is not recorded)."""
         sopTester.updateModel('mcp', TestHelper.mcpState['all_off'])
+        field = self._set_field()
         cmdState = self.actorState.gotoField
         cmdState.reinitialize(self.cmd)
         self.cmd.failOn = 'mcp ff.on'
-        self._goto_field_boss(16, 71, 0, 1, cmdState, didFail=True, finish=True)
+        self._goto_field_boss(16, 73, 0, 1, cmdState, didFail=True, finish=True)
+        self.assertEqual(self._recorded_calibs(field), [])
 
     def test_goto_field_boss_ne_on_fails(self):
         """Fail on ne.on."""
@@ -335,7 +438,7 @@ class TestGotoField(MasterThreadTester):
         cmdState = self.actorState.gotoField
         cmdState.reinitialize(self.cmd)
         self.cmd.failOn = 'mcp ne.on'
-        self._goto_field_boss(6, 15, 0, 1, cmdState, didFail=True, finish=True)
+        self._goto_field_boss(6, 17, 0, 1, cmdState, didFail=True, finish=True)
 
     def test_goto_field_boss_hartmann_fails(self):
         """Fail on hartmann."""
@@ -347,7 +450,7 @@ class TestGotoField(MasterThreadTester):
         # Should produce 0 errors, but the failure usually (not always!)
         # cascades through to hgcd lampThread.
         # I'm pretty sure that's not correct.
-        self._goto_field_boss(9, 34, 0, 1, cmdState, didFail=True, finish=True)
+        self._goto_field_boss(9, 36, 0, 1, cmdState, didFail=True, finish=True)
 
     def test_goto_field_boss_hartmann_blue_fails(self):
         """Hartmann succeeds but the blue ring move is out of tolerance."""
@@ -358,7 +461,7 @@ class TestGotoField(MasterThreadTester):
         cmdState = self.actorState.gotoField
         cmdState.reinitialize(self.cmd)
 
-        self._goto_field_boss(12, 37, 0, 0, cmdState, didFail=True, finish=True)
+        self._goto_field_boss(12, 39, 0, 0, cmdState, didFail=True, finish=True)
 
     def test_goto_field_boss_ffs_open_fails(self):
         """Fail on ffs.open, but still readout flat."""
@@ -366,7 +469,7 @@ class TestGotoField(MasterThreadTester):
         cmdState = self.actorState.gotoField
         cmdState.reinitialize(self.cmd)
         self.cmd.failOn = 'mcp ffs.open'
-        self._goto_field_boss(21, 102, 1, 1, cmdState, didFail=True, finish=True)
+        self._goto_field_boss(21, 104, 1, 1, cmdState, didFail=True, finish=True)
 
     def _goto_field_apogeemanga(self,
                                 nCall,
@@ -386,14 +489,14 @@ class TestGotoField(MasterThreadTester):
         sopTester.updateModel('mcp', TestHelper.mcpState['all_off'])
         cmdState = self.actorState.gotoField
         cmdState.reinitialize(self.cmd)
-        self._goto_field_apogeemanga(26, 105, 0, 0, cmdState)
+        self._goto_field_apogeemanga(26, 107, 0, 0, cmdState)
 
     def test_goto_field_apogeemanga_all_shutter_open(self):
         sopTester.updateModel('mcp', TestHelper.mcpState['apogee_parked'])
         sopTester.updateModel('apogee', TestHelper.apogeeState['B_open'])
         cmdState = self.actorState.gotoField
         cmdState.reinitialize(self.cmd)
-        self._goto_field_apogeemanga(27, 112, 0, 0, cmdState)
+        self._goto_field_apogeemanga(27, 114, 0, 0, cmdState)
 
     def test_goto_field_apogeemanga_apogee_lead_hartmann_out_of_focus(self):
         sopTester.updateModel('mcp', TestHelper.mcpState['all_off'])
@@ -401,7 +504,7 @@ class TestGotoField(MasterThreadTester):
         cmdState = self.actorState.gotoField
         cmdState.reinitialize(self.cmd)
         self._goto_field_apogeemanga(
-            12, 37, 0, 0, cmdState, didFail=True, finish=True, surveyMode=sopActor.APOGEELEAD)
+            12, 39, 0, 0, cmdState, didFail=True, finish=True, surveyMode=sopActor.APOGEELEAD)
 
     def test_goto_field_cartridge_mismatch(self):
         """Tests gotoField if there is a mismatch between MCP and guider."""
@@ -1435,7 +1538,7 @@ class TestBossCalibs(MasterThreadTester):
         cmdState = CmdState.DoBossCalibsCmd()
         self.cmd.failOn = 'boss exposure   readout'
         cmdState.nFlat = 2
-        self._do_boss_calibs(7, 40, 0, 1, cmdState, didFail=True)
+        self._do_boss_calibs(8, 44, 0, 1, cmdState, didFail=True)
         self.assertFalse(cmdState.isSlewingDisabled())
 
     def test_do_boss_calibs_two_arc_fail_on_second_exposure(self):
@@ -1447,6 +1550,145 @@ class TestBossCalibs(MasterThreadTester):
         self.assertFalse(cmdState.isSlewingDisabled())
 
 
+class TestDitheredFlat(MasterThreadTester):
+    """dithered_flat tests"""
+
+    def _dithered_flat(self, nCall, nInfo, nWarn, nErr, didFail=False):
+        cmdState = self.actorState.ditheredFlat
+        cmdState.reinitialize(self.cmd)
+        cmdState.nStep = 3
+        cmdState.nTick = 10
+        masterThread.dithered_flat(self.cmd, cmdState, myGlobals.actorState)
+        self._check_cmd(nCall, nInfo, nWarn, nErr, True, didFail=didFail)
+        return cmdState
+
+    def _check_stages(self, cmdState, lamps, flats, cleanup):
+        self.assertEqual(cmdState.stages, {'lamps': lamps, 'flats': flats, 'cleanup': cleanup})
+
+    def test_dithered_flat(self):
+        """
+        lamps on, 3x (collimators move, flat noreadout, with the readout during
+        the next move), then readout, collimators back and lamps off together.
+        """
+        sopTester.updateModel('mcp', TestHelper.mcpState['all_off'])
+        cmdState = self._dithered_flat(17, 66, 0, 0)
+        self.assertEqual(cmdState.nFlatDone, 3)
+        self.assertEqual(cmdState.cmdState, 'done')
+        self._check_stages(cmdState, 'done', 'done', 'done')
+
+    def test_dithered_flat_move_fails(self):
+        """We don't know where the collimators are: don't move them back."""
+        sopTester.updateModel('mcp', TestHelper.mcpState['all_off'])
+        self.cmd.failOn = 'boss moveColl spec=sp1 a=10 b=10 c=-10'
+        cmdState = self._dithered_flat(8, 29, 1, 0, didFail=True)
+        self.assertEqual(cmdState.nFlatDone, 0)
+        self.assertEqual(cmdState.cmdState, 'failed')
+        self._check_stages(cmdState, 'done', 'failed', 'done')
+
+    def test_dithered_flat_expose_fails(self):
+        """Readout the failed flat and move the collimators back."""
+        sopTester.updateModel('mcp', TestHelper.mcpState['all_off'])
+        self.cmd.failOn = 'boss exposure flat itime=30 noreadout'
+        cmdState = self._dithered_flat(12, 36, 0, 1, didFail=True)
+        self.assertEqual(cmdState.nFlatDone, 0)
+        self.assertEqual(cmdState.cmdState, 'failed')
+        self._check_stages(cmdState, 'done', 'failed', 'done')
+
+    def test_dithered_flat_abort(self):
+        """Abort during the first flat: still readout, move back and turn off the lamps."""
+        sopTester.updateModel('mcp', TestHelper.mcpState['all_off'])
+        cmdState = self.actorState.ditheredFlat
+
+        def abort_flats():
+            cmdState.abort()
+
+        self.cmd.runOn = ('boss exposure flat itime=30 noreadout', abort_flats)
+        self.cmd.runOnCount = 1
+        cmdState = self._dithered_flat(12, 40, 2, 0, didFail=True)
+        self.assertEqual(cmdState.nFlatDone, 1)
+        self.assertEqual(cmdState.cmdState, 'aborted')
+        self._check_stages(cmdState, 'done', 'aborted', 'done')
+
+    def test_prep_collimator_move(self):
+        multiCmd = masterThread.SopMultiCommand(self.cmd, 10, 'ditheredFlat.move')
+        masterThread.prep_collimator_move(multiCmd, ['sp1', 'sp2'], -62)
+        moves = [(msg.type, msg.spec, msg.a, msg.b, msg.c)
+                 for queue, isPrecondition, msg in multiCmd.commands]
+        self.assertEqual(moves, [(sopActor.Msg.MOVE_COLLIMATOR, 'sp1', -62, -62, 62),
+                                 (sopActor.Msg.MOVE_COLLIMATOR, 'sp2', -62, -62, 62)])
+        self.assertEqual(multiCmd.commands[0][2].duration, masterThread.collimatorDuration)
+
+
+class TestBossExposureLedger(MasterThreadTester):
+    """Tests of the BOSS readout bookkeeping, without running the commands."""
+
+    def setUp(self):
+        super(TestBossExposureLedger, self).setUp()
+        cmdState = self.actorState.doBossCalibs
+        cmdState.reinitialize(self.cmd)
+        self.ledger = masterThread.BossExposureLedger(self.cmd, cmdState, self.actorState)
+
+    def _multiCmd(self):
+        return masterThread.SopMultiCommand(self.cmd, 10, 'ledger')
+
+    def _readouts(self, multiCmd):
+        return [msg.readout for queue, isPrecondition, msg in multiCmd.commands]
+
+    def test_expose_readout(self):
+        multiCmd = self._multiCmd()
+        self.ledger.expose(multiCmd, 0.0, 'bias', readout=True)
+        self.assertFalse(self.ledger.pending)
+        self.assertEqual(multiCmd.timeout, 10)
+
+    def test_expose_noreadout(self):
+        multiCmd = self._multiCmd()
+        self.ledger.expose(multiCmd, 30, 'flat', readout=False)
+        self.assertTrue(self.ledger.pending)
+        self.assertEqual(self._readouts(multiCmd), [False])
+
+    def test_expose_twice_pairs_readout(self):
+        multiCmd = self._multiCmd()
+        self.ledger.expose(multiCmd, 900, 'science', readout=False)
+        self.ledger.expose(multiCmd, 900, 'science', readout=False)
+        self.assertEqual(self._readouts(multiCmd), [False, True, False])
+        self.assertEqual(multiCmd.timeout, 10 + masterThread.readoutDuration)
+        self.assertEqual(self.ledger.unread, ['science'])
+
+    def test_overlap(self):
+        self.ledger.expose(self._multiCmd(), 4, 'arc', readout=False)
+        multiCmd = self.ledger.overlap(10, 'ledger.readout')
+        self.assertEqual(self._readouts(multiCmd), [True])
+        self.assertEqual(multiCmd.timeout, 10 + masterThread.readoutDuration)
+        self.assertFalse(self.ledger.pending)
+
+    def test_overlap_nothing_pending(self):
+        multiCmd = self.ledger.overlap(10, 'ledger.readout')
+        self.assertEqual(multiCmd.commands, [])
+        self.assertEqual(multiCmd.timeout, 10)
+
+    def test_cleanup_nothing_pending(self):
+        self.assertTrue(self.ledger.cleanup('ledger.cleanup'))
+        self.assertEqual(self.cmd.calls, [])
+
+    def test_overlap_succeeds(self):
+        self.ledger.expose(self._multiCmd(), 4, 'arc', readout=False)
+        self.assertTrue(self.ledger.overlap(10, 'ledger.readout').run())
+        self.assertFalse(self.ledger.pending)
+        self.assertTrue(self.ledger.cleanup('ledger.cleanup'))
+        self.assertEqual(self.cmd.calls, ['boss exposure   readout'])
+
+    def test_cleanup_after_failed_readout(self):
+        """A readout that failed leaves the exposure unread, so cleanup reads it out."""
+        self.ledger.expose(self._multiCmd(), 4, 'arc', readout=False)
+        self.cmd.failOn = 'boss exposure   readout'
+        self.assertFalse(self.ledger.overlap(10, 'ledger.readout').run())
+        self.assertEqual(self.ledger.unread, ['arc'])
+        self.cmd.failOn = None
+        self.assertTrue(self.ledger.cleanup('ledger.cleanup'))
+        self.assertEqual(self.cmd.calls, ['boss exposure   readout', 'boss exposure   readout'])
+        self.assertFalse(self.ledger.pending)
+
+
 if __name__ == '__main__':
     verbosity = 1
     if verbose:
@@ -0,0 +1,56 @@
+"""
+Test the timing and counter accumulator in metrics.py
+"""
+import unittest
+
+from sopActor.utils.metrics import Metrics
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = Metrics()
+
+    def test_record(self):
+        self.metrics.record('slew', 10)
+        self.metrics.record('slew', 20)
+        self.assertEqual(self.metrics.get('slew'), [10., 20.])
+        self.assertEqual(self.metrics.last('slew'), 20.)
+        self.assertEqual(self.metrics.mean('slew'), 15.)
+        self.assertEqual(self.metrics.summary('slew'), (2, 15., 10., 20.))
+
+    def test_empty(self):
+        self.assertEqual(self.metrics.get('nothing'), [])
+        self.assertIsNone(self.metrics.last('nothing'))
+        self.assertEqual(self.metrics.mean('nothing', 3), 3)
+        self.assertEqual(self.metrics.summary('nothing'), (0, 0., 0., 0.))
+
+    def test_max_samples(self):
+        for i in range(Metrics.maxSamples + 10):
+            self.metrics.record('readout', i)
+        samples = self.metrics.get('readout')
+        self.assertEqual(len(samples), Metrics.maxSamples)
+        self.assertEqual(samples[0], 10.)
+
+    def test_increment(self):
+        self.metrics.increment('retries')
+        self.metrics.increment('retries', 2)
+        self.assertEqual(self.metrics.count('retries'), 3)
+        self.assertEqual(self.metrics.count('nothing'), 0)
+
+    def test_histogram(self):
+        for value in (-1, 0, 0.5, 1, 2, 5):
+            self.metrics.record('latency', value)
+        self.assertEqual(self.metrics.histogram('latency', [0, 1, 2]), [1, 2, 1, 2])
+        self.assertEqual(self.metrics.histogram('nothing', [0, 1]), [0, 0, 0])
+
+    def test_reset(self):
+        self.metrics.record('slew', 10)
+        self.metrics.increment('retries')
+        self.metrics.reset()
+        self.assertEqual(self.metrics.get('slew'), [])
+        self.assertEqual(self.metrics.count('retries'), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+"""
+Test the observing plan and its etr in nightplan.py
+"""
+import unittest
+
+import sopTester
+from sopActor.utils.nightplan import ObservingPlan
+
+# The default gotoField slew, hartmann, calibs, guider and cleanup times.
+gotoFieldTime = 180 + 150 + 240 + 120 + 30
+
+
+class TestObservingPlan(sopTester.SopTester, unittest.TestCase):
+
+    def setUp(self):
+        self.verbose = True
+        super(TestObservingPlan, self).setUp()
+        self.plan = self.actorState.plan
+        self.plan.enabled = True
+        self.metrics = self.actorState.metrics
+
+    def _load(self, survey, surveyMode=None):
+        self._update_cart(11, survey, surveyMode)
+        self.now = self.plan.loadTime
+
+    def test_parse_times(self):
+        self.assertEqual(ObservingPlan.parse_times('gotoField.slew:180 doBossCalibs:600.5'),
+                         {'gotoField.slew': 180., 'doBossCalibs': 600.5})
+
+    def test_commands(self):
+        self._load('eBOSS')
+        self.assertEqual(self.plan.commands(), ['gotoField', 'doBossScience'])
+        self._load('APOGEE-2&MaNGA', 'APOGEE lead')
+        self.assertEqual(self.plan.commands(), ['gotoField', 'doApogeeMangaSequence'])
+
+    def test_commands_mastar(self):
+        self._load('MaNGA', 'MaStar')
+        self.assertEqual(self.plan.commands(), ['gotoField', 'doMangaSequence', 'doBossCalibs'])
+
+    def test_commands_queued(self):
+        self._load('eBOSS')
+        self.actorState.commandQueue.add('doBossScience nexp=2')
+        self.actorState.commandQueue.add('gotoStow')
+        self.assertEqual(self.plan.commands(), ['gotoField', 'doBossScience', 'gotoStow'])
+
+    def test_etr_boss(self):
+        self._load('eBOSS')
+        self.actorState.doBossScience.nExp = 2
+        expected = gotoFieldTime + 2 * (900 + 60)
+        self.assertAlmostEqual(self.plan.etr(self.now), expected)
+
+    def test_etr_measured(self):
+        self._load('eBOSS')
+        self.metrics.record('stage.gotoField.slew', 60)
+        self.metrics.record('boss.exposure', 1000)
+        expected = gotoFieldTime - 180 + 60 + 1000
+        self.assertAlmostEqual(self.plan.etr(self.now), expected)
+
+    def test_etr_sequence(self):
+        self._load('MaNGA', 'MaNGA dither')
+        etr = self.actorState.doMangaSequence.keywords['etr']
+        self.assertAlmostEqual(self.plan.etr(self.now), gotoFieldTime + etr * 60)
+
+    def test_etr_running_stage(self):
+        self._load('eBOSS')
+        gotoField = self.actorState.gotoField
+        gotoField.setStageState('slew', 'done')
+        gotoField.setStageState('hartmann', 'running')
+        gotoField.stageStartTimes['hartmann'] = self.now - 100
+        steps = dict((step.stage, step) for step in self.plan.steps(self.now))
+        self.assertEqual(steps['slew'].remaining, 0)
+        self.assertAlmostEqual(steps['hartmann'].remaining, 50)
+        self.assertEqual(steps['calibs'].remaining, 240)
+
+    def test_done_since_load(self):
+        self._load('eBOSS')
+        self.actorState.gotoField.setCommandState('running')
+        self.actorState.gotoField.setCommandState('done')
+        self.assertAlmostEqual(self.plan.etr(), 900 + 60)
+
+    def test_done_before_load(self):
+        self.actorState.gotoField.setCommandState('running')
+        self.actorState.gotoField.setCommandState('done')
+        self._load('eBOSS')
+        self.plan.loadTime = self.actorState.gotoField.endTime + 1
+        self.assertAlmostEqual(self.plan.etr(self.now), gotoFieldTime + 900 + 60)
+
+    def test_bypass_keeps_load_time(self):
+        self._load('eBOSS')
+        loadTime = self.plan.loadTime
+        self.sopCmd.updateCartridge(11, 'eBOSS', 'None', status=False, bypassed=True)
+        self.assertEqual(self.plan.loadTime, loadTime)
+
+    def test_update(self):
+        self._load('eBOSS')
+        self.plan.update(self.cmd, self.now)
+        self._check_cmd(0, 1, 0, 0, False)
+
+    def test_update_on_completion(self):
+        """The plan is output when a stage or command completes, not when it starts."""
+        self._load('eBOSS')
+        gotoField = self.actorState.gotoField
+        gotoField.setStageState('slew', 'running', genKeys=False)
+        gotoField.setCommandState('running', genKeys=False)
+        self._check_cmd(0, 0, 0, 0, False)
+        gotoField.setStageState('slew', 'done', genKeys=False)
+        self._check_cmd(0, 1, 0, 0, False)
+        gotoField.setCommandState('done', genKeys=False)
+        self._check_cmd(0, 2, 0, 0, False)
+
+    def test_update_disabled(self):
+        self._load('eBOSS')
+        self.plan.enabled = False
+        self.plan.update(self.cmd, self.now)
+        self.plan.genKeys(self.cmd, self.now)
+        self._check_cmd(0, 0, 0, 0, False)
+
+    def test_genKeys(self):
+        self._load('eBOSS')
+        self.plan.genKeys(self.cmd, self.now)
+        self._check_cmd(0, 5 + 1 + 1, 0, 0, False)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+"""
+Test the retry policy in retry.py
+"""
+import unittest
+
+from sopActor.utils.retry import RetryPolicy, Rule
+
+
+class TestRetryPolicy(unittest.TestCase):
+
+    def setUp(self):
+        self.policy = RetryPolicy.from_items([('boss exposure*', '0'), ('mcp ff.*', '2 2'),
+                                              ('mcp *', '1')])
+
+    def test_from_items(self):
+        self.assertEqual(self.policy.rules[1], Rule('mcp', 'ff.*', 2, 2.))
+        self.assertEqual(self.policy.rules[2], Rule('mcp', '*', 1, 0.))
+
+    def test_lookup(self):
+        self.assertEqual(self.policy.lookup('mcp', 'ff.on').retries, 2)
+        self.assertEqual(self.policy.lookup('mcp', 'ffs.open').retries, 1)
+
+    def test_lookup_never(self):
+        self.assertIsNone(self.policy.lookup('boss', 'exposure science itime=900'))
+
+    def test_lookup_no_rule(self):
+        self.assertIsNone(self.policy.lookup('tcc', 'axis init'))
+        self.assertIsNone(RetryPolicy().lookup('mcp', 'ff.on'))
+
+    def test_delay(self):
+        rule = self.policy.rules[1]
+        self.assertEqual([RetryPolicy.delay(rule, i) for i in (1, 2, 3)], [2, 4, 8])
+
+
+if __name__ == '__main__':
+    unittest.main()
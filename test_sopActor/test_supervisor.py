@@ -0,0 +1,145 @@
+"""
+Test restarting single threads with the ThreadSupervisor.
+"""
+import threading
+import unittest
+
+import sopActor
+import sopActor.myGlobals as myGlobals
+import sopTester
+from sopActor import Msg
+from sopActor.bossThread import ExposureController
+
+
+class FAKE1():
+    pass
+
+
+class FAKE2():
+    pass
+
+
+handled = []
+
+
+def fake_main(actor, queues):
+    """Record the messages that this thread is sent, until told to exit."""
+    name = threading.current_thread().name
+    tid = [t for t in queues if name == queues[t].name][0]
+    while True:
+        msg = queues[tid].get()
+        if msg.type == Msg.EXIT:
+            return
+        handled.append((name, msg.type))
+
+
+class Handler(object):
+    handoverAttrs = ('ignoreBadAz', )
+
+    def __init__(self):
+        self.ignoreBadAz = False
+        self.other = False
+        self.running = False
+
+    @property
+    def busy(self):
+        return self.running
+
+
+class TestThreadSupervisor(sopTester.SopTester, unittest.TestCase):
+
+    def setUp(self):
+        self.verbose = True
+        super(TestThreadSupervisor, self).setUp()
+        del handled[:]
+        self.actorState.actor.threadList = [('fake1', FAKE1, fake_main),
+                                            ('fake2', FAKE2, fake_main)]
+        self.actorState.queues = {}
+        self.actorState.threads = {}
+        for tname, tid, target in self.actorState.actor.threadList:
+            self.actorState.queues[tid] = sopActor.Queue(tname, 0)
+            self.actorState.threads[tid] = threading.Thread(
+                target=target, name=tname, args=[self.actorState.actor, self.actorState.queues])
+            self.actorState.threads[tid].daemon = True
+            self.actorState.threads[tid].start()
+        self.supervisor = self.actorState.supervisor
+
+    def tearDown(self):
+        for queue in self.actorState.queues.values():
+            queue.put(Msg.EXIT, self.cmd)
+        for thread in self.actorState.threads.values():
+            thread.join(1)
+
+    def test_adopt(self):
+        old = self.supervisor.adopt('tcc', Handler())
+        old.ignoreBadAz = True
+        old.other = True
+        new = self.supervisor.adopt('tcc', Handler())
+        self.assertTrue(new.ignoreBadAz)
+        self.assertFalse(new.other)
+        self.assertIs(self.supervisor.handlers['tcc'], new)
+
+    def test_find(self):
+        self.assertEqual(self.supervisor.find('fake2'), [1])
+        self.assertEqual(self.supervisor.find('test_supervisor'), [0, 1])
+        self.assertEqual(self.supervisor.find('nonsense'), [])
+
+    def test_busy_handling(self):
+        self.actorState.queues[FAKE1].handling = sopActor.Msg(Msg.SLEW, self.cmd)
+        self.assertIn('SLEW', self.supervisor.busy('fake1', FAKE1))
+
+    def test_busy_handler(self):
+        handler = self.supervisor.adopt('fake1', Handler())
+        handler.running = True
+        self.assertIsNotNone(self.supervisor.busy('fake1', FAKE1))
+        handler.running = False
+        self.assertIsNone(self.supervisor.busy('fake1', FAKE1))
+
+    def test_busy_exposure_controller(self):
+        controller = self.supervisor.adopt(
+            'fake1', ExposureController(self.actorState, self.actorState.queues[FAKE1]))
+        self.assertIsNone(self.supervisor.busy('fake1', FAKE1))
+        controller.current = sopActor.Msg(Msg.EXPOSE, self.cmd, expTime=900)
+        self.assertIsNotNone(self.supervisor.busy('fake1', FAKE1))
+        controller.pending.append(sopActor.Msg(Msg.EXPOSE, self.cmd, expTime=900))
+        controller.current = None
+        self.assertIsNotNone(self.supervisor.busy('fake1', FAKE1))
+        controller.pending = []
+        self.assertIsNone(self.supervisor.busy('fake1', FAKE1))
+
+    def test_restart(self):
+        old = self.actorState.threads[FAKE1]
+        other = self.actorState.threads[FAKE2]
+        self.assertIsNone(self.supervisor.restart(self.cmd, 'fake1'))
+        self.assertFalse(old.is_alive())
+        self.assertTrue(self.actorState.threads[FAKE1].is_alive())
+        self.assertIsNot(self.actorState.threads[FAKE1], old)
+        self.assertIs(self.actorState.threads[FAKE2], other)
+        self._check_cmd(0, 1, 0, 0, False)
+
+    def test_restart_keeps_queue(self):
+        queue = self.actorState.queues[FAKE1]
+        self.assertIsNone(self.supervisor.restart(self.cmd, 'fake1'))
+        self.assertIs(self.actorState.queues[FAKE1], queue)
+        queue.put(Msg.STATUS, self.cmd)
+        self.actorState.queues[FAKE1].put(Msg.EXIT, self.cmd)
+        self.actorState.threads[FAKE1].join(1)
+        self.assertEqual(handled, [('fake1', Msg.STATUS)])
+
+    def test_restart_module(self):
+        self.assertIsNone(self.supervisor.restart(self.cmd, 'test_supervisor'))
+        self._check_cmd(0, 2, 0, 0, False)
+
+    def test_restart_busy(self):
+        old = self.actorState.threads[FAKE1]
+        self.supervisor.adopt('fake1', Handler()).running = True
+        self.assertIsNotNone(self.supervisor.restart(self.cmd, 'fake1'))
+        self.assertIs(self.actorState.threads[FAKE1], old)
+        self.assertTrue(old.is_alive())
+
+    def test_restart_unknown(self):
+        self.assertIsNotNone(self.supervisor.restart(self.cmd, 'nonsense'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,159 @@
+"""
+Test detecting and replacing dead and hung threads with the Watchdog.
+"""
+import threading
+import time
+import unittest
+
+import sopActor
+import sopActor.myGlobals as myGlobals
+import sopTester
+from sopActor import Msg
+
+
+class FAKE1():
+    pass
+
+
+class FAKE2():
+    pass
+
+
+unstick = threading.Event()
+handled = []
+
+
+def fake_main(actor, queues):
+    """Hang on SLEW until unstuck, die on AXIS_STOP, and record the other messages."""
+    name = threading.current_thread().name
+    tid = [t for t in queues if name == queues[t].name][0]
+    while True:
+        msg = queues[tid].get()
+        if msg.type == Msg.EXIT:
+            return
+        elif msg.type == Msg.SLEW:
+            unstick.wait(5)
+        elif msg.type == Msg.AXIS_STOP:
+            raise RuntimeError('fake thread died')
+        handled.append((name, msg.type))
+        if getattr(msg, 'replyQueue', None) is not None:
+            msg.replyQueue.put(Msg.REPLY, msg.cmd, success=True)
+
+
+class TestWatchdog(sopTester.SopTester, unittest.TestCase):
+
+    def setUp(self):
+        self.verbose = True
+        super(TestWatchdog, self).setUp()
+        del handled[:]
+        unstick.clear()
+        self.actorState.actor.threadList = [('fake1', FAKE1, fake_main),
+                                            ('fake2', FAKE2, fake_main)]
+        self.actorState.queues = {}
+        self.actorState.threads = {}
+        for tname, tid, target in self.actorState.actor.threadList:
+            self.actorState.queues[tid] = sopActor.Queue(tname, 0)
+            self.actorState.threads[tid] = threading.Thread(
+                target=target, name=tname, args=[self.actorState.actor, self.actorState.queues])
+            self.actorState.threads[tid].daemon = True
+            self.actorState.threads[tid].start()
+        self.watchdog = self.actorState.watchdog
+        self.watchdog.grace = 10
+        self.replyQueue = sopActor.Queue('(replyQueue)', 0)
+
+    def tearDown(self):
+        unstick.set()
+        for queue in self.actorState.queues.values():
+            queue.put(Msg.EXIT, self.cmd)
+        for thread in self.actorState.threads.values():
+            thread.join(1)
+
+    def _hang(self, tid=FAKE1, **kwargs):
+        """Send a message that hangs thread tid, and wait for it to be taken."""
+        queue = self.actorState.queues[tid]
+        queue.put(Msg.SLEW, self.cmd, replyQueue=self.replyQueue, **kwargs)
+        while queue.handling is None:
+            time.sleep(0.01)
+        return queue.handling
+
+    def test_expected_duration(self):
+        self.assertEqual(self.watchdog.expected_duration(Msg(Msg.SLEW, self.cmd)), 0)
+        msg = Msg(Msg.EXPOSE, self.cmd, duration=900)
+        self.assertEqual(self.watchdog.expected_duration(msg), 900)
+        msg = Msg(Msg.APOGEE_DITHER_SET, self.cmd, expTime=500, dithers='AB')
+        self.assertEqual(self.watchdog.expected_duration(msg), 1000)
+        self.assertEqual(self.watchdog.limit(msg), 2010)
+
+    def test_idle(self):
+        self.assertEqual(self.watchdog.check(), [])
+        self.assertEqual(self.watchdog.status('fake1', FAKE1)[0], 'idle')
+
+    def test_busy(self):
+        self._hang(duration=100)
+        self.assertEqual(self.watchdog.status('fake1', FAKE1)[0], 'busy')
+        self.assertEqual(self.watchdog.check(time.time() + 200), [])
+
+    def test_hung(self):
+        self._hang(duration=100)
+        state, msg, elapsed = self.watchdog.status('fake1', FAKE1, time.time() + 211)
+        self.assertEqual(state, 'hung')
+        self.assertEqual(msg.type, Msg.SLEW)
+        self.assertEqual(self.watchdog.check(time.time() + 211), ['fake1'])
+        self._check_cmd(0, 0, 1, 0, False)
+        self.assertEqual(self.actorState.metrics.count('watchdog.fake1.hung'), 1)
+
+    def test_hung_reported_once(self):
+        self._hang()
+        self.assertEqual(self.watchdog.check(time.time() + 20), ['fake1'])
+        self.assertEqual(self.watchdog.check(time.time() + 30), [])
+        self._check_cmd(0, 0, 1, 0, False)
+
+    def test_exempt(self):
+        self.watchdog.exempt = set(['fake1'])
+        self._hang()
+        self.assertEqual(self.watchdog.check(time.time() + 20), [])
+
+    def test_dead(self):
+        self.actorState.queues[FAKE2].put(Msg.AXIS_STOP, self.cmd)
+        self.actorState.threads[FAKE2].join(1)
+        self.assertEqual(self.watchdog.check(), ['fake2'])
+        self.assertEqual(self.watchdog.status('fake2', FAKE2)[0], 'dead')
+
+    def test_recover_hung(self):
+        self.watchdog.recover = True
+        old = self.actorState.threads[FAKE1]
+        self._hang()
+        self.assertEqual(self.watchdog.check(time.time() + 20), ['fake1'])
+        # the waiting command is failed at once
+        reply = self.replyQueue.get(timeout=1)
+        self.assertFalse(reply.success)
+        # and the new thread handles the next message.
+        new = self.actorState.threads[FAKE1]
+        self.assertIsNot(new, old)
+        self.actorState.queues[FAKE1].put(Msg.STATUS, self.cmd)
+        time.sleep(0.1)
+        self.assertEqual(handled, [('fake1', Msg.STATUS)])
+        # the old thread exits once it is unstuck, without taking a message.
+        unstick.set()
+        old.join(1)
+        self.assertFalse(old.is_alive())
+        self.assertTrue(new.is_alive())
+        self._check_cmd(0, 0, 2, 0, False)
+
+    def test_recover_dead(self):
+        self.watchdog.recover = True
+        self.actorState.queues[FAKE2].put(Msg.AXIS_STOP, self.cmd, replyQueue=self.replyQueue)
+        self.actorState.threads[FAKE2].join(1)
+        self.assertEqual(self.watchdog.check(), ['fake2'])
+        self.assertFalse(self.replyQueue.get(timeout=1).success)
+        self.assertTrue(self.actorState.threads[FAKE2].is_alive())
+        self.assertEqual(self.watchdog.check(), [])
+
+    def test_genKeys(self):
+        self._hang()
+        self.watchdog.genKeys(self.cmd)
+        self._check_cmd(0, 2, 0, 0, False)
+
+
+if __name__ == '__main__':
+    unittest.main()